@@ -0,0 +1,326 @@
+import asyncio
+import secrets
+import string
+import time
+from datetime import datetime, timezone
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+import httpx
+
+from config import config
+from background import spawn
+from http_clients import get_opencode_client
+from opencode_stream import event_bus, Subscription
+from sharding import cluster
+from dispatcher import QueueFull
+from chat_actions import chat_actions
+from metrics import AGENT_RUNS
+from db import AgentRun, create_agent_run, get_running_agent_runs, finish_agent_run
+
+
+Deliver = Callable[[int, str], Awaitable[None]]
+
+# Tolerated clock difference between this service and OpenCode when matching
+# a run recorded without a message ID to the user message it submitted
+CLOCK_SLACK_MS = 30_000
+
+# While a worker waits for a reply and the event stream is down, poll this often
+INLINE_POLL_INTERVAL = 2.0
+
+
+def _started_ms(run: AgentRun) -> float:
+    started = run.created_at
+    if isinstance(started, str):
+        started = datetime.strptime(started, "%Y-%m-%d %H:%M:%S").replace(tzinfo=timezone.utc)
+    return started.timestamp() * 1000
+
+
+_ID_CHARS = string.digits + string.ascii_letters
+_last_id_ms = 0
+_id_counter = 0
+
+
+def new_message_id() -> str:
+    """A message ID in OpenCode's ascending format, to submit a prompt under.
+
+    OpenCode sorts a session's messages by ID: 48 bits of
+    milliseconds * 0x1000 + counter in hex, then 14 random characters.
+    """
+    global _last_id_ms, _id_counter
+    now = int(time.time() * 1000)
+    if now != _last_id_ms:
+        _last_id_ms, _id_counter = now, 0
+    _id_counter += 1
+    value = (now * 0x1000 + _id_counter) & 0xFFFF_FFFF_FFFF
+    suffix = "".join(secrets.choice(_ID_CHARS) for _ in range(14))
+    return f"msg_{value:012x}{suffix}"
+
+
+def _error_message(error: dict) -> str:
+    return (error.get("data") or {}).get("message") or error.get("name") or "unknown error"
+
+
+def _user_message_index(messages: List[dict], message_id: Optional[str], since_ms: float) -> Optional[int]:
+    users = [i for i, m in enumerate(messages) if (m.get("info") or {}).get("role") == "user"]
+    if message_id is not None:
+        return next((i for i in users if messages[i]["info"].get("id") == message_id), None)
+    # Runs recorded before message IDs: the last user message, if it is recent enough
+    if not users:
+        return None
+    created = (messages[users[-1]]["info"].get("time") or {}).get("created", 0)
+    return users[-1] if created >= since_ms - CLOCK_SLACK_MS else None
+
+
+def run_outcome(
+    messages: List[dict], message_id: Optional[str], since_ms: float = 0
+) -> Optional[Tuple[str, Optional[str]]]:
+    """(reply text, error) of the prompt stored as `message_id`, or None while the agent works.
+
+    `messages` is OpenCode's GET /session/{id}/message list of
+    `{"info": ..., "parts": [...]}`. The reply is every assistant message
+    after that user message (up to the next one), finished once the final
+    one is completed. Runs without a message ID fall back to the last user
+    message sent around `since_ms`.
+    """
+    index = _user_message_index(messages, message_id, since_ms)
+    if index is None:
+        # Our prompt has not been stored yet
+        return None
+
+    replies = []
+    for message in messages[index + 1:]:
+        if (message.get("info") or {}).get("role") == "user":
+            break
+        replies.append(message)
+    if not replies:
+        return None
+    final = replies[-1].get("info") or {}
+    if final.get("role") != "assistant" or not (final.get("time") or {}).get("completed"):
+        return None
+
+    text = "\n".join(
+        part.get("text", "")
+        for message in replies
+        for part in message.get("parts") or []
+        if part.get("type") == "text" and part.get("text") and not part.get("synthetic")
+    )
+    error = final.get("error")
+    return text, _error_message(error) if error else None
+
+
+class AgentRunTracker:
+    """Prompts submitted with OpenCode's prompt_async, delivered to the chat when done.
+
+    A run is a row in `agent_runs` tied to the session it was sent to. The
+    worker that submitted it may wait a while for the reply (`wait()`);
+    after that nothing is held open: a listener on the shared event bus
+    notices the session going idle or failing, and every tracked run is
+    also polled each `poll_interval` seconds, and right after the event
+    stream reconnects, in case events were missed. Runs still busy after
+    `timeout` seconds are aborted. The chat shows "typing..." for as long
+    as its run is tracked.
+
+    With sharding, a replica tracks the runs of the chats it owns. At
+    most `max_running` of them at once (0 = unbounded): beyond that,
+    `submit()` raises QueueFull.
+    """
+
+    def __init__(self, poll_interval: float, timeout: float, max_running: int = 0):
+        self.poll_interval = poll_interval
+        self.timeout = timeout
+        self.max_running = max_running
+        self._submitting = 0
+        self._deliver: Optional[Deliver] = None
+        self._runs: Dict[str, AgentRun] = {}
+        self._subscriptions: Dict[int, Subscription] = {}
+        self._waiters: Dict[int, asyncio.Future] = {}
+        self._task: Optional[asyncio.Task] = None
+        self.delivered_late = 0
+
+    def start(self, deliver: Deliver):
+        """Track unfinished runs in the background; `deliver(chat_id, text)` sends late results."""
+        if not config.OPENCODE_ASYNC_RUNS:
+            return
+        self._deliver = deliver
+        event_bus.on_reconnect(self._resync)
+        self._task = asyncio.create_task(self._poll(), name="agent-runs-poll")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        for subscription in self._subscriptions.values():
+            subscription.cancel()
+        self._subscriptions.clear()
+
+    async def reload(self):
+        """Re-read unfinished runs, e.g. on startup or after a cluster rebalance."""
+        runs = await get_running_agent_runs()
+        keep = [run for run in runs if cluster.is_local(str(run.chat_id))]
+        keep += [run for run in self._runs.values() if run.id in self._waiters]
+        for run in list(self._runs.values()):
+            self._forget(run)
+        for run in keep:
+            self._track(run)
+        if self._runs:
+            print(f"[Runs] Tracking {len(self._runs)} unfinished agent run(s)")
+
+    async def submit(self, session_id: int, opencode_session_id: str, chat_id: int, text: str) -> AgentRun:
+        """Record a run and hand the prompt to OpenCode without waiting for the reply."""
+        if self.max_running and len(self._runs) + self._submitting >= self.max_running:
+            raise QueueFull("runs", self.max_running)
+        message_id = new_message_id()
+        self._submitting += 1
+        try:
+            run = await create_agent_run(session_id, opencode_session_id, chat_id, message_id)
+        finally:
+            self._submitting -= 1
+        self._track(run)
+        try:
+            response = await get_opencode_client().post(
+                f"/session/{opencode_session_id}/prompt_async",
+                json={"messageID": message_id, "parts": [{"type": "text", "text": text}]},
+                timeout=httpx.Timeout(config.OPENCODE_SESSION_TIMEOUT, connect=config.HTTP_CONNECT_TIMEOUT)
+            )
+            response.raise_for_status()
+        except Exception as e:
+            self._forget(run)
+            await finish_agent_run(run.id, "failed", str(e))
+            AGENT_RUNS.labels("rejected").inc()
+            raise
+        return run
+
+    async def wait(self, run: AgentRun, timeout: float) -> Optional[str]:
+        """The reply to `run` if it arrives within `timeout` seconds.
+
+        Returns None otherwise; the reply is then sent to the chat when the
+        agent finishes.
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._waiters[run.id] = future
+        deadline = loop.time() + timeout
+        try:
+            while not future.done():
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    return None
+                try:
+                    await asyncio.wait_for(asyncio.shield(future), min(remaining, INLINE_POLL_INTERVAL))
+                except asyncio.TimeoutError:
+                    if not event_bus.connected.is_set() and not future.done():
+                        await self._safely(run, self.check(run))
+            return future.result()
+        finally:
+            self._waiters.pop(run.id, None)
+
+    def _track(self, run: AgentRun):
+        previous = self._runs.get(run.opencode_session_id)
+        if previous is not None:
+            self._forget(previous)
+        self._runs[run.opencode_session_id] = run
+        chat_actions.hold(run.chat_id)
+        self._subscriptions[run.id] = event_bus.subscribe(
+            run.opencode_session_id, lambda event, run=run: self._on_event(run, event)
+        )
+
+    def _forget(self, run: AgentRun):
+        current = self._runs.get(run.opencode_session_id)
+        if current is not None and current.id == run.id:
+            del self._runs[run.opencode_session_id]
+        subscription = self._subscriptions.pop(run.id, None)
+        if subscription is not None:
+            subscription.cancel()
+            chat_actions.release(run.chat_id)
+
+    async def _finish(self, run: AgentRun, status: str, text: str, error: Optional[str] = None):
+        self._forget(run)
+        if not await finish_agent_run(run.id, status, error):
+            return  # Already finished, by another event or replica
+        AGENT_RUNS.labels(status).inc()
+        waiter = self._waiters.pop(run.id, None)
+        if waiter is not None and not waiter.done():
+            waiter.set_result(text)
+            return
+        self.delivered_late += 1
+        print(f"[Runs] Run {run.id} {status}, sending result to chat {run.chat_id}")
+        await self._deliver(run.chat_id, text)
+
+    async def check(self, run: AgentRun):
+        """Finish `run` if the agent is done with it, or abort it once it ran too long."""
+        response = await get_opencode_client().get(
+            f"/session/{run.opencode_session_id}/message",
+            timeout=httpx.Timeout(config.OPENCODE_SESSION_TIMEOUT, connect=config.HTTP_CONNECT_TIMEOUT)
+        )
+        response.raise_for_status()
+        started = _started_ms(run)
+        outcome = run_outcome(response.json(), run.message_id, started)
+
+        if outcome is not None:
+            text, error = outcome
+            if error:
+                await self._finish(run, "failed", f"The agent stopped with an error: {error}", error)
+            else:
+                await self._finish(run, "completed", text or "Request processed.")
+            return
+
+        if time.time() * 1000 - started > self.timeout * 1000:
+            try:
+                await get_opencode_client().post(f"/session/{run.opencode_session_id}/abort")
+            except Exception as e:
+                print(f"[Runs] Failed to abort session {run.opencode_session_id}: {e}")
+            await self._finish(
+                run, "failed",
+                f"The agent was stopped after {self.timeout / 3600:g}h without finishing.",
+                "timeout"
+            )
+
+    async def _safely(self, run: AgentRun, action: Awaitable):
+        try:
+            await action
+        except Exception as e:
+            print(f"[Runs] Failed to update run {run.id}: {e}")
+
+    async def _poll(self):
+        try:
+            await self.reload()
+        except Exception as e:
+            print(f"[Runs] Failed to load unfinished runs: {e}")
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            for run in list(self._runs.values()):
+                await self._safely(run, self.check(run))
+
+    def _resync(self):
+        """Check every run after an event stream gap: its completion may have been missed."""
+        for run in list(self._runs.values()):
+            spawn(self._safely(run, self.check(run)))
+
+    def _on_event(self, run: AgentRun, event: dict):
+        event_type = event.get("type")
+        props = event.get("properties") or {}
+        idle = event_type == "session.idle" or (
+            event_type == "session.status" and (props.get("status") or {}).get("type") == "idle"
+        )
+        if idle:
+            spawn(self._safely(run, self.check(run)))
+        elif event_type == "session.error":
+            error = _error_message(props.get("error") or {})
+            spawn(self._safely(
+                run, self._finish(run, "failed", f"The agent stopped with an error: {error}", error)
+            ))
+
+    def stats(self) -> dict:
+        return {
+            "enabled": config.OPENCODE_ASYNC_RUNS,
+            "tracked": len(self._runs),
+            "max_running": self.max_running,
+            "waiting_inline": len(self._waiters),
+            "delivered_late": self.delivered_late,
+        }
+
+
+agent_runs = AgentRunTracker(
+    config.AGENT_RUN_POLL_INTERVAL, config.AGENT_RUN_TIMEOUT, config.AGENT_RUN_MAX_RUNNING
+)
@@ -0,0 +1,19 @@
+import asyncio
+from typing import Coroutine, Optional, Set
+
+
+# The event loop only keeps weak references to tasks, so fire-and-forget
+# tasks are referenced here until they finish
+_tasks: Set[asyncio.Task] = set()
+
+
+def spawn(coro: Coroutine, name: Optional[str] = None) -> asyncio.Task:
+    """Run `coro` in the background without it being garbage-collected mid-flight."""
+    task = asyncio.create_task(coro, name=name)
+    _tasks.add(task)
+    task.add_done_callback(_tasks.discard)
+    return task
+
+
+def stats() -> dict:
+    return {"running": len(_tasks)}
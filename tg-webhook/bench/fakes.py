@@ -0,0 +1,237 @@
+import asyncio
+import itertools
+import json
+import random
+import socket
+import threading
+import time
+import uuid
+from collections import Counter
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+
+
+@dataclass
+class FakeBehavior:
+    """Latency and failure profile of a fake upstream."""
+    latency_ms: float = 0.0
+    jitter_ms: float = 0.0
+    error_rate: float = 0.0
+    rate_limit_rate: float = 0.0
+    retry_after: int = 1
+    seed: Optional[int] = None
+
+    def __post_init__(self):
+        self._random = random.Random(self.seed)
+
+    async def delay(self, scale: float = 1.0):
+        if self.latency_ms <= 0 and self.jitter_ms <= 0:
+            return
+        ms = max(0.0, self._random.gauss(self.latency_ms, self.jitter_ms)) * scale
+        await asyncio.sleep(ms / 1000)
+
+    def roll(self) -> Optional[int]:
+        """Status code to fail this call with (429 or 500), or None to succeed."""
+        value = self._random.random()
+        if value < self.rate_limit_rate:
+            return 429
+        if value < self.rate_limit_rate + self.error_rate:
+            return 500
+        return None
+
+
+class FakeServer:
+    """Runs an ASGI app with uvicorn on an ephemeral localhost port.
+
+    Each fake gets its own thread and event loop, so the service under test
+    talks to it over real HTTP without sharing its event loop.
+    """
+
+    def __init__(self, app: FastAPI):
+        self.app = app
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._sock.bind(("127.0.0.1", 0))
+        self.port = self._sock.getsockname()[1]
+        self._server = uvicorn.Server(uvicorn.Config(app, log_level="warning", lifespan="off"))
+        self._thread = threading.Thread(target=self._server.run, kwargs={"sockets": [self._sock]}, daemon=True)
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.port}"
+
+    def start(self):
+        self._thread.start()
+        deadline = time.monotonic() + 10
+        while not self._server.started:
+            if time.monotonic() > deadline:
+                raise RuntimeError("fake server did not start")
+            time.sleep(0.01)
+
+    def stop(self):
+        self._server.should_exit = True
+        self._thread.join(timeout=10)
+
+
+class FakeTelegram(FakeServer):
+    """Accepts any Bot API method under /bot<token>/<method>."""
+
+    def __init__(self, behavior: FakeBehavior):
+        self.behavior = behavior
+        self.calls: Counter = Counter()
+        self._message_ids = itertools.count(1)
+        app = FastAPI()
+        app.add_api_route("/bot{token}/{method}", self._handle, methods=["POST", "GET"])
+        super().__init__(app)
+
+    async def _handle(self, token: str, method: str, request: Request):
+        await request.body()
+        await self.behavior.delay()
+        status = self.behavior.roll()
+        self.calls[(method, status or 200)] += 1
+        if status == 429:
+            return JSONResponse({
+                "ok": False,
+                "error_code": 429,
+                "description": f"Too Many Requests: retry after {self.behavior.retry_after}",
+                "parameters": {"retry_after": self.behavior.retry_after},
+            }, status_code=429)
+        if status:
+            return JSONResponse({"ok": False, "error_code": status, "description": "Internal Server Error"}, status_code=status)
+        if method in ("sendMessage", "editMessageText", "sendDocument"):
+            return {"ok": True, "result": {"message_id": next(self._message_ids), "date": int(time.time())}}
+        return {"ok": True, "result": True}
+
+    def stats(self) -> dict:
+        return {f"{method} {status}": count for (method, status), count in sorted(self.calls.items())}
+
+
+class FakeOpenCode(FakeServer):
+    """Sessions, messages and the /event stream of an OpenCode server.
+
+    A message takes `latency_ms` to answer; while it runs, the assistant's
+    text is published on /event in a few growing parts, like the real
+    server does. Prompts sent to prompt_async are answered in the
+    background, stored for GET .../message and followed by session.idle.
+    """
+
+    def __init__(self, behavior: FakeBehavior, stream_parts: int = 3):
+        self.behavior = behavior
+        self.stream_parts = stream_parts
+        self.calls: Counter = Counter()
+        self._subscribers: List[asyncio.Queue] = []
+        self._messages: Dict[str, List[dict]] = {}
+        app = FastAPI()
+        app.add_api_route("/session", self._create_session, methods=["POST"])
+        app.add_api_route("/session/{session_id}", self._update_session, methods=["PATCH", "DELETE"])
+        app.add_api_route("/session/{session_id}/message", self._message, methods=["POST"])
+        app.add_api_route("/session/{session_id}/message", self._list_messages, methods=["GET"])
+        app.add_api_route("/session/{session_id}/prompt_async", self._prompt_async, methods=["POST"])
+        app.add_api_route("/session/{session_id}/abort", self._abort, methods=["POST"])
+        app.add_api_route("/event", self._events, methods=["GET"])
+        super().__init__(app)
+
+    def _fail(self, operation: str) -> Optional[JSONResponse]:
+        status = self.behavior.roll()
+        self.calls[(operation, status or 200)] += 1
+        if status:
+            return JSONResponse({"error": "fake failure"}, status_code=status)
+        return None
+
+    async def _create_session(self, request: Request):
+        await request.body()
+        await self.behavior.delay(scale=0.1)
+        return self._fail("create_session") or {"id": f"ses_{uuid.uuid4().hex[:12]}"}
+
+    async def _update_session(self, session_id: str, request: Request):
+        await request.body()
+        return self._fail(request.method.lower()) or True
+
+    def _store_prompt(self, session_id: str, body: dict) -> str:
+        prompt = " ".join(p.get("text", "") for p in body.get("parts", []))
+        self._messages.setdefault(session_id, []).append({
+            "info": {"id": body.get("messageID") or f"msg_{uuid.uuid4().hex[:12]}", "role": "user", "time": {"created": time.time() * 1000}},
+            "parts": [{"type": "text", "text": prompt}],
+        })
+        return prompt
+
+    async def _stream_reply(self, session_id: str, prompt: str) -> dict:
+        """Publish the reply in growing parts and return the finished assistant message."""
+        message_id = f"msg_{uuid.uuid4().hex[:12]}"
+        part_id = f"prt_{uuid.uuid4().hex[:12]}"
+        reply = f"Echo: {prompt}"
+        created = time.time() * 1000
+
+        self._publish({"type": "message.updated", "properties": {
+            "info": {"id": message_id, "sessionID": session_id, "role": "assistant"}
+        }})
+        for i in range(1, self.stream_parts + 1):
+            await self.behavior.delay(scale=1 / self.stream_parts)
+            self._publish({"type": "message.part.updated", "properties": {"part": {
+                "id": part_id, "messageID": message_id, "sessionID": session_id, "type": "text",
+                "text": reply[: len(reply) * i // self.stream_parts],
+            }}})
+        message = {
+            "info": {"id": message_id, "role": "assistant", "time": {"created": created, "completed": time.time() * 1000}},
+            "parts": [{"type": "text", "text": reply}],
+        }
+        self._messages.setdefault(session_id, []).append(message)
+        return message
+
+    async def _message(self, session_id: str, request: Request):
+        prompt = self._store_prompt(session_id, await request.json())
+        message = await self._stream_reply(session_id, prompt)
+        return self._fail("message") or message
+
+    async def _prompt_async(self, session_id: str, request: Request):
+        prompt = self._store_prompt(session_id, await request.json())
+        failure = self._fail("prompt_async")
+        if failure:
+            return failure
+        asyncio.create_task(self._answer_async(session_id, prompt))
+        return Response(status_code=204)
+
+    async def _answer_async(self, session_id: str, prompt: str):
+        message = await self._stream_reply(session_id, prompt)
+        status = self.behavior.roll()
+        self.calls[("message", status or 200)] += 1
+        if status:
+            error = {"name": "APIError", "data": {"message": "fake failure"}}
+            message["info"]["error"] = error
+            self._publish({"type": "session.error", "properties": {"sessionID": session_id, "error": error}})
+        self._publish({"type": "session.idle", "properties": {"sessionID": session_id}})
+
+    async def _list_messages(self, session_id: str):
+        self.calls[("list_messages", 200)] += 1
+        return self._messages.get(session_id, [])
+
+    async def _abort(self, session_id: str):
+        self.calls[("abort", 200)] += 1
+        return True
+
+    def _publish(self, event: dict):
+        for queue in self._subscribers:
+            queue.put_nowait(event)
+
+    async def _events(self, request: Request):
+        queue: asyncio.Queue = asyncio.Queue()
+        self._subscribers.append(queue)
+        self.calls[("event", 200)] += 1
+
+        async def stream():
+            try:
+                yield f"data: {json.dumps({'type': 'server.connected', 'properties': {}})}\n\n"
+                while True:
+                    event = await queue.get()
+                    yield f"data: {json.dumps(event)}\n\n"
+            finally:
+                self._subscribers.remove(queue)
+
+        return StreamingResponse(stream(), media_type="text/event-stream")
+
+    def stats(self) -> dict:
+        return {f"{operation} {status}": count for (operation, status), count in sorted(self.calls.items())}
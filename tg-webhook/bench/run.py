@@ -0,0 +1,341 @@
+"""Replay a synthetic update stream against webhook.app and report per-stage latency.
+
+Usage (from tg-webhook/):
+
+    python -m bench.run --users 50 --updates 500 --rate 100
+    python -m bench.run --save-baseline default
+    python -m bench.run --compare default --fail-on-regression
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from dataclasses import asdict
+from typing import Dict, List, Optional
+
+import httpx
+
+from bench.fakes import FakeBehavior, FakeOpenCode, FakeTelegram
+from bench.workload import Workload, build_updates
+
+
+BASELINE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines")
+
+
+def percentiles(values: List[float]) -> Dict[str, float]:
+    """Nearest-rank p50/p95/p99 (and max) of millisecond values."""
+    if not values:
+        return {"count": 0}
+    ordered = sorted(values)
+
+    def rank(p):
+        return ordered[min(len(ordered) - 1, max(0, int(round(p / 100 * len(ordered))) - 1))]
+
+    return {
+        "count": len(ordered),
+        "p50": round(rank(50), 3),
+        "p95": round(rank(95), 3),
+        "p99": round(rank(99), 3),
+        "max": round(ordered[-1], 3),
+    }
+
+
+def stage_latencies(trace_file: str) -> Dict[str, Dict[str, float]]:
+    """Per-span-name latency percentiles from the exported JSONL traces."""
+    samples = defaultdict(list)
+    if not os.path.exists(trace_file):
+        return {}
+    with open(trace_file, encoding="utf-8") as f:
+        for line in f:
+            trace = json.loads(line)
+            samples["update"].append(trace["duration_ms"])
+            for span in trace["spans"]:
+                samples[span["name"]].append(span["duration_ms"])
+    return {name: percentiles(values) for name, values in sorted(samples.items())}
+
+
+def db_latencies() -> Dict[str, Dict[str, float]]:
+    """Call count and mean latency of each db function, from the Prometheus histograms."""
+    from prometheus_client import REGISTRY
+
+    totals = defaultdict(dict)
+    for metric in REGISTRY.collect():
+        if metric.name != "tg_db_call_seconds":
+            continue
+        for sample in metric.samples:
+            if sample.name.endswith("_count"):
+                totals[sample.labels["function"]]["count"] = int(sample.value)
+            elif sample.name.endswith("_sum"):
+                totals[sample.labels["function"]]["sum"] = sample.value
+    return {
+        function: {"count": t["count"], "mean_ms": round(t["sum"] / t["count"] * 1000, 3)}
+        for function, t in sorted(totals.items())
+        if t.get("count")
+    }
+
+
+def jobs_finished(outcomes=("completed", "failed", "rejected")) -> int:
+    from prometheus_client import REGISTRY
+
+    return int(sum(
+        REGISTRY.get_sample_value("tg_jobs_total", {"outcome": outcome}) or 0
+        for outcome in outcomes
+    ))
+
+
+async def replay(app, schedule) -> Dict:
+    """POST every update to /webhook at its scheduled time; return ack latencies."""
+    acks: List[float] = []
+    statuses = defaultdict(int)
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        started = time.perf_counter()
+
+        async def deliver(at: float, update: dict):
+            delay = started + at - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            sent = time.perf_counter()
+            response = await client.post("/webhook", json=update)
+            acks.append((time.perf_counter() - sent) * 1000)
+            statuses[response.status_code] += 1
+
+        await asyncio.gather(*(deliver(at, update) for at, update in schedule))
+    return {"webhook_ack": percentiles(acks), "statuses": dict(statuses)}
+
+
+async def wait_for_jobs(expected: int, timeout: float) -> bool:
+    deadline = time.monotonic() + timeout
+    while jobs_finished() < expected:
+        if time.monotonic() > deadline:
+            return False
+        await asyncio.sleep(0.01)
+    return True
+
+
+async def run_bench(args, telegram: FakeTelegram, opencode: FakeOpenCode, trace_file: str) -> Dict:
+    import webhook
+
+    workload = Workload(
+        users=args.users, updates=args.updates, rate=args.rate, burst_size=args.burst_size,
+        command_ratio=args.command_ratio, project_ratio=args.project_ratio,
+        duplicate_ratio=args.duplicate_ratio, seed=args.seed,
+    )
+    schedule = build_updates(workload)
+    expected = len({update["update_id"] for _, update in schedule})
+
+    async with webhook.app.router.lifespan_context(webhook.app):
+        started = time.perf_counter()
+        ingress = await replay(webhook.app, schedule)
+        ingress_seconds = time.perf_counter() - started
+        finished = await wait_for_jobs(expected, args.timeout)
+        elapsed = time.perf_counter() - started
+        processed = jobs_finished(("completed", "failed"))
+        rejected = jobs_finished(("rejected",))
+
+    return {
+        "workload": asdict(workload),
+        "fakes": {"telegram": asdict(telegram.behavior), "opencode": asdict(opencode.behavior)},
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "db": args.db,
+        },
+        "results": {
+            "completed": finished,
+            "updates_processed": processed,
+            "updates_rejected": rejected,
+            "elapsed_s": round(elapsed, 3),
+            "ingress_rps": round(len(schedule) / ingress_seconds, 1) if ingress_seconds else None,
+            "throughput_ups": round(processed / elapsed, 1) if elapsed else None,
+            "webhook_statuses": ingress["statuses"],
+            "stages": {"webhook_ack": ingress["webhook_ack"], **stage_latencies(trace_file)},
+            "db": db_latencies(),
+            "upstream_calls": {"telegram": telegram.stats(), "opencode": opencode.stats()},
+        },
+    }
+
+
+def compare(current: Dict, baseline: Dict, tolerance: float, min_delta_ms: float) -> List[str]:
+    """Stages whose p95 got worse than the baseline by more than `tolerance`."""
+    regressions = []
+    old_stages = baseline["results"]["stages"]
+    for name, new in current["results"]["stages"].items():
+        old = old_stages.get(name)
+        if not old or not old.get("count") or not new.get("count"):
+            continue
+        if new["p95"] > old["p95"] * (1 + tolerance) and new["p95"] - old["p95"] > min_delta_ms:
+            regressions.append(f"{name}: p95 {old['p95']:.1f}ms -> {new['p95']:.1f}ms")
+    old_tp = baseline["results"].get("throughput_ups")
+    new_tp = current["results"].get("throughput_ups")
+    if old_tp and new_tp and new_tp < old_tp * (1 - tolerance):
+        regressions.append(f"throughput: {old_tp} -> {new_tp} updates/s")
+    return regressions
+
+
+def print_report(result: Dict, baseline: Optional[Dict] = None):
+    results = result["results"]
+    print(
+        f"\nProcessed {results['updates_processed']} update(s) in {results['elapsed_s']}s "
+        f"({results['throughput_ups']} updates/s, ingress {results['ingress_rps']} req/s)"
+        + ("" if results["completed"] else "  [TIMED OUT]")
+    )
+    old_stages = baseline["results"]["stages"] if baseline else {}
+    print(f"\n{'stage':<32}{'count':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    for name, s in results["stages"].items():
+        if not s.get("count"):
+            continue
+        line = f"{name:<32}{s['count']:>8}{s['p50']:>10.1f}{s['p95']:>10.1f}{s['p99']:>10.1f}{s['max']:>10.1f}"
+        old = old_stages.get(name)
+        if old and old.get("count") and old["p95"]:
+            line += f"   p95 {(s['p95'] - old['p95']) / old['p95'] * 100:+.0f}%"
+        print(line)
+    print(f"\n{'db function':<32}{'calls':>8}{'mean ms':>10}")
+    for name, s in results["db"].items():
+        print(f"{name:<32}{s['count']:>8}{s['mean_ms']:>10.3f}")
+    print("\nUpstream calls:", json.dumps(results["upstream_calls"]))
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    workload = parser.add_argument_group("workload")
+    workload.add_argument("--users", type=int, default=50)
+    workload.add_argument("--updates", type=int, default=500)
+    workload.add_argument("--rate", type=float, default=100.0, help="updates per second (0 = all at once)")
+    workload.add_argument("--burst-size", type=int, default=1)
+    workload.add_argument("--command-ratio", type=float, default=0.3)
+    workload.add_argument("--project-ratio", type=float, default=0.0, help="share of /newproject updates")
+    workload.add_argument("--duplicate-ratio", type=float, default=0.0, help="share of redelivered updates")
+    workload.add_argument("--seed", type=int, default=1)
+
+    fakes = parser.add_argument_group("fake upstreams")
+    fakes.add_argument("--tg-latency-ms", type=float, default=30.0)
+    fakes.add_argument("--tg-jitter-ms", type=float, default=10.0)
+    fakes.add_argument("--tg-error-rate", type=float, default=0.0)
+    fakes.add_argument("--tg-429-rate", type=float, default=0.0)
+    fakes.add_argument("--tg-retry-after", type=int, default=1)
+    fakes.add_argument("--oc-latency-ms", type=float, default=500.0)
+    fakes.add_argument("--oc-jitter-ms", type=float, default=150.0)
+    fakes.add_argument("--oc-error-rate", type=float, default=0.0)
+
+    run = parser.add_argument_group("run")
+    run.add_argument("--db", choices=["sqlite", "postgres"], default="sqlite", help="storage backend")
+    run.add_argument(
+        "--database-url",
+        help="Postgres DSN for --db postgres (default: a throwaway local server via the pgserver package)",
+    )
+    run.add_argument("--timeout", type=float, default=300.0, help="seconds to wait for the queue to drain")
+    run.add_argument("--env", action="append", default=[], metavar="KEY=VALUE", help="service config override")
+    run.add_argument("--output", help="write the full result JSON here")
+    run.add_argument("--save-baseline", metavar="NAME", help=f"save the result as {BASELINE_DIR}/NAME.json")
+    run.add_argument("--compare", metavar="NAME", help="compare against a saved baseline")
+    run.add_argument("--tolerance", type=float, default=0.2, help="allowed p95/throughput regression (fraction)")
+    run.add_argument("--min-delta-ms", type=float, default=2.0, help="ignore p95 changes smaller than this")
+    run.add_argument("--fail-on-regression", action="store_true")
+    return parser.parse_args(argv)
+
+
+def start_local_postgres(data_dir: str):
+    """Start a throwaway Postgres for the run. Returns (dsn, server)."""
+    try:
+        import pgserver
+    except ImportError:
+        raise SystemExit("--db postgres needs --database-url or the pgserver package (pip install pgserver)")
+    server = pgserver.get_server(os.path.join(data_dir, "pg"), cleanup_mode="delete")
+    return server.get_uri(), server
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    telegram = FakeTelegram(FakeBehavior(
+        latency_ms=args.tg_latency_ms, jitter_ms=args.tg_jitter_ms, error_rate=args.tg_error_rate,
+        rate_limit_rate=args.tg_429_rate, retry_after=args.tg_retry_after, seed=args.seed,
+    ))
+    opencode = FakeOpenCode(FakeBehavior(
+        latency_ms=args.oc_latency_ms, jitter_ms=args.oc_jitter_ms, error_rate=args.oc_error_rate, seed=args.seed,
+    ))
+    telegram.start()
+    opencode.start()
+
+    data_dir = tempfile.mkdtemp(prefix="tg-bench-")
+    trace_file = os.path.join(data_dir, "traces.jsonl")
+    # Must be set before the service modules read their config
+    os.environ.update({
+        "DATA_DIR": data_dir,
+        "TELEGRAM_BOT_TOKEN": "bench",
+        "TELEGRAM_API_URL": telegram.url,
+        "OPENCODE_URL": opencode.url,
+        "INGRESS_MODE": "webhook",
+        "ALLOW_ALL_USERS": "true",
+        "TRACE_EXPORTER": "jsonl",
+        "TRACE_FILE": trace_file,
+        "SLOW_UPDATE_THRESHOLD": "1e9",
+        "DB_BACKEND": args.db,
+    })
+    postgres = None
+    if args.db == "postgres":
+        dsn = args.database_url
+        if not dsn:
+            dsn, postgres = start_local_postgres(data_dir)
+        os.environ["DATABASE_URL"] = dsn
+    for name in ("GIT_AUTHOR_NAME", "GIT_COMMITTER_NAME"):
+        os.environ.setdefault(name, "bench")
+    for name in ("GIT_AUTHOR_EMAIL", "GIT_COMMITTER_EMAIL"):
+        os.environ.setdefault(name, "bench@localhost")
+    for override in args.env:
+        key, _, value = override.partition("=")
+        os.environ[key] = value
+
+    try:
+        result = asyncio.run(run_bench(args, telegram, opencode, trace_file))
+    finally:
+        telegram.stop()
+        opencode.stop()
+        if postgres is not None:
+            postgres.cleanup()
+
+    baseline = None
+    if args.compare:
+        with open(os.path.join(BASELINE_DIR, f"{args.compare}.json"), encoding="utf-8") as f:
+            baseline = json.load(f)
+        if (
+            baseline["workload"] != result["workload"]
+            or baseline["fakes"] != result["fakes"]
+            or baseline["environment"].get("db", "sqlite") != args.db
+        ):
+            print(f"[Bench] Warning: workload, fake settings or backend differ from baseline '{args.compare}'")
+
+    print_report(result, baseline)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2)
+    if args.save_baseline:
+        os.makedirs(BASELINE_DIR, exist_ok=True)
+        path = os.path.join(BASELINE_DIR, f"{args.save_baseline}.json")
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2)
+            f.write("\n")
+        print(f"\n[Bench] Baseline saved to {path}")
+
+    if baseline is not None:
+        regressions = compare(result, baseline, args.tolerance, args.min_delta_ms)
+        if regressions:
+            print("\n[Bench] Regressions against baseline:")
+            for regression in regressions:
+                print(f"  {regression}")
+            if args.fail_on_regression:
+                return 1
+        else:
+            print(f"\n[Bench] No regressions against baseline '{args.compare}'")
+    return 0 if result["results"]["completed"] else 2
+
+
+if __name__ == "__main__":
+    sys.exit(main())
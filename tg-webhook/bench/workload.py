@@ -0,0 +1,74 @@
+import random
+from dataclasses import dataclass
+from typing import List, Tuple
+
+
+COMMANDS = ["/start", "/help", "/projects", "/sessions", "/templates", "/newsession"]
+
+CHAT_LINES = [
+    "Add a health check endpoint",
+    "Why does the build fail on CI?",
+    "Write tests for the parser",
+    "Refactor the config loader",
+    "Explain what this repository does",
+    "Bump the dependencies and fix what breaks",
+]
+
+
+@dataclass
+class Workload:
+    """Shape of a synthetic update stream.
+
+    Updates arrive at `rate` per second (0 = all at once) in bursts of
+    `burst_size`. Each update comes from one of `users` private chats and is a
+    command with probability `command_ratio`, otherwise a chat message that
+    reaches OpenCode. `duplicate_ratio` of deliveries repeat an earlier
+    update_id, like Telegram redeliveries.
+    """
+    users: int = 50
+    updates: int = 500
+    rate: float = 100.0
+    burst_size: int = 1
+    command_ratio: float = 0.3
+    project_ratio: float = 0.0
+    duplicate_ratio: float = 0.0
+    seed: int = 1
+
+
+def build_updates(workload: Workload) -> List[Tuple[float, dict]]:
+    """Return (send_at_seconds, update) pairs in send order."""
+    rng = random.Random(workload.seed)
+    schedule = []
+    sent: List[dict] = []
+    update_id = 100000
+    burst_interval = workload.burst_size / workload.rate if workload.rate > 0 else 0.0
+
+    for i in range(workload.updates):
+        at = (i // workload.burst_size) * burst_interval
+        if sent and rng.random() < workload.duplicate_ratio:
+            schedule.append((at, rng.choice(sent)))
+            continue
+
+        user_id = 1000 + rng.randrange(workload.users)
+        roll = rng.random()
+        if roll < workload.project_ratio:
+            text = f"/newproject bench-{update_id} synthetic project"
+        elif roll < workload.project_ratio + workload.command_ratio:
+            text = rng.choice(COMMANDS)
+        else:
+            text = rng.choice(CHAT_LINES)
+
+        update_id += 1
+        update = {
+            "update_id": update_id,
+            "message": {
+                "message_id": update_id,
+                "date": 0,
+                "chat": {"id": user_id, "type": "private"},
+                "from": {"id": user_id, "is_bot": False, "first_name": f"User{user_id}", "username": f"user{user_id}"},
+                "text": text,
+            },
+        }
+        sent.append(update)
+        schedule.append((at, update))
+    return schedule
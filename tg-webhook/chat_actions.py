@@ -0,0 +1,182 @@
+import asyncio
+import math
+from contextlib import contextmanager
+from typing import Dict, Hashable, List, Optional
+
+from config import config
+from telegram_outbound import telegram_request, PRIORITY_TYPING
+
+
+class TimerWheel:
+    """Hashed timer wheel: timers hash into `slots` buckets of `tick` seconds.
+
+    Scheduling and cancelling are O(1), and each `advance()` only looks at
+    one bucket, so any number of timers share a single clock. Timers
+    further out than one turn of the wheel wait out the extra rounds in
+    their bucket.
+    """
+
+    def __init__(self, tick: float, slots: int):
+        self.tick = tick
+        self._slots: List[Dict[Hashable, int]] = [{} for _ in range(slots)]
+        self._where: Dict[Hashable, int] = {}
+        self._cursor = 0
+
+    def __len__(self) -> int:
+        return len(self._where)
+
+    def schedule(self, key: Hashable, delay: float):
+        """Fire `key` after `delay` seconds (rounded up to whole ticks), replacing its earlier timer."""
+        self.cancel(key)
+        ticks = max(1, math.ceil(delay / self.tick))
+        slot = (self._cursor + ticks) % len(self._slots)
+        self._slots[slot][key] = (ticks - 1) // len(self._slots)
+        self._where[key] = slot
+
+    def cancel(self, key: Hashable):
+        slot = self._where.pop(key, None)
+        if slot is not None:
+            del self._slots[slot][key]
+
+    def clear(self):
+        for bucket in self._slots:
+            bucket.clear()
+        self._where.clear()
+
+    def advance(self) -> List[Hashable]:
+        """Move one tick forward and return the keys that are due."""
+        self._cursor = (self._cursor + 1) % len(self._slots)
+        bucket = self._slots[self._cursor]
+        due = [key for key, rounds in bucket.items() if rounds == 0]
+        for key in due:
+            del bucket[key]
+            del self._where[key]
+        for key in bucket:
+            bucket[key] -= 1
+        return due
+
+
+class _Heartbeat:
+    __slots__ = ("chat_id", "action", "refs")
+
+    def __init__(self, chat_id: int, action: str):
+        self.chat_id = chat_id
+        self.action = action
+        self.refs = 1
+
+
+class ChatActionHeartbeat:
+    """Keeps a chat action ("typing...") visible while work for the chat is in flight.
+
+    Telegram clears a chat action after about five seconds, so it is re-sent
+    every `interval` seconds until the chat's last hold is released. All chats
+    share one timer wheel driven by a single task; due refreshes are queued
+    and sent by a fixed pool of `senders` through the outbound scheduler at
+    typing priority. A chat's next refresh is scheduled once the previous
+    one went out, so rate limits never pile up more than one per chat.
+    """
+
+    def __init__(self, interval: float, tick: float, senders: int):
+        self.interval = interval
+        self.senders = senders
+        self.wheel = TimerWheel(tick, max(1, math.ceil(interval / tick)))
+        self._active: Dict[int, _Heartbeat] = {}
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._wakeup = asyncio.Event()
+        self._tasks: List[asyncio.Task] = []
+        self.sent = 0
+        self.failed = 0
+
+    def hold(self, chat_id: int, action: str = "typing"):
+        """Show `action` in the chat until a matching `release()`; holds on one chat nest."""
+        heartbeat = self._active.get(chat_id)
+        if heartbeat is not None:
+            heartbeat.refs += 1
+            return
+        if not self._tasks:
+            self._tasks = [asyncio.create_task(self._tick(), name="chat-actions")]
+            self._tasks += [
+                asyncio.create_task(self._send(), name=f"chat-actions-send-{i}") for i in range(self.senders)
+            ]
+        heartbeat = self._active[chat_id] = _Heartbeat(chat_id, action)
+        self._queue.put_nowait(heartbeat)
+
+    def release(self, chat_id: int):
+        heartbeat = self._active.get(chat_id)
+        if heartbeat is None:
+            return
+        heartbeat.refs -= 1
+        if heartbeat.refs == 0:
+            del self._active[chat_id]
+            self.wheel.cancel(chat_id)
+
+    @contextmanager
+    def keep(self, chat_id: int, action: str = "typing"):
+        """Show `action` in the chat for the duration of the block."""
+        self.hold(chat_id, action)
+        try:
+            yield
+        finally:
+            self.release(chat_id)
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._active.clear()
+        self._queue = asyncio.Queue()
+        self.wheel.clear()
+
+    async def _tick(self):
+        loop = asyncio.get_running_loop()
+        next_tick = loop.time()
+        while True:
+            if not len(self.wheel):
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                next_tick = loop.time()
+            # Ticks are laid out on a fixed grid; after a stall they catch up one by one
+            next_tick += self.wheel.tick
+            await asyncio.sleep(max(0.0, next_tick - loop.time()))
+            for chat_id in self.wheel.advance():
+                heartbeat = self._active.get(chat_id)
+                if heartbeat is not None:
+                    self._queue.put_nowait(heartbeat)
+
+    async def _send(self):
+        while True:
+            heartbeat = await self._queue.get()
+            if self._active.get(heartbeat.chat_id) is not heartbeat:
+                continue  # Released while queued
+            status: Optional[int] = None
+            try:
+                response = await telegram_request(
+                    "sendChatAction",
+                    {"chat_id": heartbeat.chat_id, "action": heartbeat.action},
+                    PRIORITY_TYPING
+                )
+                status = response.status_code
+            except Exception as e:
+                print(f"[ChatActions] Failed to send {heartbeat.action} to chat {heartbeat.chat_id}: {e}")
+            if status == 200:
+                self.sent += 1
+            else:
+                self.failed += 1
+            if status in (400, 403):
+                continue  # Chat gone or bot blocked: no point refreshing
+            if self._active.get(heartbeat.chat_id) is heartbeat:
+                self.wheel.schedule(heartbeat.chat_id, self.interval)
+                self._wakeup.set()
+
+    def stats(self) -> dict:
+        return {
+            "active_chats": len(self._active),
+            "scheduled": len(self.wheel),
+            "queued": self._queue.qsize(),
+            "sent": self.sent,
+            "failed": self.failed,
+        }
+
+
+chat_actions = ChatActionHeartbeat(config.CHAT_ACTION_INTERVAL, config.CHAT_ACTION_TICK, config.CHAT_ACTION_SENDERS)
@@ -0,0 +1,137 @@
+import time
+from typing import Optional
+
+import httpx
+
+from config import config
+from metrics import BREAKER_STATE
+
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+# Errors that mean the upstream can't be reached. Read timeouts are not among
+# them: a blocking prompt sends no response until the agent has finished, so
+# a long agent turn times out against a healthy server.
+UPSTREAM_DOWN_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+
+
+class CircuitOpenError(httpx.TransportError):
+    """The upstream is considered down; the request was not sent."""
+
+
+class CircuitBreaker:
+    """Fails calls fast while an upstream keeps failing.
+
+    After `failure_threshold` consecutive failures (connect errors, pool
+    timeouts, 5xx) the circuit opens and calls raise CircuitOpenError
+    without touching the network. After `reset_timeout` seconds it goes
+    half-open: a single call is let through as a probe, and its outcome
+    closes the circuit or opens it for another `reset_timeout`.
+    """
+
+    def __init__(self, name: str, failure_threshold: int, reset_timeout: float):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probing = False
+        self.rejected = 0
+        self.trips = 0
+        BREAKER_STATE.labels(name).set(STATE_VALUES[CLOSED])
+
+    @property
+    def enabled(self) -> bool:
+        return self.failure_threshold > 0
+
+    def is_open(self) -> bool:
+        """True while calls are rejected without a probe being due."""
+        return self.state == OPEN and time.monotonic() - self.opened_at < self.reset_timeout
+
+    def before_call(self):
+        """Raise CircuitOpenError unless a call may go out now."""
+        if not self.enabled or self.state == CLOSED:
+            return
+        if self.state == OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+            self._set_state(HALF_OPEN)
+        if self.state == HALF_OPEN and not self.probing:
+            self.probing = True
+            return
+        self.rejected += 1
+        raise CircuitOpenError(f"{self.name} is unavailable (circuit {self.state})")
+
+    def record_success(self):
+        self.failures = 0
+        self.probing = False
+        if self.state != CLOSED:
+            print(f"[Breaker] {self.name} recovered, circuit closed")
+            self._set_state(CLOSED)
+
+    def record_failure(self):
+        self.failures += 1
+        self.probing = False
+        if self.state == HALF_OPEN or (self.state == CLOSED and self.failures >= self.failure_threshold):
+            self.trips += 1
+            self.opened_at = time.monotonic()
+            print(f"[Breaker] {self.name} failing ({self.failures} in a row), circuit open for {self.reset_timeout:g}s")
+            self._set_state(OPEN)
+
+    def record_cancelled(self):
+        """A call ended without an outcome; let the next one probe."""
+        self.probing = False
+
+    def _set_state(self, state: str):
+        self.state = state
+        BREAKER_STATE.labels(self.name).set(STATE_VALUES[state])
+
+    def retry_after(self) -> Optional[float]:
+        """Seconds until the next probe is allowed, None while closed."""
+        if self.state == CLOSED:
+            return None
+        return max(0.0, self.opened_at + self.reset_timeout - time.monotonic())
+
+    def stats(self) -> dict:
+        retry_after = self.retry_after()
+        return {
+            "state": self.state,
+            "consecutive_failures": self.failures,
+            "trips": self.trips,
+            "rejected": self.rejected,
+            "retry_after": round(retry_after, 1) if retry_after is not None else None,
+        }
+
+
+class BreakerTransport(httpx.AsyncBaseTransport):
+    """httpx transport that routes every request through a CircuitBreaker."""
+
+    def __init__(self, transport: httpx.AsyncBaseTransport, breaker: CircuitBreaker):
+        self._transport = transport
+        self.breaker = breaker
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        self.breaker.before_call()
+        try:
+            response = await self._transport.handle_async_request(request)
+        except UPSTREAM_DOWN_ERRORS:
+            self.breaker.record_failure()
+            raise
+        except BaseException:
+            # Read timeouts, dropped streams, cancellation: no verdict on the upstream
+            self.breaker.record_cancelled()
+            raise
+        if response.status_code >= 500:
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+        return response
+
+    async def aclose(self):
+        await self._transport.aclose()
+
+
+opencode_breaker = CircuitBreaker("opencode", config.OPENCODE_BREAKER_THRESHOLD, config.OPENCODE_BREAKER_RESET)
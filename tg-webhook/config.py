@@ -1,4 +1,5 @@
 import os
+import socket
 from typing import List
 
 
@@ -11,9 +12,148 @@ class Config:
     # OpenCode server
     OPENCODE_URL: str = os.getenv("OPENCODE_URL", "http://opencode-server:4000")
 
+    # Ingress: "webhook" (Telegram POSTs to /webhook) or "polling" (long-poll getUpdates)
+    INGRESS_MODE: str = os.getenv("INGRESS_MODE", "webhook").lower()
+    POLLING_TIMEOUT: int = int(os.getenv("POLLING_TIMEOUT", "50"))
+    POLLING_BATCH_SIZE: int = int(os.getenv("POLLING_BATCH_SIZE", "100"))
+
+    # Outbound HTTP clients (one pooled client per upstream)
+    TELEGRAM_API_URL: str = os.getenv("TELEGRAM_API_URL", "https://api.telegram.org")
+    TELEGRAM_HTTP2: bool = os.getenv("TELEGRAM_HTTP2", "false").lower() == "true"
+    TELEGRAM_MAX_CONNECTIONS: int = int(os.getenv("TELEGRAM_MAX_CONNECTIONS", "20"))
+    TELEGRAM_MAX_KEEPALIVE: int = int(os.getenv("TELEGRAM_MAX_KEEPALIVE", "10"))
+    TELEGRAM_TIMEOUT: float = float(os.getenv("TELEGRAM_TIMEOUT", "15"))
+    # Outbound Telegram rate limits (token buckets)
+    TELEGRAM_GLOBAL_RATE: float = float(os.getenv("TELEGRAM_GLOBAL_RATE", "30"))
+    TELEGRAM_CHAT_RATE: float = float(os.getenv("TELEGRAM_CHAT_RATE", "1"))
+    TELEGRAM_GROUP_RATE_PER_MIN: float = float(os.getenv("TELEGRAM_GROUP_RATE_PER_MIN", "20"))
+    TELEGRAM_CHAT_BURST: float = float(os.getenv("TELEGRAM_CHAT_BURST", "3"))
+    TELEGRAM_MAX_CHAT_BUCKETS: int = int(os.getenv("TELEGRAM_MAX_CHAT_BUCKETS", "10000"))
+    TELEGRAM_MAX_RETRIES: int = int(os.getenv("TELEGRAM_MAX_RETRIES", "3"))
+    # Chat actions ("typing...") are refreshed while a reply is in flight
+    CHAT_ACTION_INTERVAL: float = float(os.getenv("CHAT_ACTION_INTERVAL", "4"))
+    CHAT_ACTION_TICK: float = float(os.getenv("CHAT_ACTION_TICK", "0.5"))
+    CHAT_ACTION_SENDERS: int = int(os.getenv("CHAT_ACTION_SENDERS", "4"))
+
+    OPENCODE_MAX_CONNECTIONS: int = int(os.getenv("OPENCODE_MAX_CONNECTIONS", "50"))
+    OPENCODE_MAX_KEEPALIVE: int = int(os.getenv("OPENCODE_MAX_KEEPALIVE", "20"))
+    OPENCODE_SESSION_TIMEOUT: float = float(os.getenv("OPENCODE_SESSION_TIMEOUT", "30"))
+    OPENCODE_MESSAGE_TIMEOUT: float = float(os.getenv("OPENCODE_MESSAGE_TIMEOUT", "300"))
+    # Submit prompts with prompt_async: wait OPENCODE_MESSAGE_TIMEOUT for the reply,
+    # then deliver it to the chat whenever the agent finishes (up to AGENT_RUN_TIMEOUT)
+    OPENCODE_ASYNC_RUNS: bool = os.getenv("OPENCODE_ASYNC_RUNS", "true").lower() == "true"
+    AGENT_RUN_POLL_INTERVAL: float = float(os.getenv("AGENT_RUN_POLL_INTERVAL", "60"))
+    AGENT_RUN_TIMEOUT: float = float(os.getenv("AGENT_RUN_TIMEOUT", "28800"))
+    # Background runs one replica tracks at once; beyond that new prompts get a
+    # "busy" reply (0 = unbounded)
+    AGENT_RUN_MAX_RUNNING: int = int(os.getenv("AGENT_RUN_MAX_RUNNING", "16"))
+    # Shared OpenCode event stream: reconnect backoff cap, and how many unanswered
+    # agent questions / permission requests are kept for their inline buttons
+    OPENCODE_EVENTS_MAX_BACKOFF: float = float(os.getenv("OPENCODE_EVENTS_MAX_BACKOFF", "30"))
+    DECISION_MAX_PENDING: int = int(os.getenv("DECISION_MAX_PENDING", "1000"))
+    HTTP_CONNECT_TIMEOUT: float = float(os.getenv("HTTP_CONNECT_TIMEOUT", "5"))
+    HTTP_KEEPALIVE_EXPIRY: float = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "60"))
+
+    # Pre-warmed OpenCode sessions (SESSION_POOL_SIZE=0 disables the pool)
+    SESSION_POOL_SIZE: int = int(os.getenv("SESSION_POOL_SIZE", "2"))
+    SESSION_POOL_TTL: float = float(os.getenv("SESSION_POOL_TTL", "1800"))
+    SESSION_POOL_MAX_DIRECTORIES: int = int(os.getenv("SESSION_POOL_MAX_DIRECTORIES", "50"))
+    SESSION_POOL_REFILL_INTERVAL: float = float(os.getenv("SESSION_POOL_REFILL_INTERVAL", "5"))
+
+    # Background update processing
+    JOB_MAX_IN_FLIGHT: int = int(os.getenv("JOB_MAX_IN_FLIGHT", "256"))
+    JOB_MAX_ATTEMPTS: int = int(os.getenv("JOB_MAX_ATTEMPTS", "5"))
+    JOB_BASE_BACKOFF: float = float(os.getenv("JOB_BASE_BACKOFF", "2"))
+    JOB_MAX_BACKOFF: float = float(os.getenv("JOB_MAX_BACKOFF", "300"))
+    JOB_POLL_INTERVAL: float = float(os.getenv("JOB_POLL_INTERVAL", "1"))
+    # Shared (postgres) database: requeue running jobs untouched for this long (seconds)
+    JOB_STALE_AFTER: float = float(os.getenv("JOB_STALE_AFTER", "900"))
+
+    # Sharding chats across replicas (needs DB_BACKEND=postgres). Peers are a
+    # static list of base URLs and/or the addresses behind a headless Service
+    CLUSTER_PEERS: str = os.getenv("CLUSTER_PEERS", "")
+    CLUSTER_PEERS_DNS: str = os.getenv("CLUSTER_PEERS_DNS", "")
+    CLUSTER_PORT: int = int(os.getenv("CLUSTER_PORT", "8000"))
+    CLUSTER_SELF_URL: str = os.getenv(
+        "CLUSTER_SELF_URL",
+        f"http://{os.getenv('POD_IP') or socket.gethostname()}:{os.getenv('CLUSTER_PORT', '8000')}"
+    )
+    CLUSTER_SLOTS: int = int(os.getenv("CLUSTER_SLOTS", "1024"))
+    CLUSTER_VNODES: int = int(os.getenv("CLUSTER_VNODES", "64"))
+    CLUSTER_REFRESH_INTERVAL: float = float(os.getenv("CLUSTER_REFRESH_INTERVAL", "10"))
+    CLUSTER_TOKEN: str = os.getenv("CLUSTER_TOKEN", "")
+
+    # Dispatcher: per-chat ordered lanes, bounded concurrency toward OpenCode
+    OPENCODE_MAX_CONCURRENCY: int = int(os.getenv("OPENCODE_MAX_CONCURRENCY", "8"))
+    # Admission control: requests allowed to wait for a slot, and messages queued
+    # per chat, before new ones are turned away with a "busy" reply
+    OPENCODE_MAX_QUEUED: int = int(os.getenv("OPENCODE_MAX_QUEUED", "32"))
+    # Seconds a request waits for a slot before it gets the "busy" reply (0 = no limit)
+    OPENCODE_SLOT_TIMEOUT: float = float(os.getenv("OPENCODE_SLOT_TIMEOUT", "120"))
+    CHAT_MAX_QUEUED: int = int(os.getenv("CHAT_MAX_QUEUED", "5"))
+    # Circuit breaker: open after this many consecutive OpenCode failures (0
+    # disables), then let one probe through every OPENCODE_BREAKER_RESET seconds
+    OPENCODE_BREAKER_THRESHOLD: int = int(os.getenv("OPENCODE_BREAKER_THRESHOLD", "5"))
+    OPENCODE_BREAKER_RESET: float = float(os.getenv("OPENCODE_BREAKER_RESET", "30"))
+
+    # /ready fails if a trivial database query takes longer than this (seconds)
+    READY_DB_TIMEOUT: float = float(os.getenv("READY_DB_TIMEOUT", "2"))
+
+    # Streaming replies: placeholder message edited in place as output arrives
+    STREAM_RESPONSES: bool = os.getenv("STREAM_RESPONSES", "true").lower() == "true"
+    STREAM_EDIT_INTERVAL: float = float(os.getenv("STREAM_EDIT_INTERVAL", "1.5"))
+    STREAM_PLACEHOLDER: str = os.getenv("STREAM_PLACEHOLDER", "Working on it...")
+
+    # Long replies: split into chunks, or upload as a document beyond the threshold
+    REPLY_CHUNK_SIZE: int = int(os.getenv("REPLY_CHUNK_SIZE", "4000"))
+    REPLY_DOCUMENT_THRESHOLD: int = int(os.getenv("REPLY_DOCUMENT_THRESHOLD", "16000"))
+    # Replies are rendered from Markdown to message entities, cached by content hash
+    MARKDOWN_CACHE_SIZE: int = int(os.getenv("MARKDOWN_CACHE_SIZE", "512"))
+
     # Persistence paths (on mounted PVC)
     DATA_DIR: str = os.getenv("DATA_DIR", "/data")
 
+    # Storage backend: "sqlite" (single replica, file under DATA_DIR) or
+    # "postgres" (shared database at DATABASE_URL, allows several replicas)
+    DB_BACKEND: str = os.getenv("DB_BACKEND", "sqlite").lower()
+    DATABASE_URL: str = os.getenv("DATABASE_URL", "")
+    DB_POOL_MIN_SIZE: int = int(os.getenv("DB_POOL_MIN_SIZE", "2"))
+    DB_POOL_MAX_SIZE: int = int(os.getenv("DB_POOL_MAX_SIZE", "10"))
+    DB_COMMAND_TIMEOUT: float = float(os.getenv("DB_COMMAND_TIMEOUT", "30"))
+
+    # SQLite connection pool
+    DB_READERS: int = int(os.getenv("DB_READERS", "4"))
+    DB_BUSY_TIMEOUT_MS: int = int(os.getenv("DB_BUSY_TIMEOUT_MS", "5000"))
+    DB_MMAP_SIZE: int = int(os.getenv("DB_MMAP_SIZE", str(64 * 1024 * 1024)))
+    # Prepared statements cached per connection (both backends)
+    DB_STATEMENT_CACHE: int = int(os.getenv("DB_STATEMENT_CACHE", "128"))
+
+    # In-memory cache of users on the webhook hot path
+    USER_CACHE_SIZE: int = int(os.getenv("USER_CACHE_SIZE", "10000"))
+    USER_CACHE_TTL: float = float(os.getenv("USER_CACHE_TTL", "300"))
+    SESSION_CACHE_SIZE: int = int(os.getenv("SESSION_CACHE_SIZE", "10000"))
+
+    # Write-behind flush interval for last_active_at / last_message_at (seconds)
+    ACTIVITY_FLUSH_INTERVAL: float = float(os.getenv("ACTIVITY_FLUSH_INTERVAL", "0.5"))
+
+    # Update deduplication by update_id
+    UPDATE_DEDUP_CACHE_SIZE: int = int(os.getenv("UPDATE_DEDUP_CACHE_SIZE", "10000"))
+    UPDATE_DEDUP_TTL_HOURS: float = float(os.getenv("UPDATE_DEDUP_TTL_HOURS", "48"))
+
+    # Per-update tracing: "none", "jsonl" (TRACE_FILE) or "otlp" (OTLP/HTTP collector)
+    TRACE_EXPORTER: str = os.getenv("TRACE_EXPORTER", "none").lower()
+    TRACE_OTLP_ENDPOINT: str = os.getenv("TRACE_OTLP_ENDPOINT", "http://otel-collector:4318")
+    TRACE_SERVICE_NAME: str = os.getenv("TRACE_SERVICE_NAME", "tg-webhook")
+    TRACE_FLUSH_INTERVAL: float = float(os.getenv("TRACE_FLUSH_INTERVAL", "5"))
+    TRACE_MAX_BUFFER: int = int(os.getenv("TRACE_MAX_BUFFER", "10000"))
+    # Updates slower than this (seconds, including queue wait) go to the slow log
+    SLOW_UPDATE_THRESHOLD: float = float(os.getenv("SLOW_UPDATE_THRESHOLD", "30"))
+
+    # Admin endpoints (/debug/*) are disabled unless a token is set
+    ADMIN_TOKEN: str = os.getenv("ADMIN_TOKEN", "")
+    PROFILE_SAMPLE_INTERVAL: float = float(os.getenv("PROFILE_SAMPLE_INTERVAL", "0.005"))
+    PROFILE_MAX_SECONDS: float = float(os.getenv("PROFILE_MAX_SECONDS", "60"))
+
     @property
     def DB_PATH(self) -> str:
         return os.path.join(self.DATA_DIR, "db", "swe-agents.db")
@@ -22,6 +162,28 @@ class Config:
     def PROJECTS_DIR(self) -> str:
         return os.path.join(self.DATA_DIR, "projects")
 
+    @property
+    def TRACE_FILE(self) -> str:
+        return os.getenv("TRACE_FILE", os.path.join(self.DATA_DIR, "traces", "traces.jsonl"))
+
+    @property
+    def SLOW_LOG_FILE(self) -> str:
+        return os.getenv("SLOW_LOG_FILE", os.path.join(self.DATA_DIR, "traces", "slow-updates.jsonl"))
+
+    # Pre-built template repos (cloned by /newproject --template)
+    @property
+    def TEMPLATES_DIR(self) -> str:
+        return os.path.join(self.PROJECTS_DIR, ".templates")
+
+    # Template sources shipped with the service, built into TEMPLATES_DIR on startup
+    TEMPLATE_SOURCES_DIR: str = os.getenv(
+        "TEMPLATE_SOURCES_DIR",
+        os.path.join(os.path.dirname(os.path.abspath(__file__)), "templates")
+    )
+
+    # Timeout for each git command while creating a project (seconds)
+    PROJECT_GIT_TIMEOUT: float = float(os.getenv("PROJECT_GIT_TIMEOUT", "30"))
+
     # Access control
     @property
     def WHITELIST_USER_IDS(self) -> List[int]:
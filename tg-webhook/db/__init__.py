@@ -1,5 +1,5 @@
 # Database module
-from .database import init_db, get_db
+from .database import init_db, close_db, get_db, ping_db
 from .users import (
     User,
     get_user_by_telegram_id,
@@ -7,6 +7,8 @@ from .users import (
     get_or_create_user,
     update_user_activity,
     set_user_whitelist,
+    prime_user_cache,
+    clear_user_cache,
 )
 from .sessions import (
     Session,
@@ -18,6 +20,9 @@ from .sessions import (
     update_session_title,
     deactivate_session,
     deactivate_all_user_sessions,
+    prime_active_sessions,
+    get_session_chats,
+    clear_session_cache,
 )
 from .projects import (
     Project,
@@ -27,12 +32,43 @@ from .projects import (
     create_project,
     update_project,
     delete_project,
+    list_project_templates,
+    ensure_project_templates,
+)
+from .jobs import (
+    Job,
+    enqueue_job,
+    claim_next_job,
+    complete_job,
+    retry_job,
+    fail_job,
+    touch_jobs,
+    requeue_running_jobs,
+    count_pending_jobs,
+)
+from .runs import (
+    AgentRun,
+    create_agent_run,
+    get_running_agent_runs,
+    get_running_agent_run,
+    finish_agent_run,
+    count_running_agent_runs,
+)
+from .updates import (
+    enqueue_update,
+    enqueue_updates,
+    get_polling_offset,
+    is_known_update,
+    prune_processed_updates,
+    dedup_stats,
 )
 
 __all__ = [
     # Database
     "init_db",
+    "close_db",
     "get_db",
+    "ping_db",
     # Users
     "User",
     "get_user_by_telegram_id",
@@ -40,6 +76,8 @@ __all__ = [
     "get_or_create_user",
     "update_user_activity",
     "set_user_whitelist",
+    "prime_user_cache",
+    "clear_user_cache",
     # Sessions
     "Session",
     "get_session_by_opencode_id",
@@ -50,6 +88,9 @@ __all__ = [
     "update_session_title",
     "deactivate_session",
     "deactivate_all_user_sessions",
+    "prime_active_sessions",
+    "get_session_chats",
+    "clear_session_cache",
     # Projects
     "Project",
     "get_project_by_id",
@@ -58,4 +99,30 @@ __all__ = [
     "create_project",
     "update_project",
     "delete_project",
+    "list_project_templates",
+    "ensure_project_templates",
+    # Jobs
+    "Job",
+    "enqueue_job",
+    "claim_next_job",
+    "complete_job",
+    "retry_job",
+    "fail_job",
+    "touch_jobs",
+    "requeue_running_jobs",
+    "count_pending_jobs",
+    # Agent runs
+    "AgentRun",
+    "create_agent_run",
+    "get_running_agent_runs",
+    "get_running_agent_run",
+    "finish_agent_run",
+    "count_running_agent_runs",
+    # Updates
+    "enqueue_update",
+    "enqueue_updates",
+    "get_polling_offset",
+    "is_known_update",
+    "prune_processed_updates",
+    "dedup_stats",
 ]
@@ -0,0 +1,103 @@
+import asyncio
+from typing import Dict, Optional, Tuple
+from .database import get_db, utc_timestamp
+
+import os
+import sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from config import config
+from metrics import timed_db
+
+
+class ActivityBuffer:
+    """Write-behind buffer for activity timestamps.
+
+    Touches are coalesced per user / session in memory and written in one
+    batched transaction every `interval` seconds (and on shutdown). A crash
+    loses at most one interval of timestamp updates.
+    """
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._users: Dict[int, Tuple[str, Optional[str], Optional[str], Optional[str]]] = {}
+        self._sessions: Dict[int, str] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def touch_user(
+        self,
+        telegram_id: int,
+        username: Optional[str] = None,
+        first_name: Optional[str] = None,
+        last_name: Optional[str] = None
+    ):
+        previous = self._users.get(telegram_id)
+        if previous:
+            # Keep the latest non-null info seen since the last flush
+            _, old_username, old_first, old_last = previous
+            username = username if username is not None else old_username
+            first_name = first_name if first_name is not None else old_first
+            last_name = last_name if last_name is not None else old_last
+        self._users[telegram_id] = (utc_timestamp(), username, first_name, last_name)
+        self._ensure_running()
+
+    def touch_session(self, session_id: int):
+        self._sessions[session_id] = utc_timestamp()
+        self._ensure_running()
+
+    def _ensure_running(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run(), name="activity-flush")
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                print(f"[DB] Activity flush failed: {e}")
+
+    @timed_db(name="flush_activity")
+    async def flush(self):
+        """Write all buffered timestamps in a single transaction."""
+        if not self._users and not self._sessions:
+            return
+        users, self._users = self._users, {}
+        sessions, self._sessions = self._sessions, {}
+        try:
+            async with get_db() as db:
+                if users:
+                    await db.executemany(
+                        """
+                        UPDATE users
+                        SET last_active_at = ?,
+                            username = COALESCE(?, username),
+                            first_name = COALESCE(?, first_name),
+                            last_name = COALESCE(?, last_name)
+                        WHERE telegram_id = ?
+                        """,
+                        [(ts, u, f, l, tid) for tid, (ts, u, f, l) in users.items()]
+                    )
+                if sessions:
+                    await db.executemany(
+                        "UPDATE sessions SET last_message_at = ? WHERE id = ?",
+                        [(ts, sid) for sid, ts in sessions.items()]
+                    )
+                await db.commit()
+        except Exception:
+            # Put the batch back (newer touches win) so the next flush retries it
+            for tid, value in users.items():
+                self._users.setdefault(tid, value)
+            for sid, ts in sessions.items():
+                self._sessions.setdefault(sid, ts)
+            raise
+
+    async def stop(self):
+        """Stop the flush loop and write whatever is still buffered."""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self.flush()
+
+
+activity = ActivityBuffer(config.ACTIVITY_FLUSH_INTERVAL)
@@ -1,73 +1,152 @@
 import os
-import aiosqlite
+import secrets
+from abc import ABC, abstractmethod
 from contextlib import asynccontextmanager
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Dict, Optional
 
 import sys
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from config import config
 
 
-SCHEMA = """
-CREATE TABLE IF NOT EXISTS users (
-    id INTEGER PRIMARY KEY AUTOINCREMENT,
-    telegram_id INTEGER UNIQUE NOT NULL,
-    username TEXT,
-    first_name TEXT,
-    last_name TEXT,
-    is_whitelisted BOOLEAN DEFAULT FALSE,
-    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-    last_active_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-);
-
-CREATE TABLE IF NOT EXISTS projects (
-    id INTEGER PRIMARY KEY AUTOINCREMENT,
-    user_id INTEGER NOT NULL,
-    name TEXT NOT NULL,
-    description TEXT,
-    path TEXT NOT NULL,
-    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-    FOREIGN KEY (user_id) REFERENCES users(id),
-    UNIQUE(user_id, name)
-);
-
-CREATE TABLE IF NOT EXISTS sessions (
-    id INTEGER PRIMARY KEY AUTOINCREMENT,
-    user_id INTEGER NOT NULL,
-    project_id INTEGER,
-    opencode_session_id TEXT UNIQUE NOT NULL,
-    title TEXT,
-    is_active BOOLEAN DEFAULT TRUE,
-    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-    last_message_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-    FOREIGN KEY (user_id) REFERENCES users(id),
-    FOREIGN KEY (project_id) REFERENCES projects(id)
-);
-
-CREATE INDEX IF NOT EXISTS idx_users_telegram_id ON users(telegram_id);
-CREATE INDEX IF NOT EXISTS idx_sessions_user_id ON sessions(user_id);
-CREATE INDEX IF NOT EXISTS idx_sessions_opencode_id ON sessions(opencode_session_id);
-CREATE INDEX IF NOT EXISTS idx_projects_user_id ON projects(user_id);
-"""
+class StorageBackend(ABC):
+    """Where the db package keeps its tables.
+
+    Query modules are written against the connection interface of
+    aiosqlite (`execute()` returning a cursor with `fetchone()`,
+    `fetchall()` and `rowcount`, `executemany()`, `commit()`), with `?`
+    placeholders and SQLite-compatible SQL. Inserts read generated ids
+    with RETURNING rather than `lastrowid`, and timestamps are UTC text
+    in SQLite's CURRENT_TIMESTAMP format. A backend provides connections
+    that honor that contract; one missing a method can't be constructed.
+    """
+
+    name = ""
+
+    @abstractmethod
+    async def open(self):
+        """Create or migrate the schema and open the connection pool."""
+
+    @abstractmethod
+    async def close(self):
+        """Close the connection pool."""
+
+    @abstractmethod
+    def connection(self, readonly: bool = False):
+        """Async context manager yielding a connection.
+
+        Writes are rolled back unless the block commits.
+        """
+
+
+_backend: Optional[StorageBackend] = None
+
+# Replicas sharing a Postgres database tell each other which cached rows
+# they changed on this channel (see announce_invalidation)
+INVALIDATION_CHANNEL = "tg_cache_invalidation"
+# Identifies this process's own announcements, which need no handling
+_PROCESS_TOKEN = secrets.token_hex(8)
+
+InvalidationHandler = Callable[[Optional[str]], None]
+_invalidation_handlers: Dict[str, InvalidationHandler] = {}
+
+
+def _create_backend() -> StorageBackend:
+    if config.DB_BACKEND == "postgres":
+        from .postgres_backend import PostgresBackend
+        return PostgresBackend(config.DATABASE_URL)
+    if config.DB_BACKEND == "sqlite":
+        from .sqlite_backend import SQLiteBackend
+        return SQLiteBackend(config.DB_PATH, config.DB_READERS)
+    raise ValueError(f"Unknown DB_BACKEND: {config.DB_BACKEND!r} (expected 'sqlite' or 'postgres')")
+
+
+def dialect() -> str:
+    """SQL dialect of the configured backend ("sqlite" or "postgres")."""
+    return config.DB_BACKEND
+
+
+def utc_timestamp(offset_seconds: float = 0) -> str:
+    """UTC time (plus an offset) in the same format as SQLite's CURRENT_TIMESTAMP."""
+    moment = datetime.now(timezone.utc) + timedelta(seconds=offset_seconds)
+    return moment.strftime("%Y-%m-%d %H:%M:%S")
 
 
 async def init_db():
-    """Initialize database and create tables if not exist."""
-    db_dir = os.path.dirname(config.DB_PATH)
-    os.makedirs(db_dir, exist_ok=True)
+    """Initialize the configured storage backend and open its connection pool."""
+    global _backend
+    if _backend is None:
+        backend = _create_backend()
+        await backend.open()
+        _backend = backend
 
-    async with aiosqlite.connect(config.DB_PATH) as db:
-        await db.executescript(SCHEMA)
-        await db.commit()
-    print(f"[DB] Database initialized at {config.DB_PATH}")
+
+async def close_db():
+    """Flush buffered activity timestamps and close the connection pool."""
+    global _backend
+    from .activity import activity
+    await activity.stop()
+    if _backend is not None:
+        await _backend.close()
+        _backend = None
 
 
 @asynccontextmanager
-async def get_db():
-    """Get database connection as async context manager."""
-    db = await aiosqlite.connect(config.DB_PATH)
-    db.row_factory = aiosqlite.Row
-    try:
+async def get_db(readonly: bool = False):
+    """Get database connection as async context manager.
+
+    Uses a pooled writer connection, or a reader connection when
+    `readonly` is set. Before `init_db()` a one-off SQLite connection is
+    opened.
+    """
+    if _backend is None:
+        if config.DB_BACKEND != "sqlite":
+            raise RuntimeError("Database is not initialized, call init_db() first")
+        from .sqlite_backend import connect_once
+        async with connect_once(config.DB_PATH) as db:
+            yield db
+        return
+
+    async with _backend.connection(readonly) as db:
         yield db
-    finally:
-        await db.close()
+
+
+async def ping_db():
+    """Run a trivial query; raises if the database can't be reached."""
+    async with get_db(readonly=True) as db:
+        cursor = await db.execute("SELECT 1")
+        await cursor.fetchone()
+
+
+def on_invalidate(kind: str, handler: InvalidationHandler):
+    """Call `handler(key)` when another replica changed cached `kind` rows for `key`.
+
+    The handler gets None when announcements may have been missed and
+    everything cached of that kind should be dropped.
+    """
+    _invalidation_handlers[kind] = handler
+
+
+async def announce_invalidation(db, kind: str, key) -> None:
+    """Have other replicas drop their cached `kind` rows for `key` once `db` commits.
+
+    Only Postgres is shared between processes; with SQLite this is a no-op.
+    """
+    if dialect() == "postgres":
+        await db.execute("SELECT pg_notify(?, ?)", (INVALIDATION_CHANNEL, f"{_PROCESS_TOKEN}:{kind}:{key}"))
+
+
+def handle_invalidation(payload: str) -> None:
+    """Apply an announcement received on INVALIDATION_CHANNEL."""
+    sender, _, rest = payload.partition(":")
+    kind, _, key = rest.partition(":")
+    handler = _invalidation_handlers.get(kind)
+    if sender != _PROCESS_TOKEN and handler is not None:
+        handler(key)
+
+
+def invalidate_all() -> None:
+    """Drop every cache that announcements keep in sync."""
+    for handler in _invalidation_handlers.values():
+        handler(None)
@@ -0,0 +1,234 @@
+import json
+from typing import Collection, Optional
+from dataclasses import dataclass
+from datetime import datetime
+from .database import get_db, dialect, utc_timestamp
+
+import os
+import sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from metrics import timed_db
+from sharding import chat_key, slot_for
+
+
+@dataclass
+class Job:
+    id: int
+    payload: dict
+    status: str
+    attempts: int
+    last_error: Optional[str]
+    created_at: datetime
+    next_run_at: datetime
+
+
+def _row_to_job(row) -> Job:
+    return Job(
+        id=row["id"],
+        payload=json.loads(row["payload"]),
+        status=row["status"],
+        attempts=row["attempts"],
+        last_error=row["last_error"],
+        created_at=row["created_at"],
+        next_run_at=row["next_run_at"]
+    )
+
+
+@timed_db
+async def enqueue_job(payload: dict) -> int:
+    """Persist a raw update for background processing. Returns the job ID."""
+    key = chat_key(payload)
+    async with get_db() as db:
+        cursor = await db.execute(
+            "INSERT INTO jobs (payload, chat_key, slot) VALUES (?, ?, ?) RETURNING id",
+            (json.dumps(payload), key, slot_for(key))
+        )
+        row = await cursor.fetchone()
+        await db.commit()
+        return row["id"]
+
+
+# A chat's oldest unfinished job holds back the ones after it, including
+# while it waits out a retry backoff, so a chat's updates run in order
+HEAD_OF_LINE = """
+                  AND NOT EXISTS (
+                      SELECT 1 FROM jobs AS earlier
+                      WHERE earlier.chat_key = jobs.chat_key AND earlier.id < jobs.id
+                        AND earlier.status IN ('pending', 'running')
+                  )"""
+
+_slot_filter_cache: tuple = (None, "", [])
+
+
+def _slot_filter(slots: Collection[int]) -> tuple:
+    """SQL condition and parameters restricting a claim to `slots` (cached per slot set)."""
+    global _slot_filter_cache
+    cached_slots, sql, params = _slot_filter_cache
+    if cached_slots is not slots:
+        params = sorted(slots)
+        # NULL-safe, so running jobs without a claimer (left by an older
+        # version) count as running elsewhere
+        distinct = "IS DISTINCT FROM" if dialect() == "postgres" else "IS NOT"
+        sql = f"""
+                  AND (slot IS NULL OR slot IN ({', '.join('?' * len(params))}))
+                  AND NOT EXISTS (
+                      SELECT 1 FROM jobs AS other
+                      WHERE other.chat_key = jobs.chat_key AND other.status = 'running'
+                        AND other.claimed_by {distinct} ?
+                  )"""
+        _slot_filter_cache = (slots, sql, params)
+    return sql, params
+
+
+CLAIM_SQL = """
+            UPDATE jobs
+            SET status = 'running', attempts = attempts + 1, updated_at = CURRENT_TIMESTAMP,
+                claimed_by = ?
+            WHERE {where}
+            RETURNING *
+            """
+
+DUE_SQL = "status = 'pending' AND next_run_at <= CURRENT_TIMESTAMP{conditions}"
+
+
+@timed_db
+async def claim_next_job(
+    slots: Optional[Collection[int]] = None,
+    claimer: Optional[str] = None
+) -> Optional[Job]:
+    """Atomically mark the oldest due pending job as running and return it.
+
+    A job is only claimed once every earlier job of its chat has finished,
+    so a job waiting to be retried keeps its chat's later updates waiting.
+    With `slots` (a sharded deployment), only jobs in those hash slots are
+    considered, and never one whose chat has a job still running on
+    another replica - so a chat handed over during a rebalance stays in
+    order.
+    """
+    conditions, params = HEAD_OF_LINE, []
+    if slots is not None:
+        if not slots:
+            return None
+        slot_conditions, params = _slot_filter(slots)
+        conditions += slot_conditions
+        params = params + [claimer]
+    due = DUE_SQL.format(conditions=conditions)
+    async with get_db() as db:
+        if dialect() == "postgres":
+            row = await _claim_shared(db, due, params, claimer)
+        else:
+            # SQLite has a single writer, so one statement is atomic
+            cursor = await db.execute(
+                CLAIM_SQL.format(where=f"id = (SELECT id FROM jobs WHERE {due} ORDER BY id LIMIT 1)"),
+                [claimer] + params
+            )
+            row = await cursor.fetchone()
+        await db.commit()
+        return _row_to_job(row) if row else None
+
+
+async def _claim_shared(db, due: str, params: list, claimer: Optional[str]):
+    """Claim on a Postgres database other replicas claim from concurrently.
+
+    Rows other replicas are claiming are skipped rather than waited for.
+    The candidate's chat is then locked for the rest of the transaction
+    and the claim re-checks its conditions, so two replicas can't both
+    start a job of one chat (e.g. while a rebalance moves it).
+    """
+    cursor = await db.execute(
+        f"SELECT id, chat_key FROM jobs WHERE {due} ORDER BY id LIMIT 1 FOR UPDATE SKIP LOCKED",
+        params
+    )
+    candidate = await cursor.fetchone()
+    if candidate is None:
+        return None
+    if candidate["chat_key"] is not None:
+        await db.execute("SELECT pg_advisory_xact_lock(hashtext(?))", (candidate["chat_key"],))
+    cursor = await db.execute(CLAIM_SQL.format(where=f"id = ? AND {due}"), [claimer, candidate["id"]] + params)
+    return await cursor.fetchone()
+
+
+@timed_db
+async def complete_job(job_id: int) -> None:
+    """Remove a successfully processed job."""
+    async with get_db() as db:
+        await db.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+        await db.commit()
+
+
+@timed_db
+async def retry_job(job_id: int, error: str, delay_seconds: float) -> None:
+    """Put a job back in the queue to run again after a delay."""
+    async with get_db() as db:
+        await db.execute(
+            """
+            UPDATE jobs
+            SET status = 'pending', last_error = ?, updated_at = CURRENT_TIMESTAMP,
+                next_run_at = ?
+            WHERE id = ?
+            """,
+            (error, utc_timestamp(delay_seconds), job_id)
+        )
+        await db.commit()
+
+
+@timed_db
+async def fail_job(job_id: int, error: str) -> None:
+    """Mark a job as permanently failed (kept for inspection)."""
+    async with get_db() as db:
+        await db.execute(
+            """
+            UPDATE jobs
+            SET status = 'failed', last_error = ?, updated_at = CURRENT_TIMESTAMP
+            WHERE id = ?
+            """,
+            (error, job_id)
+        )
+        await db.commit()
+
+
+@timed_db
+async def touch_jobs(job_ids: Collection[int]) -> None:
+    """Refresh `updated_at` of running jobs, so requeue_running_jobs sees them as alive."""
+    if not job_ids:
+        return
+    ids = sorted(job_ids)
+    async with get_db() as db:
+        await db.execute(
+            f"""
+            UPDATE jobs SET updated_at = CURRENT_TIMESTAMP
+            WHERE status = 'running' AND id IN ({', '.join('?' * len(ids))})
+            """,
+            ids
+        )
+        await db.commit()
+
+
+@timed_db
+async def requeue_running_jobs(stale_after: Optional[float] = None) -> int:
+    """Return jobs left 'running' by a previous process to the queue. Returns count.
+
+    With `stale_after`, only jobs not touched for that many seconds are
+    requeued, so jobs other replicas are still running (and touching with
+    touch_jobs) are left alone.
+    """
+    sql = "UPDATE jobs SET status = 'pending', updated_at = CURRENT_TIMESTAMP WHERE status = 'running'"
+    params = ()
+    if stale_after is not None:
+        sql += " AND updated_at < ?"
+        params = (utc_timestamp(-stale_after),)
+    async with get_db() as db:
+        cursor = await db.execute(sql, params)
+        await db.commit()
+        return cursor.rowcount
+
+
+@timed_db
+async def count_pending_jobs() -> int:
+    """Count jobs waiting to be processed."""
+    async with get_db(readonly=True) as db:
+        cursor = await db.execute(
+            "SELECT COUNT(*) FROM jobs WHERE status IN ('pending', 'running')"
+        )
+        row = await cursor.fetchone()
+        return row[0]
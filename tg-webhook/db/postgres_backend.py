@@ -0,0 +1,345 @@
+import asyncio
+import re
+from contextlib import asynccontextmanager
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import asyncpg
+
+from .database import StorageBackend, INVALIDATION_CHANNEL, handle_invalidation, invalidate_all
+
+import os
+import sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from config import config
+
+
+# Timestamps are stored as UTC text in SQLite's CURRENT_TIMESTAMP format, so
+# both backends return identical rows and compare timestamps the same way
+NOW_SQL = "to_char(timezone('UTC', now()), 'YYYY-MM-DD HH24:MI:SS')"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    id BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+    telegram_id BIGINT UNIQUE NOT NULL,
+    username TEXT,
+    first_name TEXT,
+    last_name TEXT,
+    is_whitelisted BOOLEAN DEFAULT FALSE,
+    created_at TEXT DEFAULT {now},
+    last_active_at TEXT DEFAULT {now}
+);
+
+CREATE TABLE IF NOT EXISTS projects (
+    id BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+    user_id BIGINT NOT NULL REFERENCES users(id),
+    name TEXT NOT NULL,
+    description TEXT,
+    path TEXT NOT NULL,
+    created_at TEXT DEFAULT {now},
+    updated_at TEXT DEFAULT {now},
+    UNIQUE(user_id, name)
+);
+
+CREATE TABLE IF NOT EXISTS sessions (
+    id BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+    user_id BIGINT NOT NULL REFERENCES users(id),
+    project_id BIGINT REFERENCES projects(id),
+    opencode_session_id TEXT UNIQUE NOT NULL,
+    title TEXT,
+    is_active BOOLEAN DEFAULT TRUE,
+    created_at TEXT DEFAULT {now},
+    last_message_at TEXT DEFAULT {now}
+);
+
+CREATE TABLE IF NOT EXISTS jobs (
+    id BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    last_error TEXT,
+    created_at TEXT DEFAULT {now},
+    updated_at TEXT DEFAULT {now},
+    next_run_at TEXT DEFAULT {now}
+);
+
+CREATE TABLE IF NOT EXISTS processed_updates (
+    update_id BIGINT PRIMARY KEY,
+    received_at TEXT DEFAULT {now}
+);
+
+CREATE TABLE IF NOT EXISTS agent_runs (
+    id BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+    session_id BIGINT NOT NULL REFERENCES sessions(id),
+    opencode_session_id TEXT NOT NULL,
+    chat_id BIGINT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'running',
+    error TEXT,
+    created_at TEXT DEFAULT {now},
+    updated_at TEXT DEFAULT {now},
+    finished_at TEXT
+);
+
+CREATE TABLE IF NOT EXISTS bot_state (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+
+CREATE INDEX IF NOT EXISTS idx_users_telegram_id ON users(telegram_id);
+CREATE INDEX IF NOT EXISTS idx_sessions_user_id ON sessions(user_id);
+CREATE INDEX IF NOT EXISTS idx_sessions_opencode_id ON sessions(opencode_session_id);
+CREATE INDEX IF NOT EXISTS idx_projects_user_id ON projects(user_id);
+CREATE INDEX IF NOT EXISTS idx_jobs_status_next_run ON jobs(status, next_run_at);
+CREATE INDEX IF NOT EXISTS idx_processed_updates_received_at ON processed_updates(received_at);
+CREATE INDEX IF NOT EXISTS idx_agent_runs_status ON agent_runs(status, opencode_session_id);
+CREATE INDEX IF NOT EXISTS idx_sessions_active_lookup ON sessions(
+    user_id, project_id, is_active, last_message_at DESC,
+    id, opencode_session_id, title, created_at
+);
+""".format(now=NOW_SQL)
+
+
+# Schema changes applied on top of SCHEMA, tracked in bot_state.schema_version.
+# Append only, like the SQLite MIGRATIONS.
+MIGRATIONS: List[str] = [
+    # Routing columns for sharding chats across replicas
+    """
+    ALTER TABLE jobs ADD COLUMN IF NOT EXISTS chat_key TEXT;
+    ALTER TABLE jobs ADD COLUMN IF NOT EXISTS slot INTEGER;
+    ALTER TABLE jobs ADD COLUMN IF NOT EXISTS claimed_by TEXT;
+    CREATE INDEX IF NOT EXISTS idx_jobs_chat_status ON jobs(chat_key, status);
+    """,
+    # At most one active session per user and project, so replicas racing to
+    # create one can't both succeed (create_session inserts ON CONFLICT DO NOTHING)
+    """
+    UPDATE sessions SET is_active = FALSE
+    WHERE is_active = TRUE AND EXISTS (
+        SELECT 1 FROM sessions AS newer
+        WHERE newer.user_id = sessions.user_id
+          AND COALESCE(newer.project_id, 0) = COALESCE(sessions.project_id, 0)
+          AND newer.is_active = TRUE
+          AND (newer.last_message_at > sessions.last_message_at
+               OR (newer.last_message_at = sessions.last_message_at AND newer.id > sessions.id))
+    );
+    CREATE UNIQUE INDEX IF NOT EXISTS idx_sessions_one_active
+        ON sessions(user_id, COALESCE(project_id, 0)) WHERE is_active = TRUE;
+    """,
+    # ID of the user message an agent run submitted, to find its reply
+    """
+    ALTER TABLE agent_runs ADD COLUMN IF NOT EXISTS message_id TEXT;
+    """,
+]
+
+# Serializes schema setup when several replicas start at once
+SCHEMA_LOCK_ID = 0x7467776268  # "tgwbh"
+
+_PLACEHOLDER = re.compile(r"'(?:[^']|'')*'|\?|\bCURRENT_TIMESTAMP\b")
+
+
+def translate(sql: str) -> Tuple[str, bool]:
+    """Rewrite SQLite-flavored SQL for Postgres.
+
+    `?` placeholders become `$1..$n` and CURRENT_TIMESTAMP becomes the
+    text timestamp used by the schema (string literals are left alone).
+    Also returns whether the statement produces rows.
+    """
+    counter = 0
+
+    def replace(match):
+        nonlocal counter
+        token = match.group(0)
+        if token == "?":
+            counter += 1
+            return f"${counter}"
+        if token == "CURRENT_TIMESTAMP":
+            return NOW_SQL
+        return token
+
+    translated = _PLACEHOLDER.sub(replace, sql)
+    head = sql.lstrip().upper()
+    returns_rows = head.startswith(("SELECT", "WITH")) or "RETURNING" in head
+    return translated, returns_rows
+
+
+class PostgresCursor:
+    """The part of the aiosqlite cursor interface the query modules use."""
+
+    def __init__(self, rows: List[asyncpg.Record], rowcount: int):
+        self._rows = rows
+        self._next = 0
+        self.rowcount = rowcount
+
+    async def fetchone(self) -> Optional[asyncpg.Record]:
+        if self._next >= len(self._rows):
+            return None
+        row = self._rows[self._next]
+        self._next += 1
+        return row
+
+    async def fetchall(self) -> List[asyncpg.Record]:
+        rows = self._rows[self._next:]
+        self._next = len(self._rows)
+        return rows
+
+
+def _status_rowcount(status: str) -> int:
+    # e.g. "UPDATE 3", "INSERT 0 1", "DELETE 0"
+    last = status.rsplit(" ", 1)[-1]
+    return int(last) if last.isdigit() else -1
+
+
+class PostgresConnection:
+    """Adapts a pooled asyncpg connection to the aiosqlite-style interface.
+
+    Writer connections open a transaction on the first statement, which
+    `commit()` ends, like sqlite3's implicit transactions. Statements go
+    through asyncpg's prepared statement cache.
+    """
+
+    _translations: Dict[str, Tuple[str, bool]] = {}
+
+    def __init__(self, conn: asyncpg.Connection, readonly: bool):
+        self._conn = conn
+        self._readonly = readonly
+        self._transaction: Optional[asyncpg.transaction.Transaction] = None
+
+    @property
+    def in_transaction(self) -> bool:
+        return self._transaction is not None
+
+    def _translate(self, sql: str) -> Tuple[str, bool]:
+        translated = self._translations.get(sql)
+        if translated is None:
+            translated = self._translations[sql] = translate(sql)
+        return translated
+
+    async def _begin(self):
+        if not self._readonly and self._transaction is None:
+            self._transaction = self._conn.transaction()
+            await self._transaction.start()
+
+    async def execute(self, sql: str, parameters: Sequence = ()) -> PostgresCursor:
+        query, returns_rows = self._translate(sql)
+        await self._begin()
+        if returns_rows:
+            rows = await self._conn.fetch(query, *parameters)
+            return PostgresCursor(rows, len(rows))
+        status = await self._conn.execute(query, *parameters)
+        return PostgresCursor([], _status_rowcount(status))
+
+    async def executemany(self, sql: str, parameters: Iterable[Sequence]):
+        query, _ = self._translate(sql)
+        await self._begin()
+        await self._conn.executemany(query, list(parameters))
+
+    async def commit(self):
+        if self._transaction is not None:
+            transaction, self._transaction = self._transaction, None
+            await transaction.commit()
+
+    async def rollback(self):
+        if self._transaction is not None:
+            transaction, self._transaction = self._transaction, None
+            await transaction.rollback()
+
+
+class PostgresBackend(StorageBackend):
+    """A shared Postgres database, so several webhook replicas can run at once."""
+
+    name = "postgres"
+
+    def __init__(self, dsn: str):
+        self.dsn = dsn
+        self.pool: Optional[asyncpg.Pool] = None
+        self._listener: Optional[asyncio.Task] = None
+
+    async def open(self):
+        if not self.dsn:
+            raise RuntimeError("DB_BACKEND=postgres requires DATABASE_URL")
+        self.pool = await asyncpg.create_pool(
+            self.dsn,
+            min_size=config.DB_POOL_MIN_SIZE,
+            max_size=config.DB_POOL_MAX_SIZE,
+            statement_cache_size=config.DB_STATEMENT_CACHE,
+            command_timeout=config.DB_COMMAND_TIMEOUT,
+        )
+        async with self.pool.acquire() as conn:
+            async with conn.transaction():
+                await conn.execute("SELECT pg_advisory_xact_lock($1)", SCHEMA_LOCK_ID)
+                await conn.execute(SCHEMA)
+                await self._migrate(conn)
+        connected = asyncio.get_running_loop().create_future()
+        self._listener = asyncio.create_task(self._listen(connected), name="db-invalidations")
+        await connected
+        print(
+            f"[DB] Postgres pool initialized ({config.DB_POOL_MIN_SIZE}-{config.DB_POOL_MAX_SIZE} connections)"
+        )
+
+    async def _listen(self, connected: asyncio.Future):
+        """Apply other replicas' cache invalidations, on a dedicated connection.
+
+        Announcements sent while the connection is down are lost, so all
+        synced caches are dropped whenever it (re)connects.
+        """
+        backoff = 1.0
+        while True:
+            conn = None
+            try:
+                conn = await asyncpg.connect(self.dsn)
+                lost = asyncio.Event()
+                conn.add_termination_listener(lambda _: lost.set())
+                await conn.add_listener(
+                    INVALIDATION_CHANNEL, lambda _conn, _pid, _channel, payload: handle_invalidation(payload)
+                )
+                invalidate_all()
+                if not connected.done():
+                    connected.set_result(None)
+                backoff = 1.0
+                await lost.wait()
+                print("[DB] Invalidation listener disconnected, reconnecting")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                if not connected.done():
+                    connected.set_exception(e)
+                    return
+                print(f"[DB] Invalidation listener failed, retrying in {backoff:.0f}s: {e}")
+            finally:
+                if conn is not None and not conn.is_closed():
+                    await conn.close()
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, 30.0)
+
+    async def _migrate(self, conn: asyncpg.Connection):
+        """Apply pending MIGRATIONS in order (called under the schema lock)."""
+        version = int(await conn.fetchval(
+            "SELECT value FROM bot_state WHERE key = 'schema_version'"
+        ) or 0)
+        for number, script in enumerate(MIGRATIONS[version:], start=version + 1):
+            await conn.execute(script)
+            await conn.execute(
+                """
+                INSERT INTO bot_state (key, value) VALUES ('schema_version', $1)
+                ON CONFLICT(key) DO UPDATE SET value = excluded.value
+                """,
+                str(number)
+            )
+            print(f"[DB] Applied migration {number}")
+
+    async def close(self):
+        if self._listener is not None:
+            self._listener.cancel()
+            await asyncio.gather(self._listener, return_exceptions=True)
+            self._listener = None
+        if self.pool is not None:
+            await self.pool.close()
+            self.pool = None
+
+    @asynccontextmanager
+    async def connection(self, readonly: bool = False):
+        async with self.pool.acquire() as conn:
+            db = PostgresConnection(conn, readonly)
+            try:
+                yield db
+            finally:
+                if db.in_transaction:
+                    await db.rollback()
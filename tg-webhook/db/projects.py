@@ -1,4 +1,8 @@
 import os
+import time
+import shutil
+import asyncio
+import hashlib
 import subprocess
 from typing import Optional, List
 from dataclasses import dataclass
@@ -8,6 +12,7 @@ from .database import get_db
 import sys
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from config import config
+from metrics import timed_db, PROJECT_SETUP_LATENCY
 
 
 @dataclass
@@ -21,9 +26,10 @@ class Project:
     updated_at: datetime
 
 
+@timed_db
 async def get_project_by_id(project_id: int) -> Optional[Project]:
     """Get project by ID."""
-    async with get_db() as db:
+    async with get_db(readonly=True) as db:
         cursor = await db.execute(
             "SELECT * FROM projects WHERE id = ?",
             (project_id,)
@@ -42,9 +48,10 @@ async def get_project_by_id(project_id: int) -> Optional[Project]:
         return None
 
 
+@timed_db
 async def get_project_by_name(user_id: int, name: str) -> Optional[Project]:
     """Get project by user and name."""
-    async with get_db() as db:
+    async with get_db(readonly=True) as db:
         cursor = await db.execute(
             "SELECT * FROM projects WHERE user_id = ? AND name = ?",
             (user_id, name)
@@ -63,9 +70,10 @@ async def get_project_by_name(user_id: int, name: str) -> Optional[Project]:
         return None
 
 
+@timed_db
 async def get_projects_for_user(user_id: int) -> List[Project]:
     """Get all projects for a user."""
-    async with get_db() as db:
+    async with get_db(readonly=True) as db:
         cursor = await db.execute(
             """
             SELECT * FROM projects
@@ -89,8 +97,32 @@ async def get_projects_for_user(user_id: int) -> List[Project]:
         ]
 
 
-def create_project_directory(user_id: int, project_name: str) -> str:
-    """Create project directory and initialize git repo. Returns the path."""
+async def run_git(args: List[str], cwd: str, timeout: float) -> None:
+    """Run a git command without blocking the event loop.
+
+    Raises CalledProcessError on non-zero exit, TimeoutError if it takes
+    longer than `timeout`. The process is killed on timeout or cancellation.
+    """
+    process = await asyncio.create_subprocess_exec(
+        "git", *args,
+        cwd=cwd,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE
+    )
+    try:
+        stdout, stderr = await asyncio.wait_for(process.communicate(), timeout=timeout)
+    except BaseException:
+        # Timeout or cancellation: don't leave a stray git process behind
+        if process.returncode is None:
+            process.kill()
+            await process.wait()
+        raise
+    if process.returncode != 0:
+        raise subprocess.CalledProcessError(process.returncode, ["git", *args], stdout, stderr)
+
+
+def _make_project_dir(user_id: int, project_name: str) -> str:
+    """Pick a free path for the project and create it. Blocking, run in a thread."""
     # Sanitize project name for filesystem
     safe_name = "".join(c for c in project_name if c.isalnum() or c in "-_").lower()
     if not safe_name:
@@ -108,59 +140,168 @@ def create_project_directory(user_id: int, project_name: str) -> str:
 
     # Create directory
     os.makedirs(project_path, exist_ok=True)
+    return project_path
 
-    # Initialize git repo
-    subprocess.run(
-        ["git", "init"],
-        cwd=project_path,
-        capture_output=True,
-        check=True
-    )
 
-    # Create initial README
+def _write_readme(project_path: str, project_name: str) -> None:
     readme_path = os.path.join(project_path, "README.md")
     with open(readme_path, "w") as f:
         f.write(f"# {project_name}\n\nProject created via Telegram bot.\n")
 
-    # Initial commit
-    subprocess.run(
-        ["git", "add", "."],
-        cwd=project_path,
-        capture_output=True,
-        check=True
-    )
-    subprocess.run(
-        ["git", "commit", "-m", "Initial commit"],
-        cwd=project_path,
-        capture_output=True,
-        check=True
+
+def _template_fingerprint(source: str) -> str:
+    """Hash of a template source tree, used to detect changes."""
+    digest = hashlib.sha256()
+    for root, dirs, files in os.walk(source):
+        dirs.sort()
+        for name in sorted(files):
+            path = os.path.join(root, name)
+            digest.update(os.path.relpath(path, source).encode())
+            with open(path, "rb") as f:
+                digest.update(f.read())
+    return digest.hexdigest()
+
+
+def list_project_templates() -> List[str]:
+    """Names of the templates available to /newproject --template."""
+    if not os.path.isdir(config.TEMPLATES_DIR):
+        return []
+    return sorted(
+        name for name in os.listdir(config.TEMPLATES_DIR)
+        if os.path.isdir(os.path.join(config.TEMPLATES_DIR, name, ".git"))
     )
 
+
+async def ensure_project_templates() -> None:
+    """Build a pre-committed git repo in TEMPLATES_DIR for every template source.
+
+    Repos are only rebuilt when their source changed, so startup is cheap.
+    Projects are later cloned from these repos with hardlinked objects.
+    """
+    if not os.path.isdir(config.TEMPLATE_SOURCES_DIR):
+        return
+    timeout = config.PROJECT_GIT_TIMEOUT
+    for name in sorted(os.listdir(config.TEMPLATE_SOURCES_DIR)):
+        source = os.path.join(config.TEMPLATE_SOURCES_DIR, name)
+        if not os.path.isdir(source):
+            continue
+        fingerprint = await asyncio.to_thread(_template_fingerprint, source)
+        target = os.path.join(config.TEMPLATES_DIR, name)
+        stamp = os.path.join(target, ".git", "template-fingerprint")
+        if os.path.exists(stamp):
+            with open(stamp) as f:
+                if f.read().strip() == fingerprint:
+                    continue
+
+        # Build next to the target and swap in, so clones never see a half-built repo
+        build_started = time.monotonic()
+        building = f"{target}.building"
+        await asyncio.to_thread(shutil.rmtree, building, True)
+        await asyncio.to_thread(shutil.copytree, source, building)
+        await run_git(["init"], building, timeout)
+        await run_git(["add", "."], building, timeout)
+        await run_git(["commit", "-m", f"Initial commit from {name} template"], building, timeout)
+        with open(os.path.join(building, ".git", "template-fingerprint"), "w") as f:
+            f.write(fingerprint)
+        await asyncio.to_thread(shutil.rmtree, target, True)
+        os.replace(building, target)
+        PROJECT_SETUP_LATENCY.labels("template_build").observe(time.monotonic() - build_started)
+        print(f"[Project] Built template '{name}' at {target}")
+
+
+async def create_project_directory(
+    user_id: int,
+    project_name: str,
+    template: Optional[str] = None
+) -> str:
+    """Create project directory and initialize git repo. Returns the path.
+
+    With `template`, the repo is a `git clone --local` of the pre-built
+    template repo (objects are hardlinked, so this is near-constant time).
+    Filesystem work runs in a thread and git runs as async subprocesses, so
+    a slow disk never stalls the event loop. A partially created directory
+    is removed if any stage fails, times out or is cancelled.
+    """
+    if template is not None and template not in list_project_templates():
+        available = ", ".join(list_project_templates()) or "none"
+        raise ValueError(f"Unknown template '{template}'. Available: {available}")
+
+    timeout = config.PROJECT_GIT_TIMEOUT
+    timings = {}
+    started = stage_start = time.monotonic()
+
+    def mark(stage: str):
+        nonlocal stage_start
+        now = time.monotonic()
+        timings[stage] = (now - stage_start) * 1000
+        PROJECT_SETUP_LATENCY.labels(stage).observe(now - stage_start)
+        stage_start = now
+
+    project_path = await asyncio.to_thread(_make_project_dir, user_id, project_name)
+    mark("mkdir")
+    try:
+        if template is not None:
+            # Clone into the (empty) project directory, sharing template objects
+            template_path = os.path.join(config.TEMPLATES_DIR, template)
+            await run_git(["clone", "--local", "--quiet", template_path, "."], project_path, timeout)
+            mark("git_clone")
+            await run_git(["remote", "remove", "origin"], project_path, timeout)
+            mark("git_remote")
+            return _report_created(project_path, started, timings)
+
+        # Initialize git repo
+        await run_git(["init"], project_path, timeout)
+        mark("git_init")
+
+        # Create initial README
+        await asyncio.to_thread(_write_readme, project_path, project_name)
+        mark("readme")
+
+        # Initial commit
+        await run_git(["add", "."], project_path, timeout)
+        mark("git_add")
+        await run_git(["commit", "-m", "Initial commit"], project_path, timeout)
+        mark("git_commit")
+    except BaseException:
+        await asyncio.shield(asyncio.to_thread(shutil.rmtree, project_path, True))
+        raise
+
+    return _report_created(project_path, started, timings)
+
+
+def _report_created(project_path: str, started: float, timings: dict) -> str:
+    stages = ", ".join(f"{name}={ms:.0f}ms" for name, ms in timings.items())
+    total = (time.monotonic() - started) * 1000
+    PROJECT_SETUP_LATENCY.labels("total").observe(total / 1000)
+    print(f"[Project] Created {project_path} in {total:.0f}ms ({stages})")
     return project_path
 
 
 async def create_project(
     user_id: int,
     name: str,
-    description: Optional[str] = None
+    description: Optional[str] = None,
+    template: Optional[str] = None
 ) -> Project:
-    """Create a new project with git repo."""
-    # Create directory and git repo
-    project_path = create_project_directory(user_id, name)
+    """Create a new project with git repo, optionally cloned from a template."""
+    # Create directory and git repo (timed in PROJECT_SETUP_LATENCY, not as a DB call)
+    project_path = await create_project_directory(user_id, name, template)
+    return await _insert_project(user_id, name, description, project_path)
 
+
+@timed_db(name="create_project")
+async def _insert_project(user_id: int, name: str, description: Optional[str], project_path: str) -> Project:
     async with get_db() as db:
         cursor = await db.execute(
             """
             INSERT INTO projects (user_id, name, description, path)
             VALUES (?, ?, ?, ?)
+            RETURNING *
             """,
             (user_id, name, description, project_path)
         )
-        await db.commit()
-        project_id = cursor.lastrowid
-
-        cursor = await db.execute("SELECT * FROM projects WHERE id = ?", (project_id,))
         row = await cursor.fetchone()
+        await db.commit()
         return Project(
             id=row["id"],
             user_id=row["user_id"],
@@ -172,6 +313,7 @@ async def create_project(
         )
 
 
+@timed_db
 async def update_project(
     project_id: int,
     name: Optional[str] = None,
@@ -192,6 +334,7 @@ async def update_project(
         await db.commit()
 
 
+@timed_db
 async def delete_project(project_id: int) -> bool:
     """Delete a project from database (does not delete files). Returns True if deleted."""
     async with get_db() as db:
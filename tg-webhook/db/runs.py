@@ -0,0 +1,117 @@
+from typing import List, Optional
+from dataclasses import dataclass
+from datetime import datetime
+from .database import get_db
+
+import os
+import sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from metrics import timed_db
+
+
+@dataclass
+class AgentRun:
+    id: int
+    session_id: int
+    opencode_session_id: str
+    chat_id: int
+    status: str
+    error: Optional[str]
+    created_at: datetime
+    updated_at: datetime
+    finished_at: Optional[datetime]
+    message_id: Optional[str] = None
+
+
+def _row_to_run(row) -> AgentRun:
+    return AgentRun(
+        id=row["id"],
+        session_id=row["session_id"],
+        opencode_session_id=row["opencode_session_id"],
+        chat_id=row["chat_id"],
+        status=row["status"],
+        error=row["error"],
+        created_at=row["created_at"],
+        updated_at=row["updated_at"],
+        finished_at=row["finished_at"],
+        message_id=row["message_id"]
+    )
+
+
+@timed_db
+async def create_agent_run(
+    session_id: int, opencode_session_id: str, chat_id: int, message_id: Optional[str] = None
+) -> AgentRun:
+    """Record a prompt submitted to OpenCode whose result is still to be delivered.
+
+    `message_id` is the ID the prompt was stored under in OpenCode.
+    """
+    async with get_db() as db:
+        cursor = await db.execute(
+            """
+            INSERT INTO agent_runs (session_id, opencode_session_id, chat_id, message_id)
+            VALUES (?, ?, ?, ?) RETURNING *
+            """,
+            (session_id, opencode_session_id, chat_id, message_id)
+        )
+        row = await cursor.fetchone()
+        await db.commit()
+        return _row_to_run(row)
+
+
+@timed_db
+async def get_running_agent_runs() -> List[AgentRun]:
+    """All runs whose result has not been delivered yet, oldest first."""
+    async with get_db(readonly=True) as db:
+        cursor = await db.execute(
+            "SELECT * FROM agent_runs WHERE status = 'running' ORDER BY id"
+        )
+        rows = await cursor.fetchall()
+        return [_row_to_run(row) for row in rows]
+
+
+@timed_db
+async def get_running_agent_run(opencode_session_id: str) -> Optional[AgentRun]:
+    """The undelivered run of an OpenCode session, if any."""
+    async with get_db(readonly=True) as db:
+        cursor = await db.execute(
+            """
+            SELECT * FROM agent_runs
+            WHERE opencode_session_id = ? AND status = 'running'
+            ORDER BY id DESC LIMIT 1
+            """,
+            (opencode_session_id,)
+        )
+        row = await cursor.fetchone()
+        return _row_to_run(row) if row else None
+
+
+@timed_db
+async def finish_agent_run(run_id: int, status: str, error: Optional[str] = None) -> bool:
+    """Move a running run to `status` ("completed" or "failed").
+
+    Returns False if it was already finished, so only one caller (or
+    replica) delivers its result.
+    """
+    async with get_db() as db:
+        cursor = await db.execute(
+            """
+            UPDATE agent_runs
+            SET status = ?, error = ?, updated_at = CURRENT_TIMESTAMP, finished_at = CURRENT_TIMESTAMP
+            WHERE id = ? AND status = 'running'
+            """,
+            (status, error, run_id)
+        )
+        await db.commit()
+        return cursor.rowcount == 1
+
+
+@timed_db
+async def count_running_agent_runs() -> int:
+    """Number of runs still waiting for their result."""
+    async with get_db(readonly=True) as db:
+        cursor = await db.execute(
+            "SELECT COUNT(*) FROM agent_runs WHERE status = 'running'"
+        )
+        row = await cursor.fetchone()
+        return row[0]
@@ -1,7 +1,15 @@
-from typing import Optional, List
+import os
+from typing import Dict, Optional, List
 from dataclasses import dataclass
 from datetime import datetime
-from .database import get_db
+from .database import get_db, announce_invalidation, on_invalidate
+from .activity import activity
+from .cache import LRUCache
+
+import sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from config import config
+from metrics import timed_db
 
 
 @dataclass
@@ -16,9 +24,10 @@ class Session:
     last_message_at: datetime
 
 
+@timed_db
 async def get_session_by_opencode_id(opencode_session_id: str) -> Optional[Session]:
     """Get session by OpenCode session ID."""
-    async with get_db() as db:
+    async with get_db(readonly=True) as db:
         cursor = await db.execute(
             "SELECT * FROM sessions WHERE opencode_session_id = ?",
             (opencode_session_id,)
@@ -38,45 +47,146 @@ async def get_session_by_opencode_id(opencode_session_id: str) -> Optional[Sessi
         return None
 
 
+# Write-through routing table: (user_id, project_id) -> active Session, or
+# _NO_SESSION when the database is known to have none. Kept in sync by
+# create_session and the deactivate_* functions.
+_NO_SESSION = object()
+_active_sessions = LRUCache(config.SESSION_CACHE_SIZE)
+
+
+def _forget_active_sessions(predicate) -> None:
+    for key, value in _active_sessions.items():
+        if predicate(key, value):
+            _active_sessions.pop(key)
+
+
+def _forget_user_sessions(user_id: Optional[str]) -> None:
+    """Another replica changed the sessions of `user_id` (None: of anyone)."""
+    if user_id is None:
+        _active_sessions.clear()
+    else:
+        _forget_active_sessions(lambda key, value: key[0] == int(user_id))
+
+
+on_invalidate("sessions", _forget_user_sessions)
+
+
+@timed_db
 async def get_active_session_for_user(user_id: int, project_id: Optional[int] = None) -> Optional[Session]:
     """Get the active session for a user, optionally for a specific project."""
-    async with get_db() as db:
-        if project_id is not None:
-            cursor = await db.execute(
-                """
-                SELECT * FROM sessions
-                WHERE user_id = ? AND project_id = ? AND is_active = TRUE
-                ORDER BY last_message_at DESC LIMIT 1
-                """,
-                (user_id, project_id)
-            )
-        else:
-            cursor = await db.execute(
-                """
-                SELECT * FROM sessions
-                WHERE user_id = ? AND project_id IS NULL AND is_active = TRUE
-                ORDER BY last_message_at DESC LIMIT 1
-                """,
-                (user_id,)
-            )
-        row = await cursor.fetchone()
-        if row:
-            return Session(
-                id=row["id"],
-                user_id=row["user_id"],
-                project_id=row["project_id"],
-                opencode_session_id=row["opencode_session_id"],
-                title=row["title"],
-                is_active=bool(row["is_active"]),
-                created_at=row["created_at"],
-                last_message_at=row["last_message_at"]
-            )
-        return None
+    cached = _active_sessions.get((user_id, project_id))
+    if cached is not None:
+        return None if cached is _NO_SESSION else cached
+
+    session = await _query_active_session(user_id, project_id)
+    _active_sessions.set((user_id, project_id), session if session else _NO_SESSION)
+    return session
+
+
+async def _query_active_session(user_id: int, project_id: Optional[int]) -> Optional[Session]:
+    async with get_db(readonly=True) as db:
+        return await _fetch_active_session(db, user_id, project_id)
+
+
+async def _fetch_active_session(db, user_id: int, project_id: Optional[int]) -> Optional[Session]:
+    if project_id is not None:
+        cursor = await db.execute(
+            """
+            SELECT * FROM sessions
+            WHERE user_id = ? AND project_id = ? AND is_active = TRUE
+            ORDER BY last_message_at DESC LIMIT 1
+            """,
+            (user_id, project_id)
+        )
+    else:
+        cursor = await db.execute(
+            """
+            SELECT * FROM sessions
+            WHERE user_id = ? AND project_id IS NULL AND is_active = TRUE
+            ORDER BY last_message_at DESC LIMIT 1
+            """,
+            (user_id,)
+        )
+    row = await cursor.fetchone()
+    if row:
+        return Session(
+            id=row["id"],
+            user_id=row["user_id"],
+            project_id=row["project_id"],
+            opencode_session_id=row["opencode_session_id"],
+            title=row["title"],
+            is_active=bool(row["is_active"]),
+            created_at=row["created_at"],
+            last_message_at=row["last_message_at"]
+        )
+    return None
+
+
+@timed_db
+async def get_session_chats() -> Dict[str, int]:
+    """Map OpenCode session IDs to the Telegram chat of their user.
+
+    Covers active sessions and any session with an unfinished agent run.
+    Sessions belong to users, so this is the user's private chat.
+    """
+    async with get_db(readonly=True) as db:
+        cursor = await db.execute(
+            """
+            SELECT s.opencode_session_id, u.telegram_id
+            FROM sessions AS s JOIN users AS u ON u.id = s.user_id
+            WHERE s.is_active = TRUE
+               OR s.id IN (SELECT session_id FROM agent_runs WHERE status = 'running')
+            """
+        )
+        rows = await cursor.fetchall()
+        return {row["opencode_session_id"]: row["telegram_id"] for row in rows}
+
 
+def clear_session_cache() -> None:
+    """Forget the cached routing table, e.g. after other replicas may have changed it."""
+    _active_sessions.clear()
 
+
+@timed_db
+async def prime_active_sessions(user_ids: List[int]) -> None:
+    """Resolve the active sessions of many users in one query into the routing table."""
+    ids = list(set(user_ids))
+    if not ids:
+        return
+    async with get_db(readonly=True) as db:
+        cursor = await db.execute(
+            f"""
+            SELECT * FROM sessions
+            WHERE user_id IN ({', '.join('?' * len(ids))}) AND is_active = TRUE
+            ORDER BY last_message_at DESC
+            """,
+            ids
+        )
+        rows = await cursor.fetchall()
+
+    found = {}
+    for row in rows:
+        # Rows are newest first, so the first one per key is the active session
+        found.setdefault((row["user_id"], row["project_id"]), Session(
+            id=row["id"],
+            user_id=row["user_id"],
+            project_id=row["project_id"],
+            opencode_session_id=row["opencode_session_id"],
+            title=row["title"],
+            is_active=bool(row["is_active"]),
+            created_at=row["created_at"],
+            last_message_at=row["last_message_at"]
+        ))
+    for user_id in ids:
+        found.setdefault((user_id, None), _NO_SESSION)
+    for key, session in found.items():
+        _active_sessions.set(key, session)
+
+
+@timed_db
 async def get_sessions_for_user(user_id: int, limit: int = 10) -> List[Session]:
     """Get all sessions for a user, ordered by most recent."""
-    async with get_db() as db:
+    async with get_db(readonly=True) as db:
         cursor = await db.execute(
             """
             SELECT * FROM sessions
@@ -102,68 +212,92 @@ async def get_sessions_for_user(user_id: int, limit: int = 10) -> List[Session]:
         ]
 
 
+@timed_db
 async def create_session(
     user_id: int,
     opencode_session_id: str,
     title: Optional[str] = None,
     project_id: Optional[int] = None
 ) -> Session:
-    """Create a new session."""
+    """Create a new active session.
+
+    A user has at most one active session per project (a unique index).
+    If one was created concurrently, e.g. by another replica, that session
+    is returned instead and the caller's OpenCode session is left unused.
+    """
     async with get_db() as db:
         cursor = await db.execute(
             """
             INSERT INTO sessions (user_id, project_id, opencode_session_id, title)
             VALUES (?, ?, ?, ?)
+            ON CONFLICT DO NOTHING
+            RETURNING *
             """,
             (user_id, project_id, opencode_session_id, title)
         )
-        await db.commit()
-        session_id = cursor.lastrowid
-
-        cursor = await db.execute("SELECT * FROM sessions WHERE id = ?", (session_id,))
         row = await cursor.fetchone()
-        return Session(
-            id=row["id"],
-            user_id=row["user_id"],
-            project_id=row["project_id"],
-            opencode_session_id=row["opencode_session_id"],
-            title=row["title"],
-            is_active=bool(row["is_active"]),
-            created_at=row["created_at"],
-            last_message_at=row["last_message_at"]
-        )
+        if row is None:
+            session = await _fetch_active_session(db, user_id, project_id)
+            if session is None:
+                raise ValueError(f"OpenCode session {opencode_session_id} is already recorded")
+        else:
+            session = Session(
+                id=row["id"],
+                user_id=row["user_id"],
+                project_id=row["project_id"],
+                opencode_session_id=row["opencode_session_id"],
+                title=row["title"],
+                is_active=bool(row["is_active"]),
+                created_at=row["created_at"],
+                last_message_at=row["last_message_at"]
+            )
+            await announce_invalidation(db, "sessions", user_id)
+        await db.commit()
+    # The newest session is the active one for its (user, project)
+    _active_sessions.set((user_id, project_id), session)
+    return session
 
 
+@timed_db
 async def update_session_activity(session_id: int) -> None:
-    """Update session's last message timestamp."""
-    async with get_db() as db:
-        await db.execute(
-            "UPDATE sessions SET last_message_at = CURRENT_TIMESTAMP WHERE id = ?",
-            (session_id,)
-        )
-        await db.commit()
+    """Update session's last message timestamp (buffered, written in batches)."""
+    activity.touch_session(session_id)
 
 
+@timed_db
 async def update_session_title(session_id: int, title: str) -> None:
     """Update session title."""
     async with get_db() as db:
-        await db.execute(
-            "UPDATE sessions SET title = ? WHERE id = ?",
+        cursor = await db.execute(
+            "UPDATE sessions SET title = ? WHERE id = ? RETURNING user_id",
             (title, session_id)
         )
+        row = await cursor.fetchone()
+        if row is not None:
+            await announce_invalidation(db, "sessions", row["user_id"])
         await db.commit()
+    for _, value in _active_sessions.items():
+        if value is not _NO_SESSION and value.id == session_id:
+            value.title = title
 
 
+@timed_db
 async def deactivate_session(session_id: int) -> None:
     """Mark a session as inactive."""
     async with get_db() as db:
-        await db.execute(
-            "UPDATE sessions SET is_active = FALSE WHERE id = ?",
+        cursor = await db.execute(
+            "UPDATE sessions SET is_active = FALSE WHERE id = ? RETURNING user_id",
             (session_id,)
         )
+        row = await cursor.fetchone()
+        if row is not None:
+            await announce_invalidation(db, "sessions", row["user_id"])
         await db.commit()
+    # Another active session may take its place, so re-resolve on next lookup
+    _forget_active_sessions(lambda key, value: value is not _NO_SESSION and value.id == session_id)
 
 
+@timed_db
 async def deactivate_all_user_sessions(user_id: int) -> None:
     """Deactivate all sessions for a user."""
     async with get_db() as db:
@@ -171,4 +305,6 @@ async def deactivate_all_user_sessions(user_id: int) -> None:
             "UPDATE sessions SET is_active = FALSE WHERE user_id = ?",
             (user_id,)
         )
+        await announce_invalidation(db, "sessions", user_id)
         await db.commit()
+    _forget_active_sessions(lambda key, value: key[0] == user_id)
@@ -0,0 +1,245 @@
+import os
+import asyncio
+import aiosqlite
+from contextlib import asynccontextmanager
+from typing import Optional
+
+from .database import StorageBackend
+
+import sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from config import config
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    telegram_id INTEGER UNIQUE NOT NULL,
+    username TEXT,
+    first_name TEXT,
+    last_name TEXT,
+    is_whitelisted BOOLEAN DEFAULT FALSE,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    last_active_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS projects (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    description TEXT,
+    path TEXT NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (user_id) REFERENCES users(id),
+    UNIQUE(user_id, name)
+);
+
+CREATE TABLE IF NOT EXISTS sessions (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INTEGER NOT NULL,
+    project_id INTEGER,
+    opencode_session_id TEXT UNIQUE NOT NULL,
+    title TEXT,
+    is_active BOOLEAN DEFAULT TRUE,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    last_message_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (user_id) REFERENCES users(id),
+    FOREIGN KEY (project_id) REFERENCES projects(id)
+);
+
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    last_error TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    next_run_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS processed_updates (
+    update_id INTEGER PRIMARY KEY,
+    received_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS agent_runs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    session_id INTEGER NOT NULL,
+    opencode_session_id TEXT NOT NULL,
+    chat_id INTEGER NOT NULL,
+    status TEXT NOT NULL DEFAULT 'running',
+    error TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    finished_at TIMESTAMP,
+    FOREIGN KEY (session_id) REFERENCES sessions(id)
+);
+
+CREATE TABLE IF NOT EXISTS bot_state (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+
+CREATE INDEX IF NOT EXISTS idx_users_telegram_id ON users(telegram_id);
+CREATE INDEX IF NOT EXISTS idx_sessions_user_id ON sessions(user_id);
+CREATE INDEX IF NOT EXISTS idx_sessions_opencode_id ON sessions(opencode_session_id);
+CREATE INDEX IF NOT EXISTS idx_projects_user_id ON projects(user_id);
+CREATE INDEX IF NOT EXISTS idx_jobs_status_next_run ON jobs(status, next_run_at);
+CREATE INDEX IF NOT EXISTS idx_processed_updates_received_at ON processed_updates(received_at);
+CREATE INDEX IF NOT EXISTS idx_agent_runs_status ON agent_runs(status, opencode_session_id);
+"""
+
+
+# Schema changes applied on top of SCHEMA, tracked with PRAGMA user_version.
+# Append only: entry N brings the database to version N + 1.
+MIGRATIONS = [
+    # Covering index for get_active_session_for_user: filter and order by the
+    # leading columns, read every selected column without touching the table
+    """
+    CREATE INDEX IF NOT EXISTS idx_sessions_active_lookup ON sessions(
+        user_id, project_id, is_active, last_message_at DESC,
+        id, opencode_session_id, title, created_at
+    );
+    """,
+    # Routing columns for sharding chats across replicas
+    """
+    ALTER TABLE jobs ADD COLUMN chat_key TEXT;
+    ALTER TABLE jobs ADD COLUMN slot INTEGER;
+    ALTER TABLE jobs ADD COLUMN claimed_by TEXT;
+    CREATE INDEX IF NOT EXISTS idx_jobs_chat_status ON jobs(chat_key, status);
+    """,
+    # At most one active session per user and project, so replicas racing to
+    # create one can't both succeed (create_session inserts ON CONFLICT DO NOTHING)
+    """
+    UPDATE sessions SET is_active = FALSE
+    WHERE is_active = TRUE AND EXISTS (
+        SELECT 1 FROM sessions AS newer
+        WHERE newer.user_id = sessions.user_id
+          AND COALESCE(newer.project_id, 0) = COALESCE(sessions.project_id, 0)
+          AND newer.is_active = TRUE
+          AND (newer.last_message_at > sessions.last_message_at
+               OR (newer.last_message_at = sessions.last_message_at AND newer.id > sessions.id))
+    );
+    CREATE UNIQUE INDEX IF NOT EXISTS idx_sessions_one_active
+        ON sessions(user_id, COALESCE(project_id, 0)) WHERE is_active = TRUE;
+    """,
+    # ID of the user message an agent run submitted, to find its reply
+    """
+    ALTER TABLE agent_runs ADD COLUMN message_id TEXT;
+    """,
+]
+
+
+async def migrate(db: aiosqlite.Connection) -> None:
+    """Apply pending MIGRATIONS in order."""
+    cursor = await db.execute("PRAGMA user_version")
+    version = (await cursor.fetchone())[0]
+    for number, script in enumerate(MIGRATIONS[version:], start=version + 1):
+        await db.executescript(script)
+        await db.execute(f"PRAGMA user_version = {number}")
+        await db.commit()
+        print(f"[DB] Applied migration {number}")
+
+
+class ConnectionPool:
+    """Long-lived SQLite connections: one writer plus a pool of readers.
+
+    Every connection runs in WAL mode with tuned pragmas, so readers never
+    block the writer and vice versa. Writes are serialized on the single
+    writer connection, which is handed out exclusively for the duration of
+    a `get_db()` block (and rolled back if the block didn't commit).
+    """
+
+    def __init__(self, path: str, readers: int):
+        self.path = path
+        self.readers = readers
+        self._writer: Optional[aiosqlite.Connection] = None
+        self._writer_lock = asyncio.Lock()
+        self._reader_pool: "asyncio.Queue[aiosqlite.Connection]" = asyncio.Queue()
+        self._all: list = []
+
+    async def _connect(self, readonly: bool) -> aiosqlite.Connection:
+        db = await aiosqlite.connect(self.path, cached_statements=config.DB_STATEMENT_CACHE)
+        db.row_factory = aiosqlite.Row
+        await db.execute("PRAGMA journal_mode=WAL")
+        await db.execute("PRAGMA synchronous=NORMAL")
+        await db.execute(f"PRAGMA busy_timeout={int(config.DB_BUSY_TIMEOUT_MS)}")
+        await db.execute(f"PRAGMA mmap_size={int(config.DB_MMAP_SIZE)}")
+        await db.execute("PRAGMA temp_store=MEMORY")
+        if readonly:
+            await db.execute("PRAGMA query_only=ON")
+        self._all.append(db)
+        return db
+
+    async def open(self):
+        self._writer = await self._connect(readonly=False)
+        for _ in range(self.readers):
+            self._reader_pool.put_nowait(await self._connect(readonly=True))
+
+    async def close(self):
+        for db in self._all:
+            await db.close()
+        self._all = []
+        self._writer = None
+
+    @asynccontextmanager
+    async def writer(self):
+        async with self._writer_lock:
+            try:
+                yield self._writer
+            finally:
+                if self._writer.in_transaction:
+                    await self._writer.rollback()
+
+    @asynccontextmanager
+    async def reader(self):
+        if self.readers == 0:
+            async with self.writer() as db:
+                yield db
+            return
+        db = await self._reader_pool.get()
+        try:
+            yield db
+        finally:
+            if db.in_transaction:
+                await db.rollback()
+            self._reader_pool.put_nowait(db)
+
+
+class SQLiteBackend(StorageBackend):
+    """A single SQLite file in WAL mode, for single-replica deployments."""
+
+    name = "sqlite"
+
+    def __init__(self, path: str, readers: int):
+        self.path = path
+        self.pool = ConnectionPool(path, readers)
+
+    async def open(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        async with aiosqlite.connect(self.path) as db:
+            await db.execute("PRAGMA journal_mode=WAL")
+            await db.executescript(SCHEMA)
+            await db.commit()
+            await migrate(db)
+        await self.pool.open()
+        print(f"[DB] Database initialized at {self.path} ({self.pool.readers} reader connection(s))")
+
+    async def close(self):
+        await self.pool.close()
+
+    def connection(self, readonly: bool = False):
+        return self.pool.reader() if readonly else self.pool.writer()
+
+
+@asynccontextmanager
+async def connect_once(path: str):
+    """A one-off connection, for use before init_db()."""
+    db = await aiosqlite.connect(path)
+    db.row_factory = aiosqlite.Row
+    try:
+        yield db
+    finally:
+        await db.close()
@@ -0,0 +1,160 @@
+import json
+from typing import List, Optional
+from .database import get_db, dialect, utc_timestamp
+from .cache import LRUCache
+
+import os
+import sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from config import config
+from metrics import timed_db, JOB_OUTCOMES, UPDATES_RECEIVED, UPDATES_DUPLICATE
+from sharding import chat_key, slot_for
+
+
+# Hot-path set of recently seen update_ids (the table is the source of truth)
+_recent_updates = LRUCache(config.UPDATE_DEDUP_CACHE_SIZE)
+
+dedup_stats = {"received": 0, "duplicates": 0}
+
+
+def is_known_update(update_id: int) -> bool:
+    """True if the update was already accepted by this process (no DB access)."""
+    return _recent_updates.get(update_id) is not None
+
+
+async def _chat_full(db, key: str) -> bool:
+    """True if the chat already has CHAT_MAX_QUEUED updates waiting behind its current one."""
+    if dialect() == "postgres":
+        # The lock claims take, so replicas enqueueing for one chat count each other
+        await db.execute("SELECT pg_advisory_xact_lock(hashtext(?))", (key,))
+    cursor = await db.execute(
+        "SELECT COUNT(*) FROM jobs WHERE chat_key = ? AND status IN ('pending', 'running')",
+        (key,)
+    )
+    row = await cursor.fetchone()
+    return row[0] > config.CHAT_MAX_QUEUED
+
+
+async def _insert_update(db, update: dict, added: List[int], rejected: List[dict]) -> Optional[int]:
+    """Record and enqueue one update on an open transaction. None if not enqueued.
+
+    update_ids recorded here for the first time are appended to `added`.
+    An update whose chat is full is recorded but not enqueued, and
+    appended to `rejected`.
+    """
+    dedup_stats["received"] += 1
+    UPDATES_RECEIVED.inc()
+    update_id = update.get("update_id")
+
+    if update_id is not None:
+        if is_known_update(update_id):
+            dedup_stats["duplicates"] += 1
+            UPDATES_DUPLICATE.inc()
+            return None
+        cursor = await db.execute(
+            "INSERT INTO processed_updates (update_id) VALUES (?) ON CONFLICT (update_id) DO NOTHING",
+            (update_id,)
+        )
+        _recent_updates.set(update_id, True)
+        if cursor.rowcount == 0:
+            dedup_stats["duplicates"] += 1
+            UPDATES_DUPLICATE.inc()
+            return None
+        added.append(update_id)
+
+    key = chat_key(update)
+    if config.CHAT_MAX_QUEUED and await _chat_full(db, key):
+        rejected.append(update)
+        return None
+    cursor = await db.execute(
+        "INSERT INTO jobs (payload, chat_key, slot) VALUES (?, ?, ?) RETURNING id",
+        (json.dumps(update), key, slot_for(key))
+    )
+    row = await cursor.fetchone()
+    return row["id"]
+
+
+@timed_db
+async def enqueue_update(update: dict, rejected: Optional[List[dict]] = None) -> Optional[int]:
+    """Record the update_id and enqueue the update in one transaction.
+
+    Returns the job ID, or None if the update was already processed
+    (a Telegram redelivery) or its chat is full (then it is appended to
+    `rejected`), in which case nothing is enqueued.
+    """
+    update_id = update.get("update_id")
+    if update_id is not None and is_known_update(update_id):
+        dedup_stats["received"] += 1
+        dedup_stats["duplicates"] += 1
+        UPDATES_RECEIVED.inc()
+        UPDATES_DUPLICATE.inc()
+        return None
+
+    job_ids = await enqueue_updates([update], rejected=rejected)
+    return job_ids[0] if job_ids else None
+
+
+@timed_db
+async def enqueue_updates(
+    updates: List[dict],
+    offset: Optional[int] = None,
+    rejected: Optional[List[dict]] = None
+) -> List[int]:
+    """Enqueue a batch of updates in a single transaction.
+
+    If `offset` is given it is stored as the getUpdates polling offset in the
+    same transaction, so a crash can neither lose nor double-enqueue a batch.
+    Returns the IDs of the jobs created (duplicates are skipped). Updates
+    turned away because their chat already has CHAT_MAX_QUEUED waiting are
+    appended to `rejected`; the caller owes them a busy reply.
+    """
+    job_ids = []
+    added: List[int] = []
+    turned_away: List[dict] = []
+    try:
+        async with get_db() as db:
+            for update in updates:
+                job_id = await _insert_update(db, update, added, turned_away)
+                if job_id is not None:
+                    job_ids.append(job_id)
+            if offset is not None:
+                await db.execute(
+                    """
+                    INSERT INTO bot_state (key, value) VALUES ('polling_offset', ?)
+                    ON CONFLICT(key) DO UPDATE SET value = excluded.value
+                    """,
+                    (str(offset),)
+                )
+            await db.commit()
+    except Exception:
+        # Nothing was stored, don't let the hot-path set claim otherwise. IDs
+        # that were already recorded before this batch stay known.
+        for update_id in added:
+            _recent_updates.pop(update_id)
+        raise
+    if turned_away:
+        JOB_OUTCOMES.labels("rejected").inc(len(turned_away))
+        if rejected is not None:
+            rejected.extend(turned_away)
+    return job_ids
+
+
+@timed_db
+async def get_polling_offset() -> Optional[int]:
+    """The next getUpdates offset stored by enqueue_updates, if any."""
+    async with get_db(readonly=True) as db:
+        cursor = await db.execute("SELECT value FROM bot_state WHERE key = 'polling_offset'")
+        row = await cursor.fetchone()
+        return int(row["value"]) if row else None
+
+
+@timed_db
+async def prune_processed_updates(max_age_hours: float) -> int:
+    """Forget update_ids older than `max_age_hours`. Returns number removed."""
+    async with get_db() as db:
+        cursor = await db.execute(
+            "DELETE FROM processed_updates WHERE received_at < ?",
+            (utc_timestamp(-max_age_hours * 3600),)
+        )
+        await db.commit()
+        return cursor.rowcount
@@ -1,7 +1,19 @@
-from typing import Optional
+import os
+from typing import List, Optional
 from dataclasses import dataclass
 from datetime import datetime
-from .database import get_db
+from .database import get_db, announce_invalidation, on_invalidate
+from .cache import LRUCache
+from .activity import activity
+
+import sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from config import config
+from metrics import timed_db
+
+
+# Hot-path cache of User objects keyed by telegram_id
+_user_cache = LRUCache(config.USER_CACHE_SIZE, config.USER_CACHE_TTL)
 
 
 @dataclass
@@ -16,9 +28,10 @@ class User:
     last_active_at: datetime
 
 
+@timed_db
 async def get_user_by_telegram_id(telegram_id: int) -> Optional[User]:
     """Get user by Telegram ID."""
-    async with get_db() as db:
+    async with get_db(readonly=True) as db:
         cursor = await db.execute(
             "SELECT * FROM users WHERE telegram_id = ?",
             (telegram_id,)
@@ -38,6 +51,7 @@ async def get_user_by_telegram_id(telegram_id: int) -> Optional[User]:
         return None
 
 
+@timed_db
 async def create_user(
     telegram_id: int,
     username: Optional[str] = None,
@@ -51,14 +65,12 @@ async def create_user(
             """
             INSERT INTO users (telegram_id, username, first_name, last_name, is_whitelisted)
             VALUES (?, ?, ?, ?, ?)
+            RETURNING *
             """,
             (telegram_id, username, first_name, last_name, is_whitelisted)
         )
-        await db.commit()
-        user_id = cursor.lastrowid
-
-        cursor = await db.execute("SELECT * FROM users WHERE id = ?", (user_id,))
         row = await cursor.fetchone()
+        await db.commit()
         return User(
             id=row["id"],
             telegram_id=row["telegram_id"],
@@ -71,43 +83,120 @@ async def create_user(
         )
 
 
+@timed_db
 async def get_or_create_user(
     telegram_id: int,
     username: Optional[str] = None,
     first_name: Optional[str] = None,
     last_name: Optional[str] = None
 ) -> User:
-    """Get existing user or create a new one."""
-    user = await get_user_by_telegram_id(telegram_id)
-    if user:
-        # Update last active and user info
-        await update_user_activity(telegram_id, username, first_name, last_name)
-        return await get_user_by_telegram_id(telegram_id)
-    return await create_user(telegram_id, username, first_name, last_name)
+    """Get existing user or create a new one, refreshing activity and user info.
+
+    Served from an in-memory cache while the user's info is unchanged;
+    otherwise resolved with a single upsert.
+    """
+    cached = _user_cache.get(telegram_id)
+    if cached and all(
+        new is None or new == old
+        for new, old in zip(
+            (username, first_name, last_name),
+            (cached.username, cached.first_name, cached.last_name)
+        )
+    ):
+        activity.touch_user(telegram_id)
+        return cached
+
+    async with get_db() as db:
+        cursor = await db.execute(
+            """
+            INSERT INTO users (telegram_id, username, first_name, last_name)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT(telegram_id) DO UPDATE SET
+                last_active_at = CURRENT_TIMESTAMP,
+                username = COALESCE(excluded.username, users.username),
+                first_name = COALESCE(excluded.first_name, users.first_name),
+                last_name = COALESCE(excluded.last_name, users.last_name)
+            RETURNING *
+            """,
+            (telegram_id, username, first_name, last_name)
+        )
+        row = await cursor.fetchone()
+        await db.commit()
+
+    user = User(
+        id=row["id"],
+        telegram_id=row["telegram_id"],
+        username=row["username"],
+        first_name=row["first_name"],
+        last_name=row["last_name"],
+        is_whitelisted=bool(row["is_whitelisted"]),
+        created_at=row["created_at"],
+        last_active_at=row["last_active_at"]
+    )
+    _user_cache.set(telegram_id, user)
+    return user
+
+
+def clear_user_cache() -> None:
+    """Forget all cached users, e.g. after other replicas may have changed them."""
+    _user_cache.clear()
+
 
+def _forget_user(telegram_id: Optional[str]) -> None:
+    """Another replica changed the user `telegram_id` (None: any user)."""
+    if telegram_id is None:
+        _user_cache.clear()
+    else:
+        _user_cache.pop(int(telegram_id))
 
+
+on_invalidate("user", _forget_user)
+
+
+@timed_db
+async def prime_user_cache(telegram_ids: List[int]) -> List[User]:
+    """Load many users in one query and cache them for get_or_create_user."""
+    ids = list(set(telegram_ids))
+    if not ids:
+        return []
+    async with get_db(readonly=True) as db:
+        cursor = await db.execute(
+            f"SELECT * FROM users WHERE telegram_id IN ({', '.join('?' * len(ids))})",
+            ids
+        )
+        rows = await cursor.fetchall()
+    users = [
+        User(
+            id=row["id"],
+            telegram_id=row["telegram_id"],
+            username=row["username"],
+            first_name=row["first_name"],
+            last_name=row["last_name"],
+            is_whitelisted=bool(row["is_whitelisted"]),
+            created_at=row["created_at"],
+            last_active_at=row["last_active_at"]
+        )
+        for row in rows
+    ]
+    for user in users:
+        _user_cache.set(user.telegram_id, user)
+    return users
+
+
+@timed_db
 async def update_user_activity(
     telegram_id: int,
     username: Optional[str] = None,
     first_name: Optional[str] = None,
     last_name: Optional[str] = None
 ) -> None:
-    """Update user's last active timestamp and info."""
-    async with get_db() as db:
-        await db.execute(
-            """
-            UPDATE users
-            SET last_active_at = CURRENT_TIMESTAMP,
-                username = COALESCE(?, username),
-                first_name = COALESCE(?, first_name),
-                last_name = COALESCE(?, last_name)
-            WHERE telegram_id = ?
-            """,
-            (username, first_name, last_name, telegram_id)
-        )
-        await db.commit()
+    """Update user's last active timestamp and info (buffered, written in batches)."""
+    activity.touch_user(telegram_id, username, first_name, last_name)
+    if username is not None or first_name is not None or last_name is not None:
+        _user_cache.pop(telegram_id)
 
 
+@timed_db
 async def set_user_whitelist(telegram_id: int, is_whitelisted: bool) -> bool:
     """Set user whitelist status. Returns True if user exists."""
     async with get_db() as db:
@@ -115,5 +204,7 @@ async def set_user_whitelist(telegram_id: int, is_whitelisted: bool) -> bool:
             "UPDATE users SET is_whitelisted = ? WHERE telegram_id = ?",
             (is_whitelisted, telegram_id)
         )
+        await announce_invalidation(db, "user", telegram_id)
         await db.commit()
-        return cursor.rowcount > 0
+    _user_cache.pop(telegram_id)
+    return cursor.rowcount > 0
@@ -0,0 +1,157 @@
+import secrets
+from dataclasses import dataclass
+from typing import List, Optional, Tuple
+
+from config import config
+from background import spawn
+from http_clients import get_opencode_client
+from telegram_outbound import telegram_request, PRIORITY_INTERACTIVE
+from db.cache import LRUCache
+
+
+CALLBACK_PREFIX = "dec:"
+
+PERMISSION_OPTIONS = [("Allow once", "once"), ("Always allow", "always"), ("Reject", "reject")]
+
+
+@dataclass
+class Decision:
+    """A question or permission request from the agent, waiting for the user."""
+    kind: str
+    session_id: str
+    request_id: str
+    chat_id: int
+    text: str
+    options: List[Tuple[str, str]]
+    message_id: Optional[int] = None
+
+
+def _permission_text(props: dict) -> str:
+    title = props.get("title")
+    if not title:
+        patterns = props.get("patterns") or ([props["pattern"]] if props.get("pattern") else [])
+        title = " ".join([props.get("permission") or props.get("type") or "action", *map(str, patterns)])
+    return f"The agent needs your permission:\n\n{title}"
+
+
+def parse_decision(chat_id: int, event: dict) -> Optional[Decision]:
+    """Decision asked for by a permission or question event, if it can be answered with buttons."""
+    event_type = event.get("type")
+    props = event.get("properties") or {}
+    if event_type in ("permission.updated", "permission.asked"):
+        return Decision(
+            kind="permission",
+            session_id=props.get("sessionID"),
+            request_id=props.get("id"),
+            chat_id=chat_id,
+            text=_permission_text(props),
+            options=PERMISSION_OPTIONS,
+        )
+    if event_type == "question.asked":
+        questions = props.get("questions") or []
+        lines = ["The agent has a question:"]
+        for question in questions:
+            lines.append("")
+            if question.get("header"):
+                lines.append(question["header"])
+            lines.append(question.get("question", ""))
+            for option in question.get("options") or []:
+                lines.append(f"- {option.get('label')}: {option.get('description', '')}".rstrip(": "))
+        # Buttons answer a single question; several at once are answered in OpenCode itself
+        options = []
+        if len(questions) == 1:
+            options = [(o.get("label"), o.get("label")) for o in questions[0].get("options") or []]
+        return Decision(
+            kind="question",
+            session_id=props.get("sessionID"),
+            request_id=props.get("id"),
+            chat_id=chat_id,
+            text="\n".join(lines),
+            options=options,
+        )
+    return None
+
+
+class DecisionRegistry:
+    """Questions and permission requests of agents, answered with inline buttons.
+
+    Telegram limits callback_data to 64 bytes, so each pending decision is
+    kept here under a short random token and buttons carry
+    `dec:<token>:<option>`. Only the chat a decision was asked in can
+    answer it.
+    Pending decisions live in memory; a button pressed after a restart (or
+    after the chat moved to another replica) is answered as expired.
+    """
+
+    def __init__(self, max_pending: int):
+        self._pending = LRUCache(max_pending)
+        self.asked = 0
+        self.answered = 0
+
+    async def ask(self, decision: Decision):
+        """Send the decision to its chat, with one button per option."""
+        token = secrets.token_urlsafe(8)
+        payload = {"chat_id": decision.chat_id, "text": decision.text}
+        if decision.options:
+            payload["reply_markup"] = {"inline_keyboard": [
+                [{"text": label, "callback_data": f"{CALLBACK_PREFIX}{token}:{index}"}]
+                for index, (label, _) in enumerate(decision.options)
+            ]}
+        response = await telegram_request("sendMessage", payload, PRIORITY_INTERACTIVE)
+        if response.status_code == 200:
+            decision.message_id = response.json().get("result", {}).get("message_id")
+        if decision.options:
+            self._pending.set(token, decision)
+        self.asked += 1
+
+    async def answer(self, callback_query: dict) -> str:
+        """Pass a pressed button on to OpenCode. Returns the text to show the user."""
+        _, _, rest = callback_query.get("data", "").partition(CALLBACK_PREFIX)
+        token, _, index = rest.partition(":")
+        decision = self._pending.get(token)
+        if decision is None or not index.isdigit() or int(index) >= len(decision.options):
+            return "This request has expired."
+        chat_id = ((callback_query.get("message") or {}).get("chat") or {}).get("id")
+        sender_id = (callback_query.get("from") or {}).get("id")
+        if chat_id != decision.chat_id or sender_id != decision.chat_id:
+            print(f"[Decisions] User {sender_id} tried to answer a decision of chat {decision.chat_id}")
+            return "This request is not yours to answer."
+
+        label, value = decision.options[int(index)]
+        client = get_opencode_client()
+        if decision.kind == "permission":
+            response = await client.post(
+                f"/session/{decision.session_id}/permissions/{decision.request_id}",
+                json={"response": value},
+            )
+        else:
+            response = await client.post(
+                f"/question/{decision.request_id}/reply",
+                json={"answers": [[value]]},
+            )
+        if response.status_code >= 400:
+            print(f"[Decisions] OpenCode rejected answer to {decision.request_id}: {response.status_code}")
+            return "Could not pass that on; the request may have been answered already."
+
+        self._pending.pop(token)
+        self.answered += 1
+        if decision.message_id is not None:
+            spawn(self._show_answer(decision, label))
+        return f"Sent: {label}"
+
+    async def _show_answer(self, decision: Decision, label: str):
+        """Drop the buttons and record the choice in the message."""
+        try:
+            await telegram_request("editMessageText", {
+                "chat_id": decision.chat_id,
+                "message_id": decision.message_id,
+                "text": f"{decision.text}\n\nAnswer: {label}",
+            }, PRIORITY_INTERACTIVE)
+        except Exception as e:
+            print(f"[Decisions] Failed to update message in chat {decision.chat_id}: {e}")
+
+    def stats(self) -> dict:
+        return {"pending": len(self._pending), "asked": self.asked, "answered": self.answered}
+
+
+decisions = DecisionRegistry(config.DECISION_MAX_PENDING)
@@ -0,0 +1,170 @@
+import asyncio
+import time
+import weakref
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Any, Awaitable, Callable, Deque, Dict, Hashable, Optional, Tuple
+
+from config import config
+
+
+TaskFactory = Callable[[], Awaitable[Any]]
+
+
+class QueueFull(Exception):
+    """A bounded queue had no room; the work was turned away instead of queued."""
+
+    def __init__(self, queue: str, limit: int):
+        super().__init__(f"{queue} queue is full ({limit} waiting)")
+        self.queue = queue
+        self.limit = limit
+
+
+class WaitStats:
+    """Running count/total/max of wait times, in seconds."""
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, seconds: float):
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def as_dict(self) -> dict:
+        return {
+            "count": self.count,
+            "avg_ms": round(self.total / self.count * 1000, 2) if self.count else 0.0,
+            "max_ms": round(self.max * 1000, 2),
+        }
+
+
+class ChatDispatcher:
+    """Runs work in one ordered lane per chat, lanes in parallel.
+
+    Calls toward OpenCode additionally go through a global semaphore
+    (`opencode_slot`) so the number of concurrent agent requests is bounded
+    regardless of how many lanes are active. Beyond `opencode_max_queued`
+    waiters for a slot, or after waiting `slot_timeout` seconds, work is
+    rejected with QueueFull (0 = unbounded).
+    """
+
+    def __init__(self, opencode_concurrency: int, opencode_max_queued: int = 0, slot_timeout: float = 0):
+        self.opencode_concurrency = opencode_concurrency
+        self.opencode_max_queued = opencode_max_queued
+        self.slot_timeout = slot_timeout
+        self._opencode_sem = asyncio.Semaphore(opencode_concurrency)
+        self._opencode_waiting = 0
+        self._opencode_in_flight = 0
+        self._lanes: Dict[Hashable, Deque[Tuple[float, TaskFactory, asyncio.Future]]] = {}
+        self._lane_tasks: Dict[Hashable, asyncio.Task] = {}
+        self._locks: "weakref.WeakValueDictionary[Hashable, asyncio.Lock]" = weakref.WeakValueDictionary()
+        self.lane_wait = WaitStats()
+        self.opencode_wait = WaitStats()
+
+    def submit(self, key: Hashable, factory: TaskFactory) -> asyncio.Future:
+        """Queue work on the lane for `key`. Returns a future with its result."""
+        future = asyncio.get_running_loop().create_future()
+        lane = self._lanes.setdefault(key, deque())
+        lane.append((time.monotonic(), factory, future))
+        if key not in self._lane_tasks:
+            self._lane_tasks[key] = asyncio.create_task(self._run_lane(key))
+        return future
+
+    async def _run_lane(self, key: Hashable):
+        lane = self._lanes[key]
+        try:
+            while lane:
+                queued_at, factory, future = lane.popleft()
+                self.lane_wait.record(time.monotonic() - queued_at)
+                if future.cancelled():
+                    continue
+                try:
+                    result = await factory()
+                except asyncio.CancelledError:
+                    future.cancel()
+                    raise
+                except Exception as e:
+                    if not future.done():
+                        future.set_exception(e)
+                else:
+                    if not future.done():
+                        future.set_result(result)
+        finally:
+            # Lanes are dropped once drained so idle chats cost nothing
+            if not lane:
+                self._lanes.pop(key, None)
+            self._lane_tasks.pop(key, None)
+
+    @asynccontextmanager
+    async def opencode_slot(self, on_queued: Optional[Callable[[int], None]] = None):
+        """Hold one of the global OpenCode concurrency slots.
+
+        If all slots are taken, `on_queued(position)` is called before
+        waiting; with `opencode_max_queued` waiters already, or once the
+        wait exceeds `slot_timeout`, QueueFull is raised instead.
+        """
+        started = time.monotonic()
+        if self._opencode_sem.locked():
+            if self.opencode_max_queued and self._opencode_waiting >= self.opencode_max_queued:
+                raise QueueFull("opencode", self.opencode_max_queued)
+            if on_queued is not None:
+                on_queued(self._opencode_waiting + 1)
+        self._opencode_waiting += 1
+        try:
+            await asyncio.wait_for(self._opencode_sem.acquire(), self.slot_timeout or None)
+        except asyncio.TimeoutError:
+            raise QueueFull("opencode", self._opencode_waiting) from None
+        finally:
+            self._opencode_waiting -= 1
+        self.opencode_wait.record(time.monotonic() - started)
+        self._opencode_in_flight += 1
+        try:
+            yield
+        finally:
+            self._opencode_in_flight -= 1
+            self._opencode_sem.release()
+
+    def lock_for(self, key: Hashable) -> asyncio.Lock:
+        """Return a lock shared by all holders of `key` (released when unused)."""
+        lock = self._locks.get(key)
+        if lock is None:
+            lock = asyncio.Lock()
+            self._locks[key] = lock
+        return lock
+
+    async def stop(self):
+        """Cancel all running lanes and fail their queued work."""
+        tasks = list(self._lane_tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        for lane in self._lanes.values():
+            for _, _, future in lane:
+                future.cancel()
+        self._lanes.clear()
+
+    def stats(self) -> dict:
+        """Queue depth and wait-time statistics."""
+        depths = [len(lane) for lane in self._lanes.values()]
+        return {
+            "active_lanes": len(self._lane_tasks),
+            "queued": sum(depths),
+            "max_lane_depth": max(depths, default=0),
+            "lane_wait": self.lane_wait.as_dict(),
+            "opencode": {
+                "limit": self.opencode_concurrency,
+                "in_flight": self._opencode_in_flight,
+                "waiting": self._opencode_waiting,
+                "max_queued": self.opencode_max_queued,
+                "wait": self.opencode_wait.as_dict(),
+            },
+        }
+
+
+dispatcher = ChatDispatcher(
+    config.OPENCODE_MAX_CONCURRENCY, config.OPENCODE_MAX_QUEUED, config.OPENCODE_SLOT_TIMEOUT
+)
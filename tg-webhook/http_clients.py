@@ -0,0 +1,79 @@
+from typing import Optional
+
+import httpx
+
+from config import config
+from circuit_breaker import BreakerTransport, opencode_breaker
+
+
+_telegram_client: Optional[httpx.AsyncClient] = None
+_opencode_client: Optional[httpx.AsyncClient] = None
+
+
+def _http2_available() -> bool:
+    """HTTP/2 needs the optional `h2` package (pip install httpx[http2])."""
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+async def init_http_clients():
+    """Create the shared clients. Called once from the FastAPI lifespan."""
+    global _telegram_client, _opencode_client
+
+    http2 = config.TELEGRAM_HTTP2 and _http2_available()
+    if config.TELEGRAM_HTTP2 and not http2:
+        print("[HTTP] TELEGRAM_HTTP2 requested but h2 is not installed, using HTTP/1.1")
+
+    _telegram_client = httpx.AsyncClient(
+        base_url=f"{config.TELEGRAM_API_URL}/bot{config.TELEGRAM_BOT_TOKEN}",
+        http2=http2,
+        limits=httpx.Limits(
+            max_connections=config.TELEGRAM_MAX_CONNECTIONS,
+            max_keepalive_connections=config.TELEGRAM_MAX_KEEPALIVE,
+            keepalive_expiry=config.HTTP_KEEPALIVE_EXPIRY,
+        ),
+        timeout=httpx.Timeout(config.TELEGRAM_TIMEOUT, connect=config.HTTP_CONNECT_TIMEOUT),
+    )
+    # Every OpenCode call goes through the circuit breaker, so an unhealthy
+    # server fails requests fast instead of letting them wait out timeouts
+    opencode_transport = httpx.AsyncHTTPTransport(
+        limits=httpx.Limits(
+            max_connections=config.OPENCODE_MAX_CONNECTIONS,
+            max_keepalive_connections=config.OPENCODE_MAX_KEEPALIVE,
+            keepalive_expiry=config.HTTP_KEEPALIVE_EXPIRY,
+        ),
+    )
+    _opencode_client = httpx.AsyncClient(
+        base_url=config.OPENCODE_URL,
+        transport=BreakerTransport(opencode_transport, opencode_breaker),
+        timeout=httpx.Timeout(config.OPENCODE_SESSION_TIMEOUT, connect=config.HTTP_CONNECT_TIMEOUT),
+    )
+    print(f"[HTTP] Clients initialized (telegram http2={http2})")
+
+
+async def close_http_clients():
+    """Close the shared clients and release their pooled connections."""
+    global _telegram_client, _opencode_client
+    if _telegram_client is not None:
+        await _telegram_client.aclose()
+        _telegram_client = None
+    if _opencode_client is not None:
+        await _opencode_client.aclose()
+        _opencode_client = None
+
+
+def get_telegram_client() -> httpx.AsyncClient:
+    """Return the shared Telegram Bot API client (paths are relative to /bot<token>)."""
+    if _telegram_client is None:
+        raise RuntimeError("HTTP clients not initialized")
+    return _telegram_client
+
+
+def get_opencode_client() -> httpx.AsyncClient:
+    """Return the shared OpenCode server client."""
+    if _opencode_client is None:
+        raise RuntimeError("HTTP clients not initialized")
+    return _opencode_client
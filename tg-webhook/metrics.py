@@ -0,0 +1,120 @@
+import functools
+import time
+from typing import Dict
+
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Gauge, Histogram, generate_latest
+
+
+# Buckets span sub-millisecond SQLite calls up to multi-minute agent turns
+FAST_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+SLOW_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0)
+
+WEBHOOK_LATENCY = Histogram(
+    "tg_webhook_request_seconds",
+    "Time to acknowledge a webhook request",
+    buckets=FAST_BUCKETS,
+)
+WEBHOOK_IN_FLIGHT = Gauge(
+    "tg_webhook_requests_in_flight",
+    "Webhook requests currently being handled",
+)
+UPDATE_LATENCY = Histogram(
+    "tg_update_processing_seconds",
+    "Time to fully process one update in a worker",
+    buckets=SLOW_BUCKETS,
+)
+UPDATES_IN_FLIGHT = Gauge(
+    "tg_updates_in_flight",
+    "Updates currently being processed by workers",
+)
+JOB_OUTCOMES = Counter(
+    "tg_jobs_total",
+    "Processed jobs by outcome",
+    ["outcome"],
+)
+AGENT_RUNS = Counter(
+    "tg_agent_runs_total",
+    "Asynchronous agent runs by outcome",
+    ["outcome"],
+)
+UPDATES_RECEIVED = Counter(
+    "tg_updates_received_total",
+    "Updates received by the ingress",
+)
+UPDATES_DUPLICATE = Counter(
+    "tg_updates_duplicate_total",
+    "Redelivered updates dropped before any work was done",
+)
+DB_LATENCY = Histogram(
+    "tg_db_call_seconds",
+    "Latency of db package functions",
+    ["function"],
+    buckets=FAST_BUCKETS,
+)
+TELEGRAM_LATENCY = Histogram(
+    "tg_telegram_api_seconds",
+    "Latency of Telegram Bot API calls (excluding rate-limit waits)",
+    ["method"],
+    buckets=FAST_BUCKETS + (5.0, 10.0),
+)
+TELEGRAM_RESPONSES = Counter(
+    "tg_telegram_api_responses_total",
+    "Telegram Bot API responses by method and status code",
+    ["method", "status"],
+)
+PROJECT_SETUP_LATENCY = Histogram(
+    "tg_project_setup_seconds",
+    "Time spent on project directories and template repos (git, filesystem), by stage",
+    ["stage"],
+    buckets=SLOW_BUCKETS,
+)
+OPENCODE_LATENCY = Histogram(
+    "tg_opencode_request_seconds",
+    "Latency of OpenCode server calls",
+    ["operation"],
+    buckets=SLOW_BUCKETS,
+)
+QUEUE_DEPTH = Gauge(
+    "tg_queue_depth",
+    "Items waiting in each internal queue",
+    ["queue"],
+)
+ADMISSION_REJECTED = Counter(
+    "tg_admission_rejected_total",
+    "Chat messages turned away instead of queued, by reason",
+    ["reason"],
+)
+BREAKER_STATE = Gauge(
+    "tg_circuit_breaker_state",
+    "Circuit breaker state per upstream (0 closed, 1 half-open, 2 open)",
+    ["upstream"],
+)
+
+
+def timed_db(fn=None, *, name=None):
+    """Record the latency of an async db function in DB_LATENCY."""
+    if fn is None:
+        return functools.partial(timed_db, name=name)
+    histogram = DB_LATENCY.labels(name or fn.__name__)
+
+    @functools.wraps(fn)
+    async def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await fn(*args, **kwargs)
+        finally:
+            histogram.observe(time.perf_counter() - started)
+
+    return wrapper
+
+
+_telegram_children: Dict[str, Histogram] = {}
+
+
+def observe_telegram(method: str, status: int, seconds: float):
+    """Record one Bot API call."""
+    child = _telegram_children.get(method)
+    if child is None:
+        child = _telegram_children[method] = TELEGRAM_LATENCY.labels(method)
+    child.observe(seconds)
+    TELEGRAM_RESPONSES.labels(method, str(status)).inc()
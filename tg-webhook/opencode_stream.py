@@ -0,0 +1,260 @@
+import asyncio
+import json
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+import httpx
+
+from config import config
+from background import spawn
+from http_clients import get_opencode_client
+from sharding import cluster
+from db import get_session_chats
+
+
+TextCallback = Callable[[str], None]
+Listener = Callable[[dict], None]
+Notify = Callable[[int, dict], Awaitable[None]]
+
+# Events the user may have to act on, forwarded to the chat of their session
+ACTIONABLE_EVENTS = {"permission.updated", "permission.asked", "question.asked", "session.error"}
+
+
+async def iter_opencode_events(
+    last_event_id: Optional[str] = None,
+    on_connect: Optional[Callable[[], None]] = None
+) -> AsyncIterator[Tuple[Optional[str], dict]]:
+    """Yield (event id, event) pairs from OpenCode's server-sent event stream (GET /event).
+
+    `on_connect` is called once the stream is open. With `last_event_id`
+    the server is asked to resume after that event (Last-Event-ID), where
+    it supports it.
+    """
+    headers = {"accept": "text/event-stream"}
+    if last_event_id:
+        headers["last-event-id"] = last_event_id
+    client = get_opencode_client()
+    async with client.stream(
+        "GET",
+        "/event",
+        headers=headers,
+        timeout=httpx.Timeout(None, connect=config.HTTP_CONNECT_TIMEOUT),
+    ) as response:
+        response.raise_for_status()
+        if on_connect is not None:
+            on_connect()
+        data_lines = []
+        event_id = None
+        async for line in response.aiter_lines():
+            if line.startswith("data:"):
+                data_lines.append(line[5:].lstrip())
+            elif line.startswith("id:"):
+                event_id = line[3:].strip() or None
+            elif not line and data_lines:
+                raw = "\n".join(data_lines)
+                data_lines = []
+                try:
+                    yield event_id, json.loads(raw)
+                except ValueError:
+                    continue
+
+
+def event_session_id(event: dict) -> Optional[str]:
+    """OpenCode session an event belongs to, if any."""
+    props = event.get("properties") or {}
+    if props.get("sessionID"):
+        return props["sessionID"]
+    for key in ("info", "part"):
+        item = props.get(key)
+        if isinstance(item, dict) and item.get("sessionID"):
+            return item["sessionID"]
+    return None
+
+
+class SessionTextFollower:
+    """Listener passing the accumulated assistant text of one session to `on_text`.
+
+    Only text parts of assistant messages are included, so the echoed user
+    prompt never shows up in the output.
+    """
+
+    def __init__(self, on_text: TextCallback):
+        self.on_text = on_text
+        self._roles: Dict[str, str] = {}
+        self._parts: Dict[str, dict] = {}
+
+    def __call__(self, event: dict):
+        event_type = event.get("type")
+        props = event.get("properties") or {}
+
+        if event_type == "message.updated":
+            info = props.get("info") or {}
+            self._roles[info.get("id")] = info.get("role")
+            return
+
+        if event_type != "message.part.updated":
+            return
+
+        part = props.get("part") or {}
+        if part.get("type") != "text" or part.get("synthetic"):
+            return
+
+        self._parts[part.get("id")] = part
+        text = "\n".join(
+            p.get("text", "")
+            for p in self._parts.values()
+            if self._roles.get(p.get("messageID")) == "assistant" and p.get("text")
+        )
+        if text:
+            self.on_text(text)
+
+
+class Subscription:
+    """A listener registered on the event bus for one session."""
+
+    def __init__(self, bus: "OpenCodeEventBus", session_id: str, listener: Listener):
+        self._bus = bus
+        self.session_id = session_id
+        self.listener = listener
+
+    def cancel(self):
+        self._bus._unsubscribe(self)
+
+
+class OpenCodeEventBus:
+    """One subscription to OpenCode's global event stream, shared by all sessions.
+
+    Events are demultiplexed by session ID to the listeners registered with
+    `subscribe()` (streamed replies, agent runs). Actionable events
+    (questions, permission requests, errors nobody is listening for) also
+    go to `notify(chat_id, event)` for the chat of their session, looked
+    up in an index built from the sessions table. With sharding, only
+    chats this replica owns are indexed, so each notification is sent once.
+
+    The stream reconnects with backoff and asks to resume with
+    Last-Event-ID. Servers that can't replay drop what was published in
+    the gap, so `on_reconnect` callbacks run to let consumers resync.
+    """
+
+    def __init__(self, max_backoff: float):
+        self.max_backoff = max_backoff
+        self._listeners: Dict[str, Set[Subscription]] = {}
+        self._chats: Dict[str, int] = {}
+        self._on_reconnect: List[Callable[[], None]] = []
+        self._notify: Optional[Notify] = None
+        self._task: Optional[asyncio.Task] = None
+        self._last_event_id: Optional[str] = None
+        self._was_connected = False
+        self.connected = asyncio.Event()
+        self.events = 0
+        self.notified = 0
+        self.reconnects = 0
+
+    def start(self, notify: Notify):
+        """Connect in the background; `notify(chat_id, event)` receives actionable events."""
+        self._notify = notify
+        self._task = asyncio.create_task(self._run(), name="opencode-events")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        self.connected.clear()
+
+    def subscribe(self, session_id: str, listener: Listener) -> Subscription:
+        """Call `listener(event)` for every event of `session_id` until cancelled."""
+        subscription = Subscription(self, session_id, listener)
+        self._listeners.setdefault(session_id, set()).add(subscription)
+        return subscription
+
+    def _unsubscribe(self, subscription: Subscription):
+        listeners = self._listeners.get(subscription.session_id)
+        if listeners is not None:
+            listeners.discard(subscription)
+            if not listeners:
+                del self._listeners[subscription.session_id]
+
+    def on_reconnect(self, callback: Callable[[], None]):
+        self._on_reconnect.append(callback)
+
+    def register_chat(self, session_id: str, chat_id: int):
+        """Route actionable events of a new session to `chat_id`."""
+        if cluster.is_local(str(chat_id)):
+            self._chats[session_id] = chat_id
+
+    async def load_index(self):
+        """Rebuild the session -> chat index, e.g. on startup or after a cluster rebalance."""
+        chats = await get_session_chats()
+        self._chats = {sid: chat for sid, chat in chats.items() if cluster.is_local(str(chat))}
+
+    def _on_connect(self):
+        self.connected.set()
+        if not self._was_connected:
+            self._was_connected = True
+            print(f"[Events] Subscribed to OpenCode events ({len(self._chats)} session(s) indexed)")
+            return
+        self.reconnects += 1
+        for callback in self._on_reconnect:
+            callback()
+
+    async def _run(self):
+        try:
+            await self.load_index()
+        except Exception as e:
+            print(f"[Events] Failed to load session index: {e}")
+        backoff = 1.0
+        while True:
+            try:
+                async for event_id, event in iter_opencode_events(self._last_event_id, self._on_connect):
+                    backoff = 1.0
+                    if event_id:
+                        self._last_event_id = event_id
+                    self._dispatch(event)
+            except Exception as e:
+                if self.connected.is_set():
+                    print(f"[Events] Event stream lost, reconnecting: {e}")
+            self.connected.clear()
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, self.max_backoff)
+
+    def _dispatch(self, event: dict):
+        self.events += 1
+        session_id = event_session_id(event)
+        if session_id is None:
+            return
+        subscriptions = list(self._listeners.get(session_id, ()))
+        for subscription in subscriptions:
+            try:
+                subscription.listener(event)
+            except Exception as e:
+                print(f"[Events] Listener for {session_id} failed: {e}")
+
+        event_type = event.get("type")
+        if event_type not in ACTIONABLE_EVENTS or self._notify is None:
+            return
+        if event_type == "session.error" and subscriptions:
+            # A prompt sent from here is in flight; its reply carries the error
+            return
+        chat_id = self._chats.get(session_id)
+        if chat_id is not None:
+            self.notified += 1
+            spawn(self._notify_safely(chat_id, event))
+
+    async def _notify_safely(self, chat_id: int, event: dict):
+        try:
+            await self._notify(chat_id, event)
+        except Exception as e:
+            print(f"[Events] Failed to notify chat {chat_id} of {event.get('type')}: {e}")
+
+    def stats(self) -> dict:
+        return {
+            "connected": self.connected.is_set(),
+            "events": self.events,
+            "notified": self.notified,
+            "reconnects": self.reconnects,
+            "subscribed_sessions": len(self._listeners),
+            "indexed_sessions": len(self._chats),
+        }
+
+
+event_bus = OpenCodeEventBus(config.OPENCODE_EVENTS_MAX_BACKOFF)
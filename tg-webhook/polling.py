@@ -0,0 +1,122 @@
+import asyncio
+from typing import List, Optional
+
+import httpx
+
+from config import config
+from http_clients import get_telegram_client
+from tracing import mark_received
+from db import (
+    enqueue_updates,
+    get_polling_offset,
+    prime_user_cache,
+    prime_active_sessions,
+)
+
+
+class UpdatePoller:
+    """Ingress driver that long-polls getUpdates instead of receiving webhooks.
+
+    Each batch (up to 100 updates) is enqueued in one transaction together
+    with the next offset, then flows through the same job pipeline as
+    webhook updates; updates turned away because their chat is full are
+    passed to `on_rejected`. Users and active sessions for the whole batch
+    are loaded in one query each, so the workers find them in cache.
+    """
+
+    def __init__(self, on_enqueued, on_rejected):
+        self.on_enqueued = on_enqueued
+        self.on_rejected = on_rejected
+        self.offset: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+        self.batches = 0
+        self.updates = 0
+
+    async def start(self):
+        client = get_telegram_client()
+        # getUpdates is refused while a webhook is set
+        response = await client.post("/deleteWebhook", json={"drop_pending_updates": False})
+        if response.status_code != 200:
+            print(f"[Polling] deleteWebhook failed: {response.status_code} {response.text}")
+        self.offset = await get_polling_offset()
+        self._task = asyncio.create_task(self._run(), name="update-poller")
+        print(f"[Polling] Long polling getUpdates from offset {self.offset}")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self):
+        failures = 0
+        while True:
+            stage = "getUpdates"
+            try:
+                updates = await self._get_updates()
+                if updates:
+                    # The offset only advances once the batch is stored, so
+                    # a batch that fails here is fetched again
+                    stage = "Storing updates"
+                    await self._handle_batch(updates)
+                failures = 0
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                failures += 1
+                delay = min(2 ** failures, 60)
+                print(f"[Polling] {stage} failed, retrying in {delay}s: {e}")
+                await asyncio.sleep(delay)
+
+    async def _get_updates(self) -> List[dict]:
+        payload = {
+            "timeout": config.POLLING_TIMEOUT,
+            "limit": config.POLLING_BATCH_SIZE,
+        }
+        if self.offset is not None:
+            payload["offset"] = self.offset
+        response = await get_telegram_client().post(
+            "/getUpdates",
+            json=payload,
+            # The request legitimately stays open for the whole long-poll timeout
+            timeout=httpx.Timeout(config.POLLING_TIMEOUT + 10, connect=config.HTTP_CONNECT_TIMEOUT)
+        )
+        response.raise_for_status()
+        return response.json().get("result", [])
+
+    async def _handle_batch(self, updates: List[dict]):
+        next_offset = max(u["update_id"] for u in updates) + 1
+        rejected = []
+        job_ids = await enqueue_updates(updates, offset=next_offset, rejected=rejected)
+        for update in updates:
+            mark_received(update["update_id"])
+        self.offset = next_offset
+        self.batches += 1
+        self.updates += len(updates)
+
+        try:
+            await self._prime_caches(updates)
+        except Exception as e:
+            print(f"[Polling] Failed to prefetch users/sessions: {e}")
+
+        for update in rejected:
+            self.on_rejected(update)
+        if job_ids:
+            self.on_enqueued()
+
+    async def _prime_caches(self, updates: List[dict]):
+        telegram_ids = [
+            u["message"]["from"]["id"]
+            for u in updates
+            if "from" in u.get("message", {})
+        ]
+        users = await prime_user_cache(telegram_ids)
+        await prime_active_sessions([user.id for user in users])
+
+    def stats(self) -> dict:
+        return {
+            "offset": self.offset,
+            "batches": self.batches,
+            "updates": self.updates,
+            "avg_batch_size": round(self.updates / self.batches, 2) if self.batches else 0.0,
+        }
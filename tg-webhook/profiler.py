@@ -0,0 +1,68 @@
+import asyncio
+import sys
+import threading
+import time
+from collections import Counter
+
+from config import config
+
+
+class LoopProfiler:
+    """Sampling profiler for the event loop thread.
+
+    A background thread snapshots the loop thread's Python stack every
+    `interval` seconds and counts identical stacks. The result is in the
+    collapsed "frame;frame;frame count" format that flamegraph tools read.
+    Only one capture runs at a time.
+    """
+
+    def __init__(self, interval: float, max_depth: int = 64):
+        self.interval = interval
+        self.max_depth = max_depth
+        self._lock = asyncio.Lock()
+
+    @property
+    def busy(self) -> bool:
+        return self._lock.locked()
+
+    async def capture(self, seconds: float) -> str:
+        """Sample the calling (event loop) thread for `seconds`; return collapsed stacks."""
+        async with self._lock:
+            thread_id = threading.get_ident()
+            stop = threading.Event()
+            samples: Counter = Counter()
+            sampler = threading.Thread(
+                target=self._sample, args=(thread_id, stop, samples), name="loop-profiler", daemon=True
+            )
+            started = time.perf_counter()
+            sampler.start()
+            try:
+                await asyncio.sleep(seconds)
+            finally:
+                stop.set()
+                await asyncio.to_thread(sampler.join)
+            elapsed = time.perf_counter() - started
+
+        total = sum(samples.values())
+        header = (
+            f"# {total} samples over {elapsed:.1f}s at {self.interval * 1000:.0f}ms interval\n"
+        )
+        return header + "".join(f"{stack} {count}\n" for stack, count in samples.most_common())
+
+    def _sample(self, thread_id: int, stop: threading.Event, samples: Counter):
+        while not stop.wait(self.interval):
+            frame = sys._current_frames().get(thread_id)
+            if frame is None:
+                continue
+            samples[self._collapse(frame)] += 1
+
+    def _collapse(self, frame) -> str:
+        stack = []
+        while frame is not None and len(stack) < self.max_depth:
+            code = frame.f_code
+            stack.append(f"{code.co_name} ({code.co_filename.rsplit('/', 1)[-1]}:{frame.f_lineno})")
+            frame = frame.f_back
+        return ";".join(reversed(stack))
+
+
+profiler = LoopProfiler(config.PROFILE_SAMPLE_INTERVAL)
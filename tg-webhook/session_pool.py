@@ -0,0 +1,162 @@
+import asyncio
+import time
+from collections import OrderedDict, deque
+from typing import Awaitable, Callable, Optional
+
+from config import config
+from background import spawn
+from http_clients import get_opencode_client
+
+
+CreateSession = Callable[..., Awaitable[str]]
+
+WARM_TITLE = "Telegram - (warm)"
+
+
+class SessionPool:
+    """Keeps ready-made OpenCode sessions per working directory.
+
+    The default directory (None) is always kept warm; project directories are
+    warmed once they are used, up to `max_directories` (least recently used
+    ones are dropped). Claiming a session only renames it, so /newsession and
+    /project switches don't wait on session creation. Sessions unclaimed for
+    longer than `ttl` are deleted and replaced.
+    """
+
+    def __init__(self, size: int, ttl: float, max_directories: int, refill_interval: float):
+        self.size = size
+        self.ttl = ttl
+        self.max_directories = max_directories
+        self.refill_interval = refill_interval
+        self._create_session: Optional[CreateSession] = None
+        # Directory -> deque of (session ID, created at), least recently used first
+        self._pools: OrderedDict = OrderedDict()
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.size > 0
+
+    def start(self, create_session: CreateSession):
+        """Start topping up pools in the background."""
+        if not self.enabled:
+            return
+        self._create_session = create_session
+        self.warm(None)
+        self._task = asyncio.create_task(self._run(), name="session-pool")
+        print(f"[SessionPool] Keeping {self.size} warm session(s) per directory")
+
+    async def stop(self):
+        """Stop refilling and delete sessions nobody claimed."""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        leftovers = [sid for pool in self._pools.values() for sid, _ in pool]
+        self._pools.clear()
+        await asyncio.gather(*(_delete_session(sid) for sid in leftovers), return_exceptions=True)
+
+    def warm(self, directory: Optional[str]):
+        """Keep sessions ready for `directory` from now on."""
+        if not self.enabled:
+            return
+        if directory in self._pools:
+            self._pools.move_to_end(directory)
+            return
+        if directory is not None and self.max_directories <= 0:
+            return
+        # Make room among the project directories; the default one always stays
+        older = [d for d in self._pools if d is not None]
+        while older and len(older) + (directory is not None) > self.max_directories:
+            for sid, _ in self._pools.pop(older.pop(0)):
+                spawn(_delete_session(sid))
+        self._pools[directory] = deque()
+        self._wakeup.set()
+
+    async def claim(self, directory: Optional[str], title: str) -> Optional[str]:
+        """Take a ready session for `directory` and give it `title`. None if the pool is empty."""
+        if not self.enabled:
+            return None
+        self.warm(directory)
+        pool = self._pools.get(directory)
+        now = time.monotonic()
+        while pool:
+            session_id, created_at = pool.popleft()
+            if now - created_at >= self.ttl:
+                spawn(_delete_session(session_id))
+                continue
+            self._wakeup.set()
+            self.hits += 1
+            try:
+                await _rename_session(session_id, title)
+            except Exception as e:
+                # The title is cosmetic, the session is still usable
+                print(f"[SessionPool] Failed to rename {session_id}: {e}")
+            return session_id
+        self.misses += 1
+        self._wakeup.set()
+        return None
+
+    async def discard(self, session_id: str):
+        """Delete a claimed or created session that ended up unused."""
+        await _delete_session(session_id)
+
+    async def _run(self):
+        while True:
+            try:
+                await self._refill()
+            except Exception as e:
+                print(f"[SessionPool] Refill failed: {e}")
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.refill_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _refill(self):
+        now = time.monotonic()
+        for directory in list(self._pools):
+            pool = self._pools.get(directory)
+            if pool is None:
+                continue
+            # Reap expired sessions
+            while pool and now - pool[0][1] >= self.ttl:
+                session_id, _ = pool.popleft()
+                await _delete_session(session_id)
+            while len(pool) < self.size and directory in self._pools:
+                session_id = await self._create_session(directory=directory, title=WARM_TITLE)
+                pool.append((session_id, time.monotonic()))
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "directories": len(self._pools),
+            "ready": sum(len(pool) for pool in self._pools.values()),
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+async def _rename_session(session_id: str, title: str):
+    client = get_opencode_client()
+    response = await client.patch(f"/session/{session_id}", json={"title": title})
+    response.raise_for_status()
+
+
+async def _delete_session(session_id: str):
+    try:
+        client = get_opencode_client()
+        await client.delete(f"/session/{session_id}")
+    except Exception as e:
+        print(f"[SessionPool] Failed to delete {session_id}: {e}")
+
+
+session_pool = SessionPool(
+    config.SESSION_POOL_SIZE,
+    config.SESSION_POOL_TTL,
+    config.SESSION_POOL_MAX_DIRECTORIES,
+    config.SESSION_POOL_REFILL_INTERVAL,
+)
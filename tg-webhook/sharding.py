@@ -0,0 +1,210 @@
+import asyncio
+import bisect
+import hashlib
+import hmac
+import socket
+from typing import Callable, Dict, FrozenSet, List, Optional
+from urllib.parse import urlparse
+
+import httpx
+
+from config import config
+from background import spawn
+
+
+def _hash(value: str) -> int:
+    return int.from_bytes(hashlib.blake2b(value.encode(), digest_size=8).digest(), "big")
+
+
+def update_chat_id(data: dict) -> Optional[int]:
+    """Chat an update belongs to, if any."""
+    for key in ("message", "edited_message", "callback_query"):
+        if key in data:
+            item = data[key]
+            chat = item.get("chat") or item.get("message", {}).get("chat") or {}
+            if "id" in chat:
+                return chat["id"]
+    return None
+
+
+def chat_key(data: dict) -> str:
+    """Routing key of an update: its chat, or the update itself if it has none."""
+    chat_id = update_chat_id(data)
+    return str(chat_id) if chat_id is not None else f"update:{data.get('update_id')}"
+
+
+def slot_for(key: str) -> int:
+    """Hash slot of a routing key. Slots, not keys, are assigned to replicas."""
+    return _hash(key) % config.CLUSTER_SLOTS
+
+
+class HashRing:
+    """Consistent hash ring of replicas with `vnodes` points per replica.
+
+    Adding or removing a replica only moves the slots adjacent to its
+    points, so most chats keep their owner across membership changes.
+    """
+
+    def __init__(self, members: List[str], vnodes: int):
+        self.members = sorted(set(members))
+        points = sorted(
+            (_hash(f"{member}#{i}"), member)
+            for member in self.members
+            for i in range(vnodes)
+        )
+        self._hashes = [h for h, _ in points]
+        self._owners = [m for _, m in points]
+
+    def owner(self, slot: int) -> Optional[str]:
+        if not self._hashes:
+            return None
+        index = bisect.bisect(self._hashes, _hash(f"slot:{slot}")) % len(self._hashes)
+        return self._owners[index]
+
+    def assignment(self, slots: int) -> Dict[int, str]:
+        return {slot: self.owner(slot) for slot in range(slots)}
+
+
+class Cluster:
+    """Membership and slot ownership of this replica among its peers.
+
+    Peers come from CLUSTER_PEERS (static list of base URLs) or are
+    resolved from CLUSTER_PEERS_DNS (a headless Service) every
+    CLUSTER_REFRESH_INTERVAL seconds. With neither set, clustering is off
+    and this replica owns everything.
+
+    Any replica accepts an update and stores it with its slot; only the
+    slot's owner claims it (see claim_next_job) and it is woken up over
+    /internal/wake. When membership changes, `on_rebalance` callbacks run;
+    jobs already claimed keep running where they are.
+    """
+
+    def __init__(self):
+        self.self_url = config.CLUSTER_SELF_URL.rstrip("/")
+        self.members: List[str] = []
+        self.ring: Optional[HashRing] = None
+        self.owned: Optional[FrozenSet[int]] = None
+        self.rebalances = 0
+        self.forwarded = 0
+        self.forward_errors = 0
+        self._on_rebalance: List[Callable[[], None]] = []
+        self._client: Optional[httpx.AsyncClient] = None
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def enabled(self) -> bool:
+        return bool(config.CLUSTER_PEERS or config.CLUSTER_PEERS_DNS)
+
+    def on_rebalance(self, callback: Callable[[], None]):
+        self._on_rebalance.append(callback)
+
+    async def start(self):
+        if not self.enabled:
+            return
+        if config.DB_BACKEND != "postgres":
+            print("[Cluster] Warning: clustering needs a shared database (DB_BACKEND=postgres)")
+        if config.INGRESS_MODE == "polling":
+            print("[Cluster] Warning: only one replica may long-poll getUpdates, use INGRESS_MODE=webhook")
+        self._client = httpx.AsyncClient(timeout=httpx.Timeout(5.0, connect=config.HTTP_CONNECT_TIMEOUT))
+        await self.refresh()
+        self._task = asyncio.create_task(self._run(), name="cluster-membership")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(config.CLUSTER_REFRESH_INTERVAL)
+            try:
+                await self.refresh()
+            except Exception as e:
+                print(f"[Cluster] Membership refresh failed: {e}")
+
+    async def _discover(self) -> List[str]:
+        peers = [p.strip().rstrip("/") for p in config.CLUSTER_PEERS.split(",") if p.strip()]
+        if config.CLUSTER_PEERS_DNS:
+            infos = await asyncio.get_running_loop().getaddrinfo(
+                config.CLUSTER_PEERS_DNS, config.CLUSTER_PORT, type=socket.SOCK_STREAM
+            )
+            peers += [f"http://{info[4][0]}:{config.CLUSTER_PORT}" for info in infos]
+        if self.self_url not in peers:
+            # Not yet resolvable (e.g. not ready) - still own our share locally
+            peers.append(self.self_url)
+        return sorted(set(peers))
+
+    async def refresh(self):
+        """Re-read membership and rebalance slots if it changed."""
+        members = await self._discover()
+        if members == self.members:
+            return
+        ring = HashRing(members, config.CLUSTER_VNODES)
+        owned = frozenset(
+            slot for slot, owner in ring.assignment(config.CLUSTER_SLOTS).items()
+            if owner == self.self_url
+        )
+        gained = len(owned - self.owned) if self.owned is not None else len(owned)
+        lost = len(self.owned - owned) if self.owned is not None else 0
+        self.members, self.ring, self.owned = members, ring, owned
+        self.rebalances += 1
+        print(
+            f"[Cluster] {len(members)} member(s), owning {len(owned)}/{config.CLUSTER_SLOTS} slots "
+            f"(+{gained} -{lost})"
+        )
+        for callback in self._on_rebalance:
+            callback()
+
+    def owned_slots(self) -> Optional[FrozenSet[int]]:
+        """Slots this replica processes, or None for all of them."""
+        return self.owned if self.enabled else None
+
+    def owner_of(self, key: str) -> Optional[str]:
+        if not self.enabled or self.ring is None:
+            return None
+        return self.ring.owner(slot_for(key))
+
+    def is_local(self, key: str) -> bool:
+        owner = self.owner_of(key)
+        return owner is None or owner == self.self_url
+
+    def wake(self, owner: str):
+        """Tell the owner of a freshly stored update to claim it (fire and forget)."""
+        self.forwarded += 1
+        spawn(self._wake(owner))
+
+    async def _wake(self, owner: str):
+        try:
+            response = await self._client.post(
+                f"{owner}/internal/wake",
+                headers={"x-cluster-token": config.CLUSTER_TOKEN},
+            )
+            response.raise_for_status()
+        except Exception as e:
+            # The owner still finds the job on its next poll
+            self.forward_errors += 1
+            print(f"[Cluster] Failed to wake {urlparse(owner).netloc}: {e}")
+
+    def check_token(self, token: str) -> bool:
+        return hmac.compare_digest(token.encode(), config.CLUSTER_TOKEN.encode())
+
+    def stats(self) -> dict:
+        if not self.enabled:
+            return {"enabled": False}
+        return {
+            "enabled": True,
+            "self": self.self_url,
+            "members": self.members,
+            "owned_slots": len(self.owned or ()),
+            "total_slots": config.CLUSTER_SLOTS,
+            "rebalances": self.rebalances,
+            "forwarded": self.forwarded,
+            "forward_errors": self.forward_errors,
+        }
+
+
+cluster = Cluster()
@@ -0,0 +1,262 @@
+import hashlib
+import re
+from typing import List, Optional, Tuple
+
+from config import config
+from db.cache import LRUCache
+
+
+FENCE_RE = re.compile(r"^\s*```\s*([\w+#.-]*)")
+CLOSING_FENCE_RE = re.compile(r"^\s*```\s*$")
+HEADING_RE = re.compile(r"^\s{0,3}#{1,6}\s+(.*?)(?:\s+#+)?\s*$")
+QUOTE_RE = re.compile(r"^\s{0,3}>\s?(.*)$")
+RULE_RE = re.compile(r"^\s{0,3}([-*_])(?:\s*\1){2,}\s*$")
+BULLET_RE = re.compile(r"^(\s*)[-*+]\s+(.*)$")
+LINK_RE = re.compile(r"\[([^\]\n]+)\]\(\s*<?([^()<>\s]+)>?(?:\s+\"[^\"\n]*\")?\s*\)")
+
+# URL schemes Telegram accepts in a text_link; other links stay as written
+LINK_SCHEMES = ("http://", "https://", "tg://", "mailto:")
+ESCAPABLE = set("\\`*_{}[]()#+-.!~>|")
+
+# Emphasis delimiters and their entities, longest first. Single asterisks are
+# bold, as in Telegram's own Markdown and this bot's messages.
+EMPHASIS = (
+    ("***", ("bold", "italic")), ("**", ("bold",)), ("__", ("bold",)),
+    ("~~", ("strikethrough",)), ("*", ("bold",)), ("_", ("italic",)),
+)
+
+Rendered = Tuple[str, List[dict]]
+
+
+def _utf16_len(text: str) -> int:
+    # Entity offsets and lengths are counted in UTF-16 code units
+    return len(text.encode("utf-16-le")) // 2
+
+
+class _Output:
+    """Plain text being built, with the entities that format it."""
+
+    def __init__(self):
+        self.parts: List[str] = []
+        self.offset = 0
+        self.entities: List[dict] = []
+
+    def add(self, text: str):
+        if text:
+            self.parts.append(text)
+            self.offset += _utf16_len(text)
+
+    def entity(self, kind: str, start: int, **extra) -> Optional[dict]:
+        """Format everything added since `start` (an earlier offset) as `kind`."""
+        if self.offset <= start:
+            return None
+        entity = {"type": kind, "offset": start, "length": self.offset - start, **extra}
+        self.entities.append(entity)
+        return entity
+
+
+def _is_link_url(url: str) -> bool:
+    lowered = url.lower()
+    return any(lowered.startswith(scheme) and len(url) > len(scheme) for scheme in LINK_SCHEMES)
+
+
+def _word_edge(token: str) -> bool:
+    return not any(char.isalnum() for char in token)
+
+
+def _emphasis_close(text: str, i: int, delim: str) -> Optional[int]:
+    """Index of the delimiter closing the one at `i`, or None if it doesn't open a span.
+
+    Underscores only count around whole words: nothing but punctuation may
+    stand between them and the surrounding whitespace, so __init__.py and
+    snake_case stay as written.
+    """
+    start = i + len(delim)
+    if start >= len(text) or text[start].isspace():
+        return None
+    if delim != "~~" and i > 0 and text[i - 1].isalnum():
+        return None  # Inside a word, e.g. snake_case or 2*3
+    underscore = delim[0] == "_"
+    if underscore and not _word_edge(re.split(r"\s", text[:i])[-1]):
+        return None
+    j = start
+    while True:
+        j = text.find(delim, j + 1)
+        if j == -1:
+            return None
+        after = j + len(delim)
+        if text[j - 1].isspace():
+            continue
+        if len(delim) == 1 and text[after:after + 1] == delim:
+            j = after  # Part of a double delimiter, e.g. a nested **bold**
+            continue
+        if delim != "~~" and text[after:after + 1].isalnum():
+            continue
+        if underscore and not _word_edge(re.split(r"\s", text[after:], 1)[0]):
+            continue
+        return j
+
+
+def _render_inline(text: str, out: _Output):
+    """Append one line of Markdown, turning code spans, links and emphasis into entities."""
+    i = plain = 0
+    while i < len(text):
+        char = text[i]
+
+        if char == "\\" and text[i + 1:i + 2] in ESCAPABLE:
+            out.add(text[plain:i])
+            out.add(text[i + 1])
+            i = plain = i + 2
+            continue
+
+        if char == "`":
+            run = len(text[i:]) - len(text[i:].lstrip("`"))
+            close = text.find("`" * run, i + run)
+            code = text[i + run:close] if close != -1 else ""
+            if not code.strip():
+                i += run
+                continue
+            if len(code) > 2 and code[0] == code[-1] == " ":
+                code = code[1:-1]
+            out.add(text[plain:i])
+            start = out.offset
+            out.add(code)
+            out.entity("code", start)
+            i = plain = close + run
+            continue
+
+        if char == "[":
+            link = LINK_RE.match(text, i)
+            if link and _is_link_url(link.group(2)):
+                out.add(text[plain:i])
+                start = out.offset
+                _render_inline(link.group(1), out)
+                out.entity("text_link", start, url=link.group(2))
+                i = plain = link.end()
+                continue
+
+        for delim, kinds in EMPHASIS:
+            if text.startswith(delim, i):
+                close = _emphasis_close(text, i, delim)
+                if close is None and delim == "***":
+                    continue  # Maybe ** or * with a shorter closer, e.g. ***bold** text*
+                if close is None:
+                    # Leave the whole run of markers as written
+                    i += len(text[i:]) - len(text[i:].lstrip(char))
+                else:
+                    out.add(text[plain:i])
+                    start = out.offset
+                    _render_inline(text[i + len(delim):close], out)
+                    for kind in kinds:
+                        out.entity(kind, start)
+                    i = plain = close + len(delim)
+                break
+        else:
+            i += 1
+    out.add(text[plain:])
+
+
+def _trim(text: str, entities: List[dict]) -> Rendered:
+    """Strip surrounding whitespace (Telegram does) and shift the entities to match."""
+    stripped = text.strip()
+    lead = _utf16_len(text[:len(text) - len(text.lstrip())])
+    size = _utf16_len(stripped)
+    trimmed = []
+    for entity in entities:
+        offset = max(0, entity["offset"] - lead)
+        end = min(size, entity["offset"] + entity["length"] - lead)
+        if end > offset:
+            trimmed.append({**entity, "offset": offset, "length": end - offset})
+    trimmed.sort(key=lambda e: (e["offset"], -e["length"]))
+    return stripped, trimmed
+
+
+def render_markdown(markdown: str) -> Rendered:
+    """Convert agent Markdown to plain text plus Telegram MessageEntity dicts.
+
+    Handles code fences, inline code, headings, bullet lists, quotes,
+    links and emphasis. The result needs no parse_mode, so Telegram never
+    rejects it; markup that doesn't close is left as written.
+    """
+    out = _Output()
+    lines = markdown.split("\n")
+    quote: Optional[dict] = None
+    i = 0
+    while i < len(lines):
+        line = lines[i]
+        if i:
+            out.add("\n")
+
+        fence = FENCE_RE.match(line)
+        if fence:
+            end = next((j for j in range(i + 1, len(lines)) if CLOSING_FENCE_RE.match(lines[j])), len(lines))
+            start = out.offset
+            out.add("\n".join(lines[i + 1:end]))
+            language = {"language": fence.group(1)} if fence.group(1) else {}
+            out.entity("pre", start, **language)
+            i = end + 1
+            continue
+
+        match = QUOTE_RE.match(line)
+        if match:
+            start = out.offset
+            _render_inline(match.group(1), out)
+            if quote is not None and quote["offset"] + quote["length"] + 1 >= start:
+                # Consecutive quoted lines form one quote
+                quote["length"] = out.offset - quote["offset"]
+            else:
+                quote = out.entity("blockquote", start)
+            i += 1
+            continue
+
+        match = HEADING_RE.match(line)
+        if match:
+            start = out.offset
+            _render_inline(match.group(1), out)
+            out.entity("bold", start)
+        elif RULE_RE.match(line):
+            out.add("———")
+        else:
+            match = BULLET_RE.match(line)
+            if match:
+                out.add(f"{match.group(1)}• ")
+                _render_inline(match.group(2), out)
+            else:
+                _render_inline(line, out)
+        i += 1
+
+    text, entities = _trim("".join(out.parts), out.entities)
+    if not text:
+        # Nothing but markup (e.g. an empty code block): send it as written
+        return markdown, []
+    return text, entities
+
+
+class MarkdownRenderer:
+    """`render_markdown` with results cached by content hash.
+
+    Command replies like /help and other templated messages are rendered
+    once; every later send reuses the cached text and entities.
+    """
+
+    def __init__(self, cache_size: int):
+        self._cache = LRUCache(cache_size)
+        self.hits = 0
+        self.misses = 0
+
+    def render(self, markdown: str) -> Rendered:
+        key = hashlib.blake2b(markdown.encode("utf-8"), digest_size=16).digest()
+        rendered = self._cache.get(key)
+        if rendered is not None:
+            self.hits += 1
+            return rendered
+        self.misses += 1
+        rendered = render_markdown(markdown)
+        self._cache.set(key, rendered)
+        return rendered
+
+    def stats(self) -> dict:
+        return {"cached": len(self._cache), "hits": self.hits, "misses": self.misses}
+
+
+markdown_renderer = MarkdownRenderer(config.MARKDOWN_CACHE_SIZE)
@@ -0,0 +1,212 @@
+import asyncio
+import itertools
+import time
+from typing import Dict, List, Optional, Tuple
+
+import httpx
+
+from config import config
+from http_clients import get_telegram_client
+from metrics import observe_telegram
+from tracing import span
+
+
+# Priority lanes, lowest value is served first
+PRIORITY_INTERACTIVE = 0
+PRIORITY_EDIT = 1
+PRIORITY_TYPING = 2
+PRIORITY_BULK = 3
+
+
+class TokenBucket:
+    """Classic token bucket: `rate` tokens per second, up to `burst` stored."""
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+
+    def _refill(self, now: float):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, now: float) -> float:
+        """Seconds until one token is available (0 if available now)."""
+        if now < self.paused_until:
+            return self.paused_until - now
+        self._refill(now)
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+    def pause(self, seconds: float):
+        """Stop handing out tokens for `seconds` (Telegram flood wait)."""
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+        self.tokens = 0
+
+    def is_idle(self, now: float) -> bool:
+        self._refill(now)
+        return self.tokens >= self.burst and now >= self.paused_until
+
+
+class OutboundScheduler:
+    """Central scheduler for outbound Telegram Bot API calls.
+
+    Every call waits for a token from the global bucket and from its chat's
+    bucket (groups get a slower bucket than private chats). Waiting calls are
+    granted in priority order, so interactive replies overtake typing actions
+    and bulk notifications. A 429 response pauses the affected bucket for the
+    `retry_after` Telegram asks for and the call is retried.
+    """
+
+    def __init__(self):
+        self.global_bucket = TokenBucket(config.TELEGRAM_GLOBAL_RATE, config.TELEGRAM_GLOBAL_RATE)
+        self._chat_buckets: Dict[int, TokenBucket] = {}
+        self._waiters: List[Tuple[int, int, Optional[int], asyncio.Future]] = []
+        self._seq = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self.rate_limited = 0
+
+    def _chat_bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            if len(self._chat_buckets) >= config.TELEGRAM_MAX_CHAT_BUCKETS:
+                self._prune_buckets()
+            if isinstance(chat_id, int) and chat_id < 0:
+                # Group and channel chats have a per-minute cap
+                bucket = TokenBucket(config.TELEGRAM_GROUP_RATE_PER_MIN / 60.0, config.TELEGRAM_CHAT_BURST)
+            else:
+                bucket = TokenBucket(config.TELEGRAM_CHAT_RATE, config.TELEGRAM_CHAT_BURST)
+            self._chat_buckets[chat_id] = bucket
+        return bucket
+
+    def _prune_buckets(self):
+        now = time.monotonic()
+        for chat_id in [c for c, b in self._chat_buckets.items() if b.is_idle(now)]:
+            del self._chat_buckets[chat_id]
+
+    async def acquire(self, chat_id: Optional[int], priority: int):
+        """Wait until a call for `chat_id` may be sent."""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._pump(), name="telegram-outbound")
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.append((priority, next(self._seq), chat_id, future))
+        self._wakeup.set()
+        await future
+
+    async def _pump(self):
+        while True:
+            self._waiters = [w for w in self._waiters if not w[3].done()]
+            if not self._waiters:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            now = time.monotonic()
+            global_delay = self.global_bucket.delay(now)
+            if global_delay > 0:
+                await self._sleep(global_delay)
+                continue
+
+            # Highest priority waiter whose chat has a token; others keep waiting
+            next_delay = None
+            for waiter in sorted(self._waiters):
+                chat_id = waiter[2]
+                chat_delay = self._chat_bucket(chat_id).delay(now) if chat_id is not None else 0.0
+                if chat_delay == 0:
+                    self.global_bucket.take()
+                    if chat_id is not None:
+                        self._chat_buckets[chat_id].take()
+                    self._waiters.remove(waiter)
+                    waiter[3].set_result(None)
+                    next_delay = 0.0
+                    break
+                next_delay = chat_delay if next_delay is None else min(next_delay, chat_delay)
+
+            if next_delay:
+                await self._sleep(next_delay)
+
+    async def _sleep(self, seconds: float):
+        """Sleep, but wake early when a new waiter arrives."""
+        self._wakeup.clear()
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), timeout=seconds)
+        except asyncio.TimeoutError:
+            pass
+
+    def flood_wait(self, chat_id: Optional[int], retry_after: float):
+        """Apply a 429 retry_after to the chat, or globally if there is no chat."""
+        self.rate_limited += 1
+        bucket = self._chat_bucket(chat_id) if chat_id is not None else self.global_bucket
+        bucket.pause(retry_after)
+        print(f"[Telegram] Rate limited (chat {chat_id}), retrying after {retry_after}s")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        for waiter in self._waiters:
+            waiter[3].cancel()
+        self._waiters = []
+
+    def stats(self) -> dict:
+        by_priority: Dict[int, int] = {}
+        for waiter in self._waiters:
+            by_priority[waiter[0]] = by_priority.get(waiter[0], 0) + 1
+        return {
+            "waiting": len(self._waiters),
+            "waiting_by_priority": by_priority,
+            "chat_buckets": len(self._chat_buckets),
+            "rate_limited": self.rate_limited,
+        }
+
+
+outbound = OutboundScheduler()
+
+
+def _retry_after(response: httpx.Response) -> float:
+    try:
+        return float(response.json().get("parameters", {}).get("retry_after", 1))
+    except ValueError:
+        return 1.0
+
+
+async def telegram_request(
+    method: str,
+    payload: dict,
+    priority: int = PRIORITY_INTERACTIVE,
+    chat_id: Optional[int] = None,
+    files: Optional[dict] = None
+) -> httpx.Response:
+    """Call a Bot API method through the outbound scheduler, honoring 429 retry_after.
+
+    With `files`, the call is sent as multipart form data (e.g. sendDocument).
+    """
+    if chat_id is None:
+        chat_id = payload.get("chat_id")
+    client = get_telegram_client()
+    attempt = 0
+    with span(f"telegram.{method}", chat_id=chat_id) as attrs:
+        while True:
+            queued = time.perf_counter()
+            await outbound.acquire(chat_id, priority)
+            started = time.perf_counter()
+            attrs["wait_ms"] = round((started - queued) * 1000, 3)
+            if files:
+                response = await client.post(f"/{method}", data=payload, files=files)
+            else:
+                response = await client.post(f"/{method}", json=payload)
+            observe_telegram(method, response.status_code, time.perf_counter() - started)
+            attrs["status"] = response.status_code
+            if response.status_code != 429 or attempt >= config.TELEGRAM_MAX_RETRIES:
+                return response
+            attempt += 1
+            attrs["retries"] = attempt
+            outbound.flood_wait(chat_id, _retry_after(response))
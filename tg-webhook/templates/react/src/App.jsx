@@ -0,0 +1,9 @@
+function App() {
+  return (
+    <main>
+      <h1>React App</h1>
+    </main>
+  )
+}
+
+export default App
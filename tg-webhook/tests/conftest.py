@@ -0,0 +1,53 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from config import config
+from db import init_db, close_db, get_db, clear_user_cache, clear_session_cache
+from db import updates as db_updates
+
+
+# Tables emptied between Postgres tests; bot_state keeps the schema version
+TABLES = "agent_runs, jobs, processed_updates, sessions, projects, users"
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+@pytest.fixture(scope="session")
+def postgres_url(tmp_path_factory):
+    """TEST_DATABASE_URL, or a throwaway local server via the pgserver package."""
+    url = os.getenv("TEST_DATABASE_URL")
+    if url:
+        yield url
+        return
+    pgserver = pytest.importorskip("pgserver", reason="needs TEST_DATABASE_URL or pgserver")
+    server = pgserver.get_server(str(tmp_path_factory.mktemp("pg")), cleanup_mode="delete")
+    yield server.get_uri()
+    server.cleanup()
+
+
+@pytest.fixture(params=["sqlite", "postgres"])
+async def storage(request, tmp_path, monkeypatch):
+    """An initialized, empty database on each backend."""
+    if request.param == "postgres":
+        monkeypatch.setattr(config, "DATABASE_URL", request.getfixturevalue("postgres_url"))
+    monkeypatch.setattr(config, "DB_BACKEND", request.param)
+    monkeypatch.setattr(config, "DATA_DIR", str(tmp_path))
+    await init_db()
+    try:
+        yield request.param
+    finally:
+        if request.param == "postgres":
+            async with get_db() as db:
+                await db.execute(f"TRUNCATE {TABLES} RESTART IDENTITY CASCADE")
+                await db.execute("DELETE FROM bot_state WHERE key <> 'schema_version'")
+                await db.commit()
+        await close_db()
+        clear_user_cache()
+        clear_session_cache()
+        db_updates._recent_updates.clear()
@@ -0,0 +1,68 @@
+import pytest
+
+import agent_runs as agent_runs_module
+from agent_runs import AgentRunTracker, new_message_id, run_outcome
+from dispatcher import QueueFull
+
+
+def user(message_id, created=0):
+    return {"info": {"id": message_id, "role": "user", "time": {"created": created}}, "parts": []}
+
+
+def assistant(message_id, text, completed=True, error=None):
+    info = {"id": message_id, "role": "assistant", "time": {"created": 0}}
+    if completed:
+        info["time"]["completed"] = 1
+    if error:
+        info["error"] = error
+    return {"info": info, "parts": [{"type": "text", "text": text}]}
+
+
+def test_message_ids_ascend():
+    ids = [new_message_id() for _ in range(100)]
+    assert ids == sorted(ids)
+    assert all(i.startswith("msg_") and len(i) == 30 for i in ids)
+
+
+def test_outcome_waits_for_its_own_prompt():
+    # The previous exchange is finished, but our prompt isn't stored yet
+    messages = [user("msg_a"), assistant("msg_b", "old")]
+    assert run_outcome(messages, "msg_c") is None
+
+    messages.append(user("msg_c"))
+    assert run_outcome(messages, "msg_c") is None
+    messages.append(assistant("msg_d", "working", completed=False))
+    assert run_outcome(messages, "msg_c") is None
+
+    messages[-1] = assistant("msg_d", "done")
+    assert run_outcome(messages, "msg_c") == ("done", None)
+
+
+def test_outcome_stops_at_the_next_prompt():
+    messages = [
+        user("msg_a"), assistant("msg_b", "first"),
+        user("msg_c"), assistant("msg_d", "second"),
+    ]
+    assert run_outcome(messages, "msg_a") == ("first", None)
+    assert run_outcome(messages, "msg_c") == ("second", None)
+
+
+def test_outcome_reports_errors():
+    messages = [user("msg_a"), assistant("msg_b", "", error={"name": "APIError", "data": {"message": "boom"}})]
+    assert run_outcome(messages, "msg_a") == ("", "boom")
+
+
+def test_runs_without_message_id_match_by_time():
+    messages = [user("msg_a", created=1_000_000), assistant("msg_b", "reply")]
+    assert run_outcome(messages, None, since_ms=1_000_000) == ("reply", None)
+    assert run_outcome(messages, None, since_ms=2_000_000) is None
+
+
+@pytest.mark.anyio
+async def test_submit_refused_beyond_max_running(monkeypatch):
+    tracker = AgentRunTracker(poll_interval=60, timeout=60, max_running=1)
+    monkeypatch.setattr(agent_runs_module, "create_agent_run", pytest.fail)
+    tracker._runs["ses_busy"] = object()
+
+    with pytest.raises(QueueFull):
+        await tracker.submit(1, "ses_new", 42, "hi")
@@ -0,0 +1,129 @@
+import asyncio
+
+import httpx
+import pytest
+
+import chat_actions as chat_actions_module
+from chat_actions import ChatActionHeartbeat, TimerWheel
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+def sent(monkeypatch):
+    calls = []
+
+    async def telegram_request(method, payload, priority):
+        calls.append(payload["chat_id"])
+        return httpx.Response(200)
+
+    monkeypatch.setattr(chat_actions_module, "telegram_request", telegram_request)
+    return calls
+
+
+@pytest.fixture
+async def heartbeat():
+    heartbeat = ChatActionHeartbeat(interval=0.05, tick=0.01, senders=2)
+    yield heartbeat
+    await heartbeat.stop()
+
+
+def test_wheel_fires_after_delay():
+    wheel = TimerWheel(tick=1, slots=4)
+    wheel.schedule("a", 2)
+    assert wheel.advance() == []
+    assert wheel.advance() == ["a"]
+    assert len(wheel) == 0
+
+
+def test_wheel_waits_out_extra_rounds():
+    wheel = TimerWheel(tick=1, slots=4)
+    wheel.schedule("far", 6)
+    fired = [tick for tick in range(1, 10) if wheel.advance()]
+    assert fired == [6]
+
+
+def test_wheel_cancel_and_reschedule():
+    wheel = TimerWheel(tick=1, slots=4)
+    wheel.schedule("a", 1)
+    wheel.cancel("a")
+    assert wheel.advance() == []
+    wheel.schedule("b", 1)
+    wheel.schedule("b", 3)  # Replaces the earlier timer
+    assert [wheel.advance() for _ in range(3)] == [[], [], ["b"]]
+
+
+async def test_action_is_refreshed_while_held(sent, heartbeat):
+    heartbeat.hold(1)
+    await asyncio.sleep(0.18)
+    # Sent right away, then about every 50ms
+    assert 3 <= sent.count(1) <= 5
+
+
+async def test_release_stops_refreshes(sent, heartbeat):
+    heartbeat.hold(1)
+    await asyncio.sleep(0.02)
+    heartbeat.release(1)
+    sent_at_release = len(sent)
+    await asyncio.sleep(0.15)
+
+    assert sent_at_release == 1
+    assert len(sent) == 1
+    assert heartbeat.stats()["active_chats"] == 0
+    assert heartbeat.stats()["scheduled"] == 0
+
+
+async def test_holds_nest(sent, heartbeat):
+    with heartbeat.keep(1):
+        heartbeat.hold(1)
+        await asyncio.sleep(0.01)
+    # The inner hold (e.g. a background run) outlives the block
+    assert heartbeat.stats()["active_chats"] == 1
+    heartbeat.release(1)
+    assert heartbeat.stats()["active_chats"] == 0
+    assert sent == [1]
+
+
+async def test_blocked_chat_is_not_refreshed(monkeypatch, heartbeat):
+    calls = []
+
+    async def telegram_request(method, payload, priority):
+        calls.append(payload["chat_id"])
+        return httpx.Response(403)
+
+    monkeypatch.setattr(chat_actions_module, "telegram_request", telegram_request)
+    heartbeat.hold(1)
+    await asyncio.sleep(0.15)
+    assert calls == [1]
+    assert heartbeat.stats()["failed"] == 1
+
+
+async def test_heartbeat_stops_when_run_finishes(sent, heartbeat, monkeypatch):
+    import agent_runs as agent_runs_module
+    from agent_runs import AgentRunTracker
+    from db import AgentRun
+
+    async def finish_agent_run(run_id, status, error=None):
+        return True
+
+    delivered = []
+
+    async def deliver(chat_id, text):
+        delivered.append((chat_id, text))
+
+    monkeypatch.setattr(agent_runs_module, "chat_actions", heartbeat)
+    monkeypatch.setattr(agent_runs_module, "finish_agent_run", finish_agent_run)
+    tracker = AgentRunTracker(poll_interval=60, timeout=60)
+    tracker._deliver = deliver
+    run = AgentRun(1, 1, "ses_1", 7, "running", None, None, None, None, "msg_1")
+
+    tracker._track(run)
+    await asyncio.sleep(0.08)
+    assert sent.count(7) >= 2
+
+    await tracker._finish(run, "completed", "done")
+    refreshes = len(sent)
+    await asyncio.sleep(0.1)
+    assert len(sent) == refreshes
+    assert heartbeat.stats()["active_chats"] == 0
+    assert delivered == [(7, "done")]
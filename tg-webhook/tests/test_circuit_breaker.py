@@ -0,0 +1,136 @@
+import time
+
+import httpx
+import pytest
+
+from circuit_breaker import (
+    BreakerTransport,
+    CircuitBreaker,
+    CircuitOpenError,
+    CLOSED,
+    HALF_OPEN,
+    OPEN,
+)
+
+pytestmark = pytest.mark.anyio
+
+
+class FakeClock:
+    def __init__(self, monkeypatch):
+        self.now = 1000.0
+        monkeypatch.setattr(time, "monotonic", lambda: self.now)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    return FakeClock(monkeypatch)
+
+
+def trip(breaker: CircuitBreaker):
+    for _ in range(breaker.failure_threshold):
+        breaker.before_call()
+        breaker.record_failure()
+
+
+def test_opens_after_consecutive_failures(clock):
+    breaker = CircuitBreaker("test", failure_threshold=3, reset_timeout=30)
+    breaker.record_failure()
+    breaker.record_failure()
+    breaker.record_success()  # Not consecutive any more
+    breaker.record_failure()
+    assert breaker.state == CLOSED
+
+    breaker.record_failure()
+    breaker.record_failure()
+    assert breaker.state == OPEN
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+    assert breaker.stats()["rejected"] == 1
+    assert breaker.retry_after() == 30
+
+
+def test_half_open_lets_one_probe_through(clock):
+    breaker = CircuitBreaker("test", failure_threshold=2, reset_timeout=30)
+    trip(breaker)
+
+    clock.now += 30
+    breaker.before_call()
+    assert breaker.state == HALF_OPEN
+    # Only the probe goes out; everything else fails fast until it returns
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+
+    breaker.record_success()
+    assert breaker.state == CLOSED
+    breaker.before_call()
+    breaker.before_call()
+
+
+def test_failed_probe_reopens(clock):
+    breaker = CircuitBreaker("test", failure_threshold=2, reset_timeout=30)
+    trip(breaker)
+    clock.now += 30
+    breaker.before_call()
+    breaker.record_failure()
+
+    assert breaker.state == OPEN
+    assert breaker.stats()["trips"] == 2
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+
+    clock.now += 30
+    breaker.before_call()
+    breaker.record_success()
+    assert breaker.state == CLOSED
+
+
+def test_cancelled_probe_frees_the_probe_slot(clock):
+    breaker = CircuitBreaker("test", failure_threshold=1, reset_timeout=30)
+    trip(breaker)
+    clock.now += 30
+    breaker.before_call()
+    breaker.record_cancelled()
+
+    assert breaker.state == HALF_OPEN
+    breaker.before_call()  # The next call probes instead
+
+
+def test_disabled_breaker_never_opens():
+    breaker = CircuitBreaker("test", failure_threshold=0, reset_timeout=30)
+    for _ in range(10):
+        breaker.record_failure()
+        breaker.before_call()
+
+
+def transport_for(breaker: CircuitBreaker, handler) -> httpx.AsyncClient:
+    return httpx.AsyncClient(transport=BreakerTransport(httpx.MockTransport(handler), breaker), base_url="http://oc")
+
+
+async def test_transport_counts_only_upstream_failures():
+    breaker = CircuitBreaker("test", failure_threshold=2, reset_timeout=30)
+    outcomes = iter([
+        httpx.ReadTimeout("slow agent"),
+        httpx.Response(404),
+        httpx.Response(503),
+        httpx.ConnectError("refused"),
+    ])
+
+    def handler(request):
+        outcome = next(outcomes)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    async with transport_for(breaker, handler) as client:
+        with pytest.raises(httpx.ReadTimeout):
+            await client.get("/")
+        assert (await client.get("/")).status_code == 404
+        assert breaker.failures == 0
+
+        assert (await client.get("/")).status_code == 503
+        with pytest.raises(httpx.ConnectError):
+            await client.get("/")
+        assert breaker.state == OPEN
+
+        with pytest.raises(CircuitOpenError):
+            await client.get("/")
@@ -0,0 +1,139 @@
+import asyncio
+
+import pytest
+
+from db import (
+    enqueue_job,
+    claim_next_job,
+    complete_job,
+    retry_job,
+    fail_job,
+    touch_jobs,
+    requeue_running_jobs,
+    count_pending_jobs,
+)
+from db.database import get_db, utc_timestamp
+from sharding import slot_for
+
+pytestmark = pytest.mark.anyio
+
+
+def message(update_id: int, chat_id: int) -> dict:
+    return {"update_id": update_id, "message": {"chat": {"id": chat_id}, "text": "hi"}}
+
+
+async def test_claims_oldest_job_first(storage):
+    first = await enqueue_job(message(1, 10))
+    second = await enqueue_job(message(2, 20))
+
+    job = await claim_next_job()
+    assert job.id == first
+    assert job.status == "running"
+    assert job.attempts == 1
+    assert job.payload == message(1, 10)
+    assert (await claim_next_job()).id == second
+    assert await claim_next_job() is None
+
+
+async def test_complete_and_fail(storage):
+    done = await enqueue_job(message(1, 10))
+    broken = await enqueue_job(message(2, 20))
+    await claim_next_job()
+    await claim_next_job()
+    assert await count_pending_jobs() == 2
+
+    await complete_job(done)
+    await fail_job(broken, "boom")
+    assert await count_pending_jobs() == 0
+    assert await claim_next_job() is None
+
+
+async def test_retry_waits_for_backoff(storage):
+    job_id = await enqueue_job(message(1, 10))
+    await claim_next_job()
+
+    await retry_job(job_id, "timeout", delay_seconds=60)
+    assert await claim_next_job() is None
+
+    await retry_job(job_id, "timeout", delay_seconds=0)
+    job = await claim_next_job()
+    assert job.id == job_id
+    assert job.attempts == 2
+    assert job.last_error == "timeout"
+
+
+async def test_requeue_running_jobs(storage):
+    job_id = await enqueue_job(message(1, 10))
+    await claim_next_job()
+
+    assert await requeue_running_jobs(stale_after=60) == 0
+    assert await requeue_running_jobs() == 1
+    assert (await claim_next_job()).id == job_id
+
+
+async def test_sharded_claim_only_takes_owned_slots(storage):
+    await enqueue_job(message(1, 10))
+    owned = await enqueue_job(message(2, 20))
+
+    assert await claim_next_job(slots=set(), claimer="a") is None
+    job = await claim_next_job(slots={slot_for("20")}, claimer="a")
+    assert job.id == owned
+
+
+async def test_chat_running_elsewhere_is_not_claimed(storage):
+    slots = {slot_for("10")}
+    await enqueue_job(message(1, 10))
+    await enqueue_job(message(2, 10))
+    await claim_next_job(slots=slots, claimer="old-owner")
+
+    # After a rebalance the new owner waits for the old owner's job
+    assert await claim_next_job(slots=slots, claimer="new-owner") is None
+
+
+async def test_chat_runs_one_job_at_a_time(storage):
+    first = await enqueue_job(message(1, 10))
+    await enqueue_job(message(2, 10))
+    other_chat = await enqueue_job(message(3, 20))
+
+    assert (await claim_next_job()).id == first
+    assert (await claim_next_job()).id == other_chat
+    assert await claim_next_job() is None
+
+
+async def test_retry_backoff_holds_back_later_jobs_of_the_chat(storage):
+    project = await enqueue_job(message(1, 10))
+    follow_up = await enqueue_job(message(2, 10))
+    await claim_next_job()
+    await retry_job(project, "timeout", delay_seconds=60)
+
+    assert await claim_next_job() is None
+
+    await retry_job(project, "timeout", delay_seconds=0)
+    assert (await claim_next_job()).id == project
+    await complete_job(project)
+    assert (await claim_next_job()).id == follow_up
+
+
+async def test_concurrent_claims_start_one_job_per_chat(storage):
+    slots = {slot_for("10")}
+    for update_id in range(1, 5):
+        await enqueue_job(message(update_id, 10))
+
+    claimed = await asyncio.gather(*(
+        claim_next_job(slots=slots, claimer=replica) for replica in ("a", "b", "c", "d")
+    ))
+    assert len([job for job in claimed if job is not None]) == 1
+
+
+async def test_touched_jobs_are_not_stale(storage):
+    stale = await enqueue_job(message(1, 10))
+    alive = await enqueue_job(message(2, 20))
+    await claim_next_job()
+    await claim_next_job()
+    async with get_db() as db:
+        await db.execute("UPDATE jobs SET updated_at = ?", (utc_timestamp(-120),))
+        await db.commit()
+
+    await touch_jobs([alive])
+    assert await requeue_running_jobs(stale_after=60) == 1
+    assert (await claim_next_job()).id == stale
@@ -0,0 +1,31 @@
+import pytest
+
+from db import (
+    get_or_create_user,
+    create_session,
+    create_agent_run,
+    get_running_agent_run,
+    get_running_agent_runs,
+    finish_agent_run,
+    count_running_agent_runs,
+)
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_run_finishes_once(storage):
+    user = await get_or_create_user(42)
+    session = await create_session(user.id, "ses_1")
+    run = await create_agent_run(session.id, "ses_1", chat_id=42, message_id="msg_1")
+
+    assert run.status == "running"
+    assert run.message_id == "msg_1"
+    assert (await get_running_agent_run("ses_1")).id == run.id
+    assert [r.id for r in await get_running_agent_runs()] == [run.id]
+    assert await count_running_agent_runs() == 1
+
+    assert await finish_agent_run(run.id, "completed")
+    # A second caller (or replica) must not deliver the result again
+    assert not await finish_agent_run(run.id, "failed", "late")
+    assert await get_running_agent_run("ses_1") is None
+    assert await count_running_agent_runs() == 0
@@ -0,0 +1,67 @@
+import asyncio
+
+import pytest
+
+from db import (
+    get_db,
+    get_or_create_user,
+    create_session,
+    get_active_session_for_user,
+    deactivate_all_user_sessions,
+)
+from db.database import INVALIDATION_CHANNEL, handle_invalidation
+from db import sessions as db_sessions
+
+pytestmark = pytest.mark.anyio
+
+
+async def add_project(user_id: int, name: str) -> int:
+    async with get_db() as db:
+        cursor = await db.execute(
+            "INSERT INTO projects (user_id, name, path) VALUES (?, ?, ?) RETURNING id",
+            (user_id, name, f"/tmp/{name}")
+        )
+        row = await cursor.fetchone()
+        await db.commit()
+        return row["id"]
+
+
+async def test_one_active_session_per_user_and_project(storage):
+    user = await get_or_create_user(42)
+    project = await add_project(user.id, "demo")
+
+    first = await create_session(user.id, "ses_1")
+    # A replica that lost the race gets the session that was created first
+    assert (await create_session(user.id, "ses_2")).opencode_session_id == "ses_1"
+    assert (await create_session(user.id, "ses_3", project_id=project)).opencode_session_id == "ses_3"
+    assert (await get_active_session_for_user(user.id)).id == first.id
+
+    await deactivate_all_user_sessions(user.id)
+    assert await get_active_session_for_user(user.id) is None
+    assert (await create_session(user.id, "ses_4")).opencode_session_id == "ses_4"
+
+
+async def test_announced_invalidation_drops_cached_sessions(storage):
+    user = await get_or_create_user(42)
+    await create_session(user.id, "ses_1")
+    assert await get_active_session_for_user(user.id) is not None
+
+    handle_invalidation(f"other-replica:sessions:{user.id}")
+    assert len(db_sessions._active_sessions) == 0
+
+
+async def test_invalidations_reach_other_replicas(storage):
+    if storage != "postgres":
+        pytest.skip("only Postgres is shared between replicas")
+    user = await get_or_create_user(42)
+    await create_session(user.id, "ses_1")
+    await get_active_session_for_user(user.id)
+
+    async with get_db() as db:
+        await db.execute("SELECT pg_notify(?, ?)", (INVALIDATION_CHANNEL, f"other-replica:sessions:{user.id}"))
+        await db.commit()
+    for _ in range(100):
+        if not len(db_sessions._active_sessions):
+            break
+        await asyncio.sleep(0.01)
+    assert len(db_sessions._active_sessions) == 0
@@ -0,0 +1,66 @@
+import pytest
+
+from db import enqueue_update, enqueue_updates, get_polling_offset, is_known_update, claim_next_job
+from db import updates as db_updates
+
+pytestmark = pytest.mark.anyio
+
+
+def message(update_id: int, chat_id: int = 10) -> dict:
+    return {"update_id": update_id, "message": {"chat": {"id": chat_id}, "text": "hi"}}
+
+
+async def test_redelivered_update_is_dropped(storage):
+    assert await enqueue_update(message(1)) is not None
+    assert await enqueue_update(message(1)) is None
+    assert (await claim_next_job()).payload == message(1)
+    assert await claim_next_job() is None
+
+
+async def test_table_dedups_after_restart(storage):
+    await enqueue_update(message(1))
+    db_updates._recent_updates.clear()
+
+    assert not is_known_update(1)
+    assert await enqueue_update(message(1)) is None
+    assert is_known_update(1)
+
+
+async def test_batch_skips_duplicates_and_stores_offset(storage):
+    await enqueue_update(message(1))
+
+    job_ids = await enqueue_updates([message(1), message(2), message(2), message(3)], offset=4)
+    assert len(job_ids) == 2
+    assert await get_polling_offset() == 4
+
+
+async def test_failed_batch_only_forgets_its_own_updates(storage):
+    await enqueue_update(message(1))
+    unserializable = {"update_id": 3, "message": {"chat": {"id": 10}, "text": object()}}
+
+    with pytest.raises(TypeError):
+        await enqueue_updates([message(1), message(2), unserializable])
+
+    # Nothing of the batch was stored; update 1 was recorded before it
+    assert is_known_update(1)
+    assert not is_known_update(2)
+    assert not is_known_update(3)
+    assert await enqueue_update(message(1)) is None
+    assert await enqueue_update(message(2)) is not None
+
+
+async def test_full_chat_turns_updates_away(storage, monkeypatch):
+    monkeypatch.setattr(db_updates.config, "CHAT_MAX_QUEUED", 2)
+    rejected = []
+    job_ids = await enqueue_updates([message(i) for i in range(1, 6)] + [message(6, chat_id=11)], rejected=rejected)
+
+    # One in progress plus two waiting; other chats are unaffected
+    assert len(job_ids) == 4
+    assert [u["update_id"] for u in rejected] == [4, 5]
+    # Turned-away updates still count as seen, so a redelivery is dropped
+    assert await enqueue_update(message(4), rejected) is None
+    assert len(rejected) == 2
+
+    await claim_next_job()
+    assert await enqueue_update(message(7), rejected) is None
+    assert [u["update_id"] for u in rejected] == [4, 5, 7]
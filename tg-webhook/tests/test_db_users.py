@@ -0,0 +1,33 @@
+import pytest
+
+from db import get_or_create_user, get_user_by_telegram_id, set_user_whitelist, clear_user_cache
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_upsert_creates_then_updates(storage):
+    created = await get_or_create_user(42, username="ann", first_name="Ann")
+    assert created.telegram_id == 42
+    assert not created.is_whitelisted
+
+    clear_user_cache()
+    updated = await get_or_create_user(42, username="ann2")
+    assert updated.id == created.id
+    assert updated.username == "ann2"
+    # Fields not given keep their stored value
+    assert updated.first_name == "Ann"
+
+
+async def test_unchanged_user_is_served_from_cache(storage):
+    user = await get_or_create_user(42, username="ann")
+    assert await get_or_create_user(42, username="ann") is user
+    assert await get_or_create_user(42) is user
+    assert (await get_or_create_user(42, username="bob")).username == "bob"
+
+
+async def test_whitelist(storage):
+    await get_or_create_user(42)
+    assert await set_user_whitelist(42, True)
+    assert (await get_user_by_telegram_id(42)).is_whitelisted
+    assert (await get_or_create_user(42)).is_whitelisted
+    assert not await set_user_whitelist(43, True)
@@ -0,0 +1,67 @@
+import httpx
+import pytest
+
+import decisions as decisions_module
+from decisions import Decision, DecisionRegistry, PERMISSION_OPTIONS
+
+pytestmark = pytest.mark.anyio
+
+
+class FakeOpenCode:
+    def __init__(self):
+        self.posts = []
+
+    async def post(self, url, json):
+        self.posts.append((url, json))
+        return httpx.Response(200)
+
+
+@pytest.fixture
+def sent(monkeypatch):
+    messages = []
+
+    async def telegram_request(method, payload, priority):
+        messages.append((method, payload))
+        return httpx.Response(200, json={"result": {"message_id": len(messages)}})
+
+    monkeypatch.setattr(decisions_module, "telegram_request", telegram_request)
+    return messages
+
+
+@pytest.fixture
+def opencode(monkeypatch):
+    client = FakeOpenCode()
+    monkeypatch.setattr(decisions_module, "get_opencode_client", lambda: client)
+    return client
+
+
+def press(callback_data: str, user_id: int, chat_id: int) -> dict:
+    return {"data": callback_data, "from": {"id": user_id}, "message": {"chat": {"id": chat_id}}}
+
+
+async def ask_permission(registry: DecisionRegistry, sent: list, chat_id: int) -> str:
+    await registry.ask(Decision("permission", "ses_1", "per_1", chat_id, "Run ls?", PERMISSION_OPTIONS))
+    keyboard = sent[-1][1]["reply_markup"]["inline_keyboard"]
+    return keyboard[1][0]["callback_data"]  # Always allow
+
+
+async def test_only_the_asking_chat_can_answer(sent, opencode):
+    registry = DecisionRegistry(max_pending=10)
+    always = await ask_permission(registry, sent, chat_id=100)
+
+    assert await registry.answer(press(always, user_id=200, chat_id=200)) == "This request is not yours to answer."
+    assert await registry.answer(press(always, user_id=200, chat_id=100)) == "This request is not yours to answer."
+    assert opencode.posts == []
+
+    assert await registry.answer(press(always, user_id=100, chat_id=100)) == "Sent: Always allow"
+    assert opencode.posts == [("/session/ses_1/permissions/per_1", {"response": "always"})]
+
+
+async def test_tokens_are_not_guessable(sent, opencode):
+    registry = DecisionRegistry(max_pending=10)
+    first = await ask_permission(registry, sent, chat_id=100)
+    second = await ask_permission(registry, sent, chat_id=100)
+
+    assert first != second
+    assert all(len(data.encode()) <= 64 for data in (first, second))
+    assert await registry.answer(press("dec:1:1", user_id=100, chat_id=100)) == "This request has expired."
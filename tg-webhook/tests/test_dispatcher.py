@@ -0,0 +1,34 @@
+import asyncio
+
+import pytest
+
+from dispatcher import ChatDispatcher, QueueFull
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_slot_wait_times_out():
+    dispatcher = ChatDispatcher(opencode_concurrency=1, slot_timeout=0.05)
+    queued = []
+    async with dispatcher.opencode_slot():
+        with pytest.raises(QueueFull):
+            async with dispatcher.opencode_slot(queued.append):
+                pass
+    assert queued == [1]
+    assert dispatcher.stats()["opencode"]["waiting"] == 0
+
+    # The slot is free again for the next request
+    async with dispatcher.opencode_slot():
+        assert dispatcher.stats()["opencode"]["in_flight"] == 1
+
+
+async def test_full_slot_queue_is_refused():
+    dispatcher = ChatDispatcher(opencode_concurrency=1, opencode_max_queued=1)
+    async with dispatcher.opencode_slot():
+        waiter = asyncio.create_task(dispatcher.opencode_slot().__aenter__())
+        await asyncio.sleep(0)
+        with pytest.raises(QueueFull):
+            async with dispatcher.opencode_slot():
+                pass
+        waiter.cancel()
+        await asyncio.gather(waiter, return_exceptions=True)
@@ -0,0 +1,29 @@
+from db.postgres_backend import NOW_SQL, translate
+
+
+def test_placeholders_are_numbered_in_order():
+    sql, _ = translate("UPDATE jobs SET status = ? WHERE id = ? AND slot IN (?, ?)")
+    assert sql == "UPDATE jobs SET status = $1 WHERE id = $2 AND slot IN ($3, $4)"
+
+
+def test_question_marks_in_string_literals_are_left_alone():
+    sql, _ = translate("SELECT '?' AS q, ? AS a, 'what?' AS b, ? AS c")
+    assert sql == "SELECT '?' AS q, $1 AS a, 'what?' AS b, $2 AS c"
+
+
+def test_escaped_quotes_stay_inside_the_literal():
+    sql, _ = translate("SELECT 'it''s ?' WHERE x = ? AND y = '?'''")
+    assert sql == "SELECT 'it''s ?' WHERE x = $1 AND y = '?'''"
+
+
+def test_current_timestamp_becomes_text_timestamp():
+    sql, _ = translate("UPDATE jobs SET updated_at = CURRENT_TIMESTAMP WHERE note = 'CURRENT_TIMESTAMP'")
+    assert sql == f"UPDATE jobs SET updated_at = {NOW_SQL} WHERE note = 'CURRENT_TIMESTAMP'"
+
+
+def test_statements_returning_rows():
+    assert translate("SELECT 1")[1]
+    assert translate("  WITH x AS (SELECT 1) SELECT * FROM x")[1]
+    assert translate("INSERT INTO jobs (payload) VALUES (?) RETURNING id")[1]
+    assert not translate("DELETE FROM jobs WHERE id = ?")[1]
+    assert not translate("UPDATE jobs SET status = 'pending'")[1]
@@ -0,0 +1,55 @@
+import asyncio
+
+import pytest
+
+import session_pool as session_pool_module
+from session_pool import SessionPool
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture(autouse=True)
+def deleted(monkeypatch):
+    sessions = []
+
+    async def delete_session(session_id):
+        sessions.append(session_id)
+
+    monkeypatch.setattr(session_pool_module, "_delete_session", delete_session)
+    return sessions
+
+
+def new_pool(max_directories: int) -> SessionPool:
+    pool = SessionPool(size=1, ttl=60, max_directories=max_directories, refill_interval=60)
+    pool.warm(None)
+    return pool
+
+
+async def test_default_directory_only_with_no_project_limit():
+    pool = new_pool(max_directories=0)
+    pool.warm("/projects/a")
+    assert list(pool._pools) == [None]
+
+
+async def test_newest_project_directory_is_kept():
+    pool = new_pool(max_directories=1)
+    pool.warm("/projects/a")
+    assert list(pool._pools) == [None, "/projects/a"]
+
+    pool.warm("/projects/b")
+    assert list(pool._pools) == [None, "/projects/b"]
+
+
+async def test_least_recently_used_project_is_dropped(deleted):
+    pool = new_pool(max_directories=2)
+    pool.warm("/projects/a")
+    pool.warm("/projects/b")
+    pool._pools["/projects/a"].append(("ses_a", 0.0))
+    pool.warm("/projects/a")  # Used again, so b is now the oldest
+
+    pool.warm("/projects/c")
+    assert list(pool._pools) == [None, "/projects/a", "/projects/c"]
+    pool.warm("/projects/d")
+    assert list(pool._pools) == [None, "/projects/c", "/projects/d"]
+    await asyncio.sleep(0)
+    assert deleted == ["ses_a"]
@@ -0,0 +1,33 @@
+from telegram_markdown import render_markdown
+
+
+def kinds(entities):
+    return [(e["type"], e["offset"], e["length"]) for e in entities]
+
+
+def test_triple_asterisks_are_bold_italic():
+    text, entities = render_markdown("a ***b*** c")
+    assert text == "a b c"
+    assert kinds(entities) == [("bold", 2, 1), ("italic", 2, 1)]
+
+
+def test_triple_asterisks_without_closer_fall_back():
+    text, entities = render_markdown("***bold** rest")
+    assert text == "*bold rest"
+    assert kinds(entities) == [("bold", 0, 5)]
+
+
+def test_underscores_inside_words_stay_as_written():
+    for markdown in ("__init__.py file", "see foo.__bar__", "my_var_name", "2*3*4"):
+        assert render_markdown(markdown) == (markdown, [])
+
+
+def test_underscores_around_words():
+    assert render_markdown("__bold__ text") == ("bold text", [{"type": "bold", "offset": 0, "length": 4}])
+    assert render_markdown("(_it_), yes") == ("(it), yes", [{"type": "italic", "offset": 1, "length": 2}])
+
+
+def test_mixed_emphasis_and_code():
+    text, entities = render_markdown("**b** and `__x__` and ~~s~~")
+    assert text == "b and __x__ and s"
+    assert kinds(entities) == [("bold", 0, 1), ("code", 6, 5), ("strikethrough", 16, 1)]
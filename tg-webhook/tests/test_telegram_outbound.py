@@ -0,0 +1,96 @@
+import asyncio
+import time
+
+import pytest
+
+from config import config
+from telegram_outbound import (
+    OutboundScheduler,
+    TokenBucket,
+    PRIORITY_INTERACTIVE,
+    PRIORITY_EDIT,
+    PRIORITY_TYPING,
+    PRIORITY_BULK,
+)
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+async def scheduler(monkeypatch):
+    monkeypatch.setattr(config, "TELEGRAM_GLOBAL_RATE", 20.0)
+    monkeypatch.setattr(config, "TELEGRAM_CHAT_RATE", 10.0)
+    monkeypatch.setattr(config, "TELEGRAM_CHAT_BURST", 1.0)
+    monkeypatch.setattr(config, "TELEGRAM_GROUP_RATE_PER_MIN", 60.0)
+    scheduler = OutboundScheduler()
+    yield scheduler
+    await scheduler.stop()
+
+
+async def timed(coro) -> float:
+    started = time.monotonic()
+    await coro
+    return time.monotonic() - started
+
+
+def test_bucket_refills_at_its_rate():
+    bucket = TokenBucket(rate=2, burst=1)
+    now = bucket.updated
+    assert bucket.delay(now) == 0
+    bucket.take()
+    assert bucket.delay(now) == pytest.approx(0.5)
+    assert bucket.delay(now + 0.25) == pytest.approx(0.25)
+    assert bucket.delay(now + 0.5) == 0
+
+
+def test_paused_bucket_waits_out_retry_after():
+    bucket = TokenBucket(rate=100, burst=5)
+    bucket.pause(2)
+    assert bucket.delay(time.monotonic()) == pytest.approx(2, abs=0.05)
+
+
+async def test_chat_rate_limit(scheduler):
+    await scheduler.acquire(1, PRIORITY_INTERACTIVE)
+    # The chat's burst of 1 is spent: the next call waits ~1/10s, other chats don't
+    assert await timed(scheduler.acquire(2, PRIORITY_INTERACTIVE)) < 0.05
+    assert await timed(scheduler.acquire(1, PRIORITY_INTERACTIVE)) == pytest.approx(0.1, abs=0.05)
+
+
+async def test_group_chats_get_the_slower_rate(scheduler):
+    await scheduler.acquire(-100, PRIORITY_INTERACTIVE)
+    # 60 per minute is one per second
+    assert scheduler._chat_bucket(-100).delay(time.monotonic()) == pytest.approx(1, abs=0.05)
+
+
+async def test_global_rate_limit(scheduler):
+    scheduler.global_bucket.tokens = 0
+    # Different chats, so only the global bucket (20/s) holds them back
+    elapsed = await timed(asyncio.gather(*(scheduler.acquire(chat, PRIORITY_INTERACTIVE) for chat in range(4))))
+    assert elapsed == pytest.approx(0.2, abs=0.08)
+
+
+async def test_waiters_are_served_by_priority(scheduler):
+    scheduler.global_bucket.tokens = 0
+    order = []
+
+    async def call(name: str, chat_id: int, priority: int):
+        await scheduler.acquire(chat_id, priority)
+        order.append(name)
+
+    await asyncio.gather(
+        call("bulk", 1, PRIORITY_BULK),
+        call("typing", 2, PRIORITY_TYPING),
+        call("edit", 3, PRIORITY_EDIT),
+        call("reply", 4, PRIORITY_INTERACTIVE),
+        call("second reply", 5, PRIORITY_INTERACTIVE),
+    )
+    assert order == ["reply", "second reply", "edit", "typing", "bulk"]
+
+
+async def test_rate_limited_chat_does_not_block_others(scheduler):
+    scheduler.flood_wait(1, 5)
+    blocked = asyncio.create_task(scheduler.acquire(1, PRIORITY_INTERACTIVE))
+    assert await timed(scheduler.acquire(2, PRIORITY_BULK)) < 0.05
+    assert not blocked.done()
+    assert scheduler.stats()["rate_limited"] == 1
+    blocked.cancel()
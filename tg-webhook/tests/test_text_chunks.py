@@ -0,0 +1,62 @@
+from telegram_markdown import render_markdown
+from text_chunks import split_message
+
+
+def test_fence_too_long_for_limit_splits_as_plain_text():
+    # Used to loop forever: no room was left between the fence lines
+    chunks = split_message("```py\nprint('hello world')\n```", 5)
+    assert all(0 < len(chunk) <= 5 for chunk in chunks)
+    assert "".join(chunks).replace(" ", "") == "```pyprint('helloworld')```"
+
+
+def test_small_limits_always_finish():
+    text = "```python\n" + "x" * 50 + "\n```\n\nsome text " * 3
+    for limit in range(1, 40):
+        chunks = split_message(text, limit)
+        assert all(len(chunk) <= limit for chunk in chunks)
+
+
+CODE = "\n".join(f"value_{i} = {i}" for i in range(30))
+REPLY = f"**Intro** paragraph\n\n```python\n{CODE}\n```\n\nThe **end**."
+
+
+def test_short_text_is_one_chunk():
+    assert split_message("hello\n\nworld", 100) == ["hello\n\nworld"]
+
+
+def test_chunks_break_on_paragraphs():
+    text = "\n\n".join(f"Paragraph {i} " + "word " * 10 for i in range(6))
+    chunks = split_message(text, 130)
+    assert len(chunks) > 1
+    assert all(len(chunk) <= 130 for chunk in chunks)
+    assert "\n\n".join(chunks) == text
+
+
+def test_split_code_block_is_refenced_in_every_chunk():
+    chunks = split_message(REPLY, 150)
+    code_chunks = [chunk for chunk in chunks if "value_" in chunk]
+    assert len(code_chunks) > 1
+    for chunk in code_chunks:
+        assert chunk.count("```") == 2
+        assert "```python\n" in chunk
+    # Every line of code survives, in order
+    lines = [line for chunk in code_chunks for line in chunk.split("\n") if line.startswith("value_")]
+    assert lines == CODE.split("\n")
+
+
+def test_entities_survive_chunking():
+    chunks = split_message(REPLY, 150)
+    rendered = [render_markdown(chunk) for chunk in chunks]
+
+    assert rendered[0][1][0] == {"type": "bold", "offset": 0, "length": 5}
+    for text, entities in rendered[1:]:
+        pre = [e for e in entities if e["type"] == "pre"]
+        assert pre and pre[0]["language"] == "python"
+        assert "```" not in text
+    assert rendered[-1][1][-1]["type"] == "bold"
+    assert rendered[-1][0].endswith("The end.")
+
+
+def test_unterminated_fence_is_closed():
+    chunks = split_message("intro\n\n```\n" + "line\n" * 40, 60)
+    assert all(chunk.count("```") in (0, 2) for chunk in chunks)
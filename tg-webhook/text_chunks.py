@@ -0,0 +1,106 @@
+import re
+from typing import List
+
+
+FENCE_RE = re.compile(r"^\s*```")
+
+
+def _split_blocks(text: str) -> List[str]:
+    """Split text into paragraphs and whole code-fence blocks."""
+    blocks: List[str] = []
+    current: List[str] = []
+    in_fence = False
+
+    for line in text.split("\n"):
+        if FENCE_RE.match(line):
+            if not in_fence and current:
+                blocks.append("\n".join(current))
+                current = []
+            current.append(line)
+            if in_fence:
+                blocks.append("\n".join(current))
+                current = []
+            in_fence = not in_fence
+            continue
+        if not in_fence and not line.strip():
+            if current:
+                blocks.append("\n".join(current))
+                current = []
+            continue
+        current.append(line)
+
+    if current:
+        if in_fence:
+            # Unterminated fence: close it so every chunk stays well-formed
+            current.append("```")
+        blocks.append("\n".join(current))
+    return blocks
+
+
+def _hard_split(line: str, limit: int) -> List[str]:
+    """Split a single over-long line, preferring whitespace boundaries."""
+    pieces = []
+    while len(line) > limit:
+        cut = line.rfind(" ", 0, limit)
+        if cut <= limit // 2:
+            cut = limit
+        pieces.append(line[:cut])
+        line = line[cut:].lstrip(" ")
+    if line:
+        pieces.append(line)
+    return pieces
+
+
+def _split_large_block(block: str, limit: int) -> List[str]:
+    """Split a block larger than `limit` on line boundaries, re-fencing code.
+
+    If not even one character fits between the fence lines, the block is
+    split as plain text instead.
+    """
+    lines = block.split("\n")
+    opening = closing = ""
+    if FENCE_RE.match(lines[0]) and limit - len(lines[0].strip()) - 5 >= 1:
+        opening, closing = lines[0].strip(), "```"
+        lines = lines[1:-1] if len(lines) > 1 and FENCE_RE.match(lines[-1]) else lines[1:]
+    # Room left for the fence lines wrapped around each piece
+    budget = max(1, limit - (len(opening) + len(closing) + 2 if opening else 0))
+
+    pieces: List[str] = []
+    current: List[str] = []
+    size = 0
+    for line in lines:
+        for part in _hard_split(line, budget) or [""]:
+            if current and size + len(part) + 1 > budget:
+                pieces.append("\n".join(current))
+                current, size = [], 0
+            current.append(part)
+            size += len(part) + 1
+    if current:
+        pieces.append("\n".join(current))
+
+    if opening:
+        pieces = [f"{opening}\n{piece}\n{closing}" for piece in pieces]
+    return pieces
+
+
+def split_message(text: str, limit: int) -> List[str]:
+    """Split text into chunks of at most `limit` characters.
+
+    Chunks break on paragraph and code-fence boundaries; a code block that
+    has to be split is closed and reopened so each chunk renders on its own.
+    """
+    if len(text) <= limit:
+        return [text]
+
+    chunks: List[str] = []
+    current = ""
+    for block in _split_blocks(text):
+        pieces = [block] if len(block) <= limit else _split_large_block(block, limit)
+        for piece in pieces:
+            if current and len(current) + len(piece) + 2 > limit:
+                chunks.append(current)
+                current = ""
+            current = f"{current}\n\n{piece}" if current else piece
+    if current:
+        chunks.append(current)
+    return chunks
@@ -0,0 +1,274 @@
+import asyncio
+import json
+import os
+import secrets
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, List, Optional
+
+import httpx
+
+from config import config
+from db.cache import LRUCache
+
+
+class Trace:
+    """One update's trace: a root span plus the child spans recorded under it."""
+
+    def __init__(self, name: str, attrs: Dict, received_at: Optional[float] = None):
+        self.trace_id = secrets.token_hex(16)
+        self.span_id = secrets.token_hex(8)
+        self.name = name
+        self.attrs = attrs
+        self.start = time.time()
+        self.duration = 0.0
+        self.error: Optional[str] = None
+        self.spans: List[Dict] = []
+        self.finished = False
+        self._t0 = time.perf_counter()
+        if received_at is not None and received_at < self.start:
+            # Time spent in the job queue is part of what the user waited
+            queued = self.start - received_at
+            self.start = received_at
+            self._t0 -= queued
+            self.spans.append(self._record("queue_wait", self.span_id, self._t0, self._t0 + queued, {}, None))
+
+    def _record(self, name, parent_id, started, ended, attrs, error) -> Dict:
+        return {
+            "span_id": secrets.token_hex(8),
+            "parent_id": parent_id,
+            "name": name,
+            "start_ms": round((started - self._t0) * 1000, 3),
+            "duration_ms": round((ended - started) * 1000, 3),
+            "attrs": attrs,
+            "error": error,
+        }
+
+    def as_dict(self) -> Dict:
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "name": self.name,
+            "start": self.start,
+            "duration_ms": round(self.duration * 1000, 3),
+            "attrs": self.attrs,
+            "error": self.error,
+            "spans": self.spans,
+        }
+
+
+_current_trace: ContextVar[Optional[Trace]] = ContextVar("current_trace", default=None)
+_current_span: ContextVar[Optional[str]] = ContextVar("current_span", default=None)
+
+# Ingress time per update_id, so a trace can include the queue wait
+_received_at = LRUCache(config.UPDATE_DEDUP_CACHE_SIZE)
+
+
+def mark_received(update_id: Optional[int]):
+    """Remember when an update was accepted by the ingress."""
+    if update_id is not None:
+        _received_at.set(update_id, time.time())
+
+
+@contextmanager
+def start_trace(name: str, update_id: Optional[int] = None, **attrs):
+    """Trace the enclosed block as the root span of a new trace."""
+    if update_id is not None:
+        attrs["update_id"] = update_id
+    received_at = None
+    if update_id is not None:
+        received_at = _received_at.get(update_id)
+        _received_at.pop(update_id)
+    trace = Trace(name, attrs, received_at)
+    trace_token = _current_trace.set(trace)
+    span_token = _current_span.set(trace.span_id)
+    try:
+        yield trace
+    except BaseException as e:
+        trace.error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        _current_span.reset(span_token)
+        _current_trace.reset(trace_token)
+        trace.duration = time.perf_counter() - trace._t0
+        trace.finished = True
+        exporter.export(trace)
+
+
+@contextmanager
+def span(name: str, **attrs):
+    """Record the enclosed block as a child span of the current trace.
+
+    Yields the attribute dict so the block can add attributes as it learns
+    them. Outside of a trace this does nothing.
+    """
+    trace = _current_trace.get()
+    if trace is None or trace.finished:
+        yield attrs
+        return
+    parent_id = _current_span.get()
+    record = trace._record(name, parent_id, 0.0, 0.0, attrs, None)
+    token = _current_span.set(record["span_id"])
+    started = time.perf_counter()
+    try:
+        yield attrs
+    except BaseException as e:
+        record["error"] = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        ended = time.perf_counter()
+        _current_span.reset(token)
+        record["start_ms"] = round((started - trace._t0) * 1000, 3)
+        record["duration_ms"] = round((ended - started) * 1000, 3)
+        trace.spans.append(record)
+
+
+def _otlp_value(value) -> Dict:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def _otlp_span(trace_id, span_id, parent_id, name, start_ns, end_ns, attrs, error) -> Dict:
+    otlp = {
+        "traceId": trace_id,
+        "spanId": span_id,
+        "name": name,
+        "kind": 1,
+        "startTimeUnixNano": str(start_ns),
+        "endTimeUnixNano": str(end_ns),
+        "attributes": [{"key": k, "value": _otlp_value(v)} for k, v in attrs.items() if v is not None],
+        "status": {"code": 2, "message": error} if error else {"code": 1},
+    }
+    if parent_id:
+        otlp["parentSpanId"] = parent_id
+    return otlp
+
+
+def to_otlp(traces: List[Trace]) -> Dict:
+    """Convert traces to an OTLP/HTTP JSON ExportTraceServiceRequest."""
+    spans = []
+    for trace in traces:
+        start_ns = int(trace.start * 1e9)
+        spans.append(_otlp_span(
+            trace.trace_id, trace.span_id, None, trace.name,
+            start_ns, start_ns + int(trace.duration * 1e9), trace.attrs, trace.error
+        ))
+        for s in trace.spans:
+            child_start = start_ns + int(s["start_ms"] * 1e6)
+            spans.append(_otlp_span(
+                trace.trace_id, s["span_id"], s["parent_id"], s["name"],
+                child_start, child_start + int(s["duration_ms"] * 1e6), s["attrs"], s["error"]
+            ))
+    return {
+        "resourceSpans": [{
+            "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": config.TRACE_SERVICE_NAME}}]},
+            "scopeSpans": [{"scope": {"name": "tg-webhook"}, "spans": spans}],
+        }]
+    }
+
+
+def _append_jsonl(path: str, records: List[Dict]):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "a", encoding="utf-8") as f:
+        for record in records:
+            f.write(json.dumps(record, default=str) + "\n")
+
+
+class TraceExporter:
+    """Buffers finished traces and writes them out in batches.
+
+    Traces go to a JSONL file or an OTLP/HTTP collector depending on
+    TRACE_EXPORTER. Updates slower than SLOW_UPDATE_THRESHOLD are always
+    appended to the slow log, whatever the exporter.
+    """
+
+    def __init__(self, mode: str, interval: float, slow_threshold: float):
+        self.mode = mode
+        self.interval = interval
+        self.slow_threshold = slow_threshold
+        self.exported = 0
+        self.slow = 0
+        self.dropped = 0
+        self._pending: List[Trace] = []
+        self._slow: List[Trace] = []
+        self._client: Optional[httpx.AsyncClient] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def export(self, trace: Trace):
+        if trace.duration >= self.slow_threshold:
+            self.slow += 1
+            self._slow.append(trace)
+            print(
+                f"[Trace] Slow update {trace.attrs.get('update_id')} took {trace.duration:.2f}s "
+                f"(trace {trace.trace_id}): "
+                + ", ".join(f"{s['name']}={s['duration_ms']:.0f}ms" for s in trace.spans)
+            )
+        if self.mode != "none":
+            if len(self._pending) >= config.TRACE_MAX_BUFFER:
+                self.dropped += 1
+            else:
+                self._pending.append(trace)
+        if (self._slow or self._pending) and (self._task is None or self._task.done()):
+            try:
+                self._task = asyncio.get_running_loop().create_task(self._run(), name="trace-export")
+            except RuntimeError:
+                pass
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                print(f"[Trace] Export failed: {e}")
+
+    async def flush(self):
+        """Write all buffered traces."""
+        slow, self._slow = self._slow, []
+        pending, self._pending = self._pending, []
+        if slow:
+            await asyncio.to_thread(_append_jsonl, config.SLOW_LOG_FILE, [t.as_dict() for t in slow])
+        if not pending:
+            return
+        if self.mode == "jsonl":
+            await asyncio.to_thread(_append_jsonl, config.TRACE_FILE, [t.as_dict() for t in pending])
+        elif self.mode == "otlp":
+            if self._client is None:
+                self._client = httpx.AsyncClient(timeout=config.TELEGRAM_TIMEOUT)
+            response = await self._client.post(
+                f"{config.TRACE_OTLP_ENDPOINT.rstrip('/')}/v1/traces", json=to_otlp(pending)
+            )
+            response.raise_for_status()
+        self.exported += len(pending)
+
+    async def stop(self):
+        """Stop the export loop and write whatever is still buffered."""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        try:
+            await self.flush()
+        except Exception as e:
+            print(f"[Trace] Final export failed: {e}")
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    def stats(self) -> dict:
+        return {
+            "exporter": self.mode,
+            "exported": self.exported,
+            "slow": self.slow,
+            "dropped": self.dropped,
+            "pending": len(self._pending),
+        }
+
+
+exporter = TraceExporter(config.TRACE_EXPORTER, config.TRACE_FLUSH_INTERVAL, config.SLOW_UPDATE_THRESHOLD)
@@ -1,13 +1,49 @@
 import os
+import hmac
+import asyncio
+import time
 from contextlib import asynccontextmanager
-from fastapi import FastAPI, Request, HTTPException
+from fastapi import FastAPI, Request, HTTPException, Response
+from fastapi.responses import PlainTextResponse
 from dotenv import load_dotenv
 import httpx
-from typing import Optional
+from typing import Callable, Optional, Tuple
 
 from config import config
+from background import spawn, stats as background_stats
+from http_clients import (
+    init_http_clients,
+    close_http_clients,
+    get_opencode_client,
+)
+from telegram_outbound import (
+    outbound,
+    telegram_request,
+    PRIORITY_INTERACTIVE,
+    PRIORITY_EDIT,
+)
+from worker import start_job_workers, stop_job_workers, notify_job_workers
+from dispatcher import dispatcher, QueueFull
+from circuit_breaker import CLOSED, CircuitOpenError, opencode_breaker
+from text_chunks import split_message
+from telegram_markdown import markdown_renderer
+from session_pool import session_pool
+from polling import UpdatePoller
+from opencode_stream import event_bus, Subscription, SessionTextFollower
+from decisions import decisions, parse_decision, CALLBACK_PREFIX
+from chat_actions import chat_actions
+from metrics import (
+    WEBHOOK_LATENCY, WEBHOOK_IN_FLIGHT, UPDATE_LATENCY, UPDATES_IN_FLIGHT,
+    OPENCODE_LATENCY, QUEUE_DEPTH, ADMISSION_REJECTED, CONTENT_TYPE_LATEST, generate_latest,
+)
+from tracing import exporter as trace_exporter, mark_received, span, start_trace
+from profiler import profiler
+from sharding import cluster, chat_key, update_chat_id
+from agent_runs import agent_runs
 from db import (
     init_db,
+    close_db,
+    ping_db,
     get_or_create_user,
     get_user_by_telegram_id,
     get_active_session_for_user,
@@ -18,50 +54,242 @@ from db import (
     get_projects_for_user,
     get_project_by_name,
     create_project as db_create_project,
+    list_project_templates,
+    ensure_project_templates,
+    count_pending_jobs,
+    enqueue_update,
+    prune_processed_updates,
+    dedup_stats,
+    get_running_agent_run,
+    count_running_agent_runs,
+    clear_user_cache,
+    clear_session_cache,
     User,
+    Session,
 )
 
 load_dotenv()
 
 
+async def prune_processed_updates_periodically():
+    """Forget old update_ids; Telegram does not redeliver after UPDATE_DEDUP_TTL_HOURS."""
+    while True:
+        try:
+            removed = await prune_processed_updates(config.UPDATE_DEDUP_TTL_HOURS)
+            if removed:
+                print(f"[DB] Pruned {removed} processed update id(s)")
+        except Exception as e:
+            print(f"[DB] Failed to prune processed updates: {e}")
+        await asyncio.sleep(3600)
+
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    """Initialize database on startup."""
+    """Initialize database, shared HTTP clients and job workers on startup."""
     await init_db()
+    await init_http_clients()
+    try:
+        await ensure_project_templates()
+    except Exception as e:
+        print(f"[Project] Failed to build project templates: {e}")
+    cluster.on_rebalance(on_cluster_rebalance)
+    await cluster.start()
+    await start_job_workers(process_update, update_lane_key)
+    pruner = asyncio.create_task(prune_processed_updates_periodically())
+    session_pool.start(create_opencode_session)
+    event_bus.start(notify_agent_event)
+    agent_runs.start(send_telegram_message)
+    if config.INGRESS_MODE == "polling":
+        app.state.poller = UpdatePoller(notify_job_workers, lambda update: spawn(reject_update(update)))
+        await app.state.poller.start()
     yield
+    if config.INGRESS_MODE == "polling":
+        await app.state.poller.stop()
+    pruner.cancel()
+    await session_pool.stop()
+    await agent_runs.stop()
+    await event_bus.stop()
+    await stop_job_workers()
+    await chat_actions.stop()
+    await cluster.stop()
+    await outbound.stop()
+    await trace_exporter.stop()
+    await close_http_clients()
+    await close_db()
+
+
+def on_cluster_rebalance():
+    """Chats this replica now owns may have been served elsewhere: drop stale caches."""
+    clear_user_cache()
+    clear_session_cache()
+    notify_job_workers()
+    spawn(agent_runs.reload())
+    spawn(event_bus.load_index())
 
 
 app = FastAPI(lifespan=lifespan)
 
 
-async def send_telegram_message(chat_id: int, text: str, parse_mode: str = "Markdown"):
-    """Send a message via Telegram Bot API."""
-    url = f"https://api.telegram.org/bot{config.TELEGRAM_BOT_TOKEN}/sendMessage"
+async def send_telegram_message(
+    chat_id: int,
+    text: str,
+    markdown: bool = True,
+    priority: int = PRIORITY_INTERACTIVE
+):
+    """Send a message via Telegram Bot API.
+
+    Long text is split into several messages on paragraph and code-fence
+    boundaries, or uploaded as a `.md` document beyond
+    REPLY_DOCUMENT_THRESHOLD characters. Returns the first message's result.
+    """
+    if len(text) > config.REPLY_DOCUMENT_THRESHOLD:
+        return await send_telegram_document(chat_id, text, priority=priority)
+
+    first_result = None
+    for chunk in split_message(text, config.REPLY_CHUNK_SIZE):
+        result = await send_single_telegram_message(chat_id, chunk, markdown, priority)
+        if first_result is None:
+            first_result = result
+    return first_result
+
+
+def with_text(payload: dict, text: str, markdown: bool) -> dict:
+    """Add `text` to a sendMessage/editMessageText payload, with Markdown rendered to entities."""
+    if not markdown:
+        return {**payload, "text": text}
+    text, entities = markdown_renderer.render(text)
+    if entities:
+        return {**payload, "text": text, "entities": entities}
+    return {**payload, "text": text}
+
+
+async def send_single_telegram_message(
+    chat_id: int,
+    text: str,
+    markdown: bool = True,
+    priority: int = PRIORITY_INTERACTIVE
+):
+    """Send one message that fits Telegram's size limit."""
+    payload = with_text({"chat_id": chat_id}, text, markdown)
+    response = await telegram_request("sendMessage", payload, priority)
+    if "entities" in payload and response.status_code == 400:
+        # Rendered entities are always valid, so this means a renderer bug; don't lose the reply
+        print(f"[Telegram] Formatted message rejected in chat {chat_id}: {response.text[:200]}")
+        response = await telegram_request("sendMessage", {"chat_id": chat_id, "text": text}, priority)
+    return response.json()
+
+
+async def send_telegram_document(
+    chat_id: int,
+    text: str,
+    filename: str = "response.md",
+    priority: int = PRIORITY_INTERACTIVE
+):
+    """Upload text as a document, for replies too long to send as messages."""
+    caption = f"Full response attached ({len(text)} characters)."
+    response = await telegram_request(
+        "sendDocument",
+        {"chat_id": chat_id, "caption": caption},
+        priority,
+        files={"document": (filename, text.encode("utf-8"), "text/markdown")}
+    )
+    return response.json()
+
 
-    # Truncate long messages (Telegram limit is 4096)
+def truncate_message(text: str) -> str:
+    """Truncate long messages (Telegram limit is 4096)."""
     if len(text) > 4000:
         text = text[:4000] + "\n\n... (message truncated)"
-
-    payload = {
-        "chat_id": chat_id,
-        "text": text,
-        "parse_mode": parse_mode
-    }
-
-    async with httpx.AsyncClient() as client:
-        response = await client.post(url, json=payload)
-        if response.status_code != 200:
-            # Try without parse mode if markdown fails
-            payload["parse_mode"] = None
-            response = await client.post(url, json=payload)
-        return response.json()
-
-
-async def send_typing_action(chat_id: int):
-    """Send typing indicator."""
-    url = f"https://api.telegram.org/bot{config.TELEGRAM_BOT_TOKEN}/sendChatAction"
-    async with httpx.AsyncClient() as client:
-        await client.post(url, json={"chat_id": chat_id, "action": "typing"})
+    return text
+
+
+async def edit_telegram_message(
+    chat_id: int,
+    message_id: int,
+    text: str,
+    markdown: bool = False,
+    priority: int = PRIORITY_EDIT
+):
+    """Replace the text of a previously sent message."""
+    payload = with_text({"chat_id": chat_id, "message_id": message_id}, truncate_message(text), markdown)
+    response = await telegram_request("editMessageText", payload, priority)
+    if "entities" in payload and response.status_code == 400:
+        print(f"[Telegram] Formatted edit rejected in chat {chat_id}: {response.text[:200]}")
+        payload = {"chat_id": chat_id, "message_id": message_id, "text": truncate_message(text)}
+        response = await telegram_request("editMessageText", payload, priority)
+    return response.json()
+
+
+class TelegramMessageStreamer:
+    """Progressively updates one placeholder message as agent output streams in.
+
+    Updates are coalesced: at most one editMessageText per `interval` seconds,
+    always carrying the latest text, so bursts of tokens cost a single edit.
+    """
+
+    def __init__(self, chat_id: int, interval: float):
+        self.chat_id = chat_id
+        self.interval = interval
+        self.message_id: Optional[int] = None
+        self._latest = ""
+        self._shown = ""
+        self._last_edit = 0.0
+        self._flush_task: Optional[asyncio.Task] = None
+
+    async def start(self, placeholder: str):
+        """Send the placeholder message that will be edited in place."""
+        result = await send_telegram_message(self.chat_id, placeholder, markdown=False)
+        self.message_id = (result.get("result") or {}).get("message_id")
+        self._shown = placeholder
+        self._last_edit = time.monotonic()
+
+    def update(self, text: str):
+        """Record the latest partial text and schedule a throttled edit."""
+        self._latest = text
+        if self.message_id is None or self._flush_task is not None:
+            return
+        delay = max(0.0, self._last_edit + self.interval - time.monotonic())
+        self._flush_task = asyncio.create_task(self._flush_after(delay))
+
+    async def _flush_after(self, delay: float):
+        try:
+            await asyncio.sleep(delay)
+            text = self._latest
+            if text and text != self._shown:
+                # Partial output is sent as plain text: half-written markdown is rarely valid
+                await edit_telegram_message(self.chat_id, self.message_id, text + " ...")
+                self._shown = text
+            self._last_edit = time.monotonic()
+        except Exception as e:
+            print(f"[Stream] Edit failed for chat {self.chat_id}: {e}")
+        finally:
+            self._flush_task = None
+
+    async def finish(self, text: str):
+        """Replace the placeholder with the final response."""
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            self._flush_task = None
+        if self.message_id is None:
+            await send_telegram_message(self.chat_id, text)
+            return
+
+        if len(text) > config.REPLY_DOCUMENT_THRESHOLD:
+            await edit_telegram_message(
+                self.chat_id, self.message_id, "Response is long, sending it as a document.",
+                priority=PRIORITY_INTERACTIVE
+            )
+            await send_telegram_document(self.chat_id, text)
+            return
+
+        # First chunk replaces the placeholder, the rest follow as new messages
+        first, *rest = split_message(text, config.REPLY_CHUNK_SIZE)
+        await edit_telegram_message(
+            self.chat_id, self.message_id, first,
+            markdown=True, priority=PRIORITY_INTERACTIVE
+        )
+        for chunk in rest:
+            await send_single_telegram_message(self.chat_id, chunk)
 
 
 def is_user_allowed(user: User) -> bool:
@@ -78,92 +306,256 @@ def is_user_allowed(user: User) -> bool:
 async def create_opencode_session(directory: Optional[str] = None, title: Optional[str] = None) -> str:
     """Create a new OpenCode session and return session ID."""
     try:
-        async with httpx.AsyncClient(timeout=30.0) as client:
-            payload = {}
-            if directory:
-                payload["directory"] = directory
-            if title:
-                payload["title"] = title
-
-            response = await client.post(
-                f"{config.OPENCODE_URL}/session",
-                json=payload,
-                headers={"x-opencode-directory": directory} if directory else {}
-            )
-
-            if response.status_code in [200, 201]:
-                session_data = response.json()
-                return session_data.get("id")
-            else:
-                raise Exception(f"Failed to create session: {response.status_code} - {response.text}")
+        client = get_opencode_client()
+        payload = {}
+        if directory:
+            payload["directory"] = directory
+        if title:
+            payload["title"] = title
+
+        async with dispatcher.opencode_slot():
+            with span("opencode.create_session"), OPENCODE_LATENCY.labels("create_session").time():
+                response = await client.post(
+                    "/session",
+                    json=payload,
+                    headers={"x-opencode-directory": directory} if directory else {},
+                    timeout=httpx.Timeout(config.OPENCODE_SESSION_TIMEOUT, connect=config.HTTP_CONNECT_TIMEOUT)
+                )
+
+        if response.status_code in [200, 201]:
+            session_data = response.json()
+            return session_data.get("id")
+        else:
+            raise Exception(f"Failed to create session: {response.status_code} - {response.text}")
 
+    except (QueueFull, CircuitOpenError):
+        raise
     except Exception as e:
         raise Exception(f"Error creating OpenCode session: {str(e)}")
 
 
 async def get_or_create_opencode_session(user: User, project_id: Optional[int] = None, directory: Optional[str] = None) -> tuple:
     """Get existing session or create a new one. Returns (session_id, db_session)."""
-    # Check for existing active session
-    db_session = await get_active_session_for_user(user.id, project_id)
-
-    if db_session:
+    # Serialize per user so concurrent chats of the same user here don't both
+    # create a session; across replicas the database keeps one active session
+    async with dispatcher.lock_for(("session", user.id)):
+        # Check for existing active session
+        db_session = await get_active_session_for_user(user.id, project_id)
+
+        if db_session:
+            return db_session.opencode_session_id, db_session
+
+        # Take a pre-warmed OpenCode session, or create one if none is ready
+        title = f"Telegram - {user.username or user.first_name or user.telegram_id}"
+        opencode_session_id = await session_pool.claim(directory, title)
+        if opencode_session_id is None:
+            opencode_session_id = await create_opencode_session(directory=directory, title=title)
+
+        # Save to database
+        db_session = await db_create_session(
+            user_id=user.id,
+            opencode_session_id=opencode_session_id,
+            title=title,
+            project_id=project_id
+        )
+    if db_session.opencode_session_id != opencode_session_id:
+        # Another replica created the user's session first: use that one
+        await session_pool.discard(opencode_session_id)
+        event_bus.register_chat(db_session.opencode_session_id, user.telegram_id)
         return db_session.opencode_session_id, db_session
-
-    # Create new OpenCode session
-    title = f"Telegram - {user.username or user.first_name or user.telegram_id}"
-    opencode_session_id = await create_opencode_session(directory=directory, title=title)
-
-    # Save to database
-    db_session = await db_create_session(
-        user_id=user.id,
-        opencode_session_id=opencode_session_id,
-        title=title,
-        project_id=project_id
-    )
+    event_bus.register_chat(opencode_session_id, user.telegram_id)
 
     print(f"[Session] Created new session {opencode_session_id} for user {user.telegram_id}")
     return opencode_session_id, db_session
 
 
-async def send_message_to_opencode(session_id: str, user_message: str) -> str:
-    """Send message to OpenCode session and get response."""
-    try:
-        async with httpx.AsyncClient(timeout=300.0) as client:
-            response = await client.post(
-                f"{config.OPENCODE_URL}/session/{session_id}/message",
-                json={
-                    "parts": [
-                        {
-                            "type": "text",
-                            "text": user_message
-                        }
-                    ]
-                }
-            )
+async def send_message_to_opencode(
+    session_id: str,
+    user_message: str,
+    on_text: Optional[Callable[[str], None]] = None,
+    on_queued: Optional[Callable[[int], None]] = None
+) -> str:
+    """Send message to OpenCode session and get response.
 
-            if response.status_code == 200:
-                data = response.json()
-                # Extract text from response parts
-                if isinstance(data, dict) and "parts" in data:
-                    parts = data["parts"]
-                    text_parts = [p.get("text", "") for p in parts if p.get("type") == "text"]
-                    return "\n".join(text_parts) if text_parts else "Request processed."
-                elif isinstance(data, list):
-                    # Handle array of message objects
-                    text_parts = []
-                    for msg in data:
-                        if "parts" in msg:
-                            text_parts.extend([p.get("text", "") for p in msg["parts"] if p.get("type") == "text"])
-                    return "\n".join(text_parts) if text_parts else "Request processed."
-                else:
-                    return "Request processed successfully."
+    If `on_text` is given, it is called with the accumulated assistant text
+    while the agent is still working (via OpenCode's event stream).
+    `on_queued(position)` is called if the request has to wait for a slot.
+    """
+    follower = None
+    try:
+        client = get_opencode_client()
+        async with dispatcher.opencode_slot(on_queued):
+            if on_text is not None:
+                follower = await start_session_follower(session_id, on_text)
+            with span("opencode.message", session_id=session_id), OPENCODE_LATENCY.labels("message").time():
+                response = await client.post(
+                    f"/session/{session_id}/message",
+                    json={
+                        "parts": [
+                            {
+                                "type": "text",
+                                "text": user_message
+                            }
+                        ]
+                    },
+                    timeout=httpx.Timeout(config.OPENCODE_MESSAGE_TIMEOUT, connect=config.HTTP_CONNECT_TIMEOUT)
+                )
+
+        if response.status_code == 200:
+            data = response.json()
+            # Extract text from response parts
+            if isinstance(data, dict) and "parts" in data:
+                parts = data["parts"]
+                text_parts = [p.get("text", "") for p in parts if p.get("type") == "text"]
+                return "\n".join(text_parts) if text_parts else "Request processed."
+            elif isinstance(data, list):
+                # Handle array of message objects
+                text_parts = []
+                for msg in data:
+                    if "parts" in msg:
+                        text_parts.extend([p.get("text", "") for p in msg["parts"] if p.get("type") == "text"])
+                return "\n".join(text_parts) if text_parts else "Request processed."
             else:
-                return f"Error: OpenCode server returned status {response.status_code}"
+                return "Request processed successfully."
+        else:
+            return f"Error: OpenCode server returned status {response.status_code}"
 
     except httpx.TimeoutException:
         return "Request is being processed. This may take a while..."
+    except (QueueFull, CircuitOpenError) as e:
+        return busy_reply(e)
+    except Exception as e:
+        return f"Error communicating with OpenCode server: {str(e)}"
+    finally:
+        if follower is not None:
+            follower.cancel()
+
+
+async def submit_to_opencode(
+    db_session: Session,
+    chat_id: int,
+    user_message: str,
+    on_text: Optional[Callable[[str], None]] = None,
+    on_queued: Optional[Callable[[int], None]] = None
+) -> Optional[str]:
+    """Send a prompt with prompt_async and wait up to OPENCODE_MESSAGE_TIMEOUT for the reply.
+
+    Returns None if the agent is still working by then: the worker moves
+    on and agent_runs sends the reply to the chat once it is ready. The
+    OpenCode slot is only held until the prompt is accepted.
+    """
+    session_id = db_session.opencode_session_id
+    follower = None
+    try:
+        with span("opencode.message", session_id=session_id), OPENCODE_LATENCY.labels("message").time():
+            async with dispatcher.opencode_slot(on_queued):
+                if on_text is not None:
+                    follower = await start_session_follower(session_id, on_text)
+                run = await agent_runs.submit(db_session.id, session_id, chat_id, user_message)
+            return await agent_runs.wait(run, config.OPENCODE_MESSAGE_TIMEOUT)
+    except (QueueFull, CircuitOpenError) as e:
+        return busy_reply(e)
     except Exception as e:
         return f"Error communicating with OpenCode server: {str(e)}"
+    finally:
+        if follower is not None:
+            follower.cancel()
+
+
+async def ask_opencode(
+    db_session: Session,
+    chat_id: int,
+    user_message: str,
+    on_text: Optional[Callable[[str], None]] = None,
+    on_queued: Optional[Callable[[int], None]] = None
+) -> str:
+    """Get the agent's reply to a chat message, or a note that it will follow later."""
+    if not config.OPENCODE_ASYNC_RUNS:
+        return await send_message_to_opencode(db_session.opencode_session_id, user_message, on_text, on_queued)
+    response = await submit_to_opencode(db_session, chat_id, user_message, on_text, on_queued)
+    if response is None:
+        return "Still working on this. I'll send the result here when it's done."
+    return response
+
+
+def busy_reply(error: Exception) -> str:
+    """Count a message turned away by admission control and tell the user why."""
+    if isinstance(error, CircuitOpenError):
+        ADMISSION_REJECTED.labels("opencode_unavailable").inc()
+        return "The agent server is unavailable right now. Please try again in a few minutes."
+    ADMISSION_REJECTED.labels(f"{error.queue}_queue_full").inc()
+    if error.queue == "chat":
+        return (
+            f"You already have {error.limit} messages waiting, so I skipped this one. "
+            "Send it again once the agent has answered."
+        )
+    if error.queue == "runs":
+        return (
+            f"The agent is already working on {error.limit} requests. "
+            "Please try again once some of them are done."
+        )
+    return (
+        f"The agent is busy: {error.limit} requests are already queued. "
+        "Please try again in a few minutes."
+    )
+
+
+async def reject_update(data: dict):
+    """Tell a chat its update was turned away because the chat's queue is full."""
+    text = busy_reply(QueueFull("chat", config.CHAT_MAX_QUEUED))
+    try:
+        if "callback_query" in data:
+            await telegram_request(
+                "answerCallbackQuery",
+                {"callback_query_id": data["callback_query"].get("id"), "text": "Busy, please try again shortly."},
+                PRIORITY_INTERACTIVE
+            )
+        elif "message" in data:
+            await send_telegram_message(data["message"]["chat"]["id"], text, markdown=False)
+    except Exception as e:
+        print(f"[Admission] Failed to send busy reply for update {data.get('update_id')}: {e}")
+
+
+async def start_session_follower(session_id: str, on_text: Callable[[str], None]) -> Optional[Subscription]:
+    """Subscribe to the session's streamed output. Returns None if the event stream is unavailable."""
+    if not event_bus.connected.is_set():
+        return None
+    return event_bus.subscribe(session_id, SessionTextFollower(on_text))
+
+
+async def notify_agent_event(chat_id: int, event: dict):
+    """Tell a chat about an OpenCode event that needs the user (question, permission, error)."""
+    if event.get("type") == "session.error":
+        error = (event.get("properties") or {}).get("error") or {}
+        if error.get("name") == "MessageAbortedError":
+            return
+        message = (error.get("data") or {}).get("message") or error.get("name") or "unknown error"
+        await send_telegram_message(chat_id, f"The agent reported an error: {message}", markdown=False)
+        return
+    decision = parse_decision(chat_id, event)
+    if decision is not None:
+        await decisions.ask(decision)
+
+
+async def handle_callback_query(query: dict):
+    """Handle a pressed inline button, e.g. the answer to an agent's question."""
+    from_user = query.get("from", {})
+    user = await get_or_create_user(
+        telegram_id=from_user.get("id"),
+        username=from_user.get("username"),
+        first_name=from_user.get("first_name"),
+        last_name=from_user.get("last_name")
+    )
+    if not is_user_allowed(user):
+        text = "Sorry, you're not authorized to use this bot."
+    elif query.get("data", "").startswith(CALLBACK_PREFIX):
+        text = await decisions.answer(query)
+    else:
+        text = "This button is no longer supported."
+    # Not a chat message, so it doesn't count against the chat's rate limit
+    await telegram_request(
+        "answerCallbackQuery", {"callback_query_id": query.get("id"), "text": text}, PRIORITY_INTERACTIVE
+    )
 
 
 # Command handlers
@@ -174,6 +566,7 @@ async def cmd_start(chat_id: int, user: User):
         "Welcome! I'm your AI coding assistant.\n\n"
         "Commands:\n"
         "/newproject <name> - Create a new project\n"
+        "/templates - List project templates\n"
         "/projects - List your projects\n"
         "/sessions - List your sessions\n"
         "/newsession - Start a fresh session\n"
@@ -188,6 +581,8 @@ async def cmd_help(chat_id: int, user: User):
     help_text = (
         "*Available Commands:*\n\n"
         "/newproject <name> - Create a new project with git repo\n"
+        "/newproject <name> --template <t> - Create a project from a template\n"
+        "/templates - List available project templates\n"
         "/projects - List all your projects\n"
         "/sessions - List your recent sessions\n"
         "/newsession - Start a fresh conversation\n"
@@ -247,14 +642,25 @@ async def cmd_newproject(chat_id: int, user: User, args: str):
     if not args.strip():
         await send_telegram_message(
             chat_id,
-            "Please provide a project name.\n\nUsage: /newproject my-awesome-app"
+            "Please provide a project name.\n\nUsage: /newproject my-awesome-app [--template fastapi]"
         )
         return
 
-    # Parse name and optional description
-    parts = args.strip().split(" ", 1)
-    name = parts[0]
-    description = parts[1] if len(parts) > 1 else None
+    # Parse name, optional description and optional --template <name>
+    tokens = args.split()
+    template = None
+    if "--template" in tokens:
+        idx = tokens.index("--template")
+        if idx + 1 >= len(tokens):
+            await send_telegram_message(chat_id, "Please name a template. Use /templates to list them.")
+            return
+        template = tokens[idx + 1]
+        del tokens[idx:idx + 2]
+    if not tokens:
+        await send_telegram_message(chat_id, "Please provide a project name.")
+        return
+    name = tokens[0]
+    description = " ".join(tokens[1:]) or None
 
     # Check if project exists
     existing = await get_project_by_name(user.id, name)
@@ -266,14 +672,17 @@ async def cmd_newproject(chat_id: int, user: User, args: str):
         return
 
     try:
-        await send_typing_action(chat_id)
-        project = await db_create_project(user.id, name, description)
+        with chat_actions.keep(chat_id):
+            project = await db_create_project(user.id, name, description, template)
+        # The next step is usually /project <name>, have a session ready for it
+        session_pool.warm(project.path)
 
+        origin = f"Cloned from the *{template}* template." if template else "Git repo initialized with initial commit."
         await send_telegram_message(
             chat_id,
             f"Project *{name}* created!\n\n"
             f"Path: `{project.path}`\n"
-            f"Git repo initialized with initial commit.\n\n"
+            f"{origin}\n\n"
             f"Use /project {name} to start working on it."
         )
 
@@ -304,12 +713,12 @@ async def cmd_project(chat_id: int, user: User, args: str):
     await deactivate_all_user_sessions(user.id)
 
     try:
-        await send_typing_action(chat_id)
-        session_id, _ = await get_or_create_opencode_session(
-            user,
-            project_id=project.id,
-            directory=project.path
-        )
+        with chat_actions.keep(chat_id):
+            session_id, _ = await get_or_create_opencode_session(
+                user,
+                project_id=project.id,
+                directory=project.path
+            )
 
         await send_telegram_message(
             chat_id,
@@ -322,6 +731,20 @@ async def cmd_project(chat_id: int, user: User, args: str):
         await send_telegram_message(chat_id, f"Failed to switch project: {str(e)}")
 
 
+async def cmd_templates(chat_id: int, user: User):
+    """Handle /templates command."""
+    templates = list_project_templates()
+
+    if not templates:
+        await send_telegram_message(chat_id, "No project templates are available.")
+        return
+
+    lines = ["*Project Templates:*\n"]
+    lines.extend(f"- {name}" for name in templates)
+    lines.append("\n_Use /newproject <name> --template <template>_")
+    await send_telegram_message(chat_id, "\n".join(lines))
+
+
 # Command router
 COMMANDS = {
     "/start": (cmd_start, False),
@@ -329,6 +752,7 @@ COMMANDS = {
     "/sessions": (cmd_sessions, False),
     "/newsession": (cmd_newsession, False),
     "/projects": (cmd_projects, False),
+    "/templates": (cmd_templates, False),
     "/newproject": (cmd_newproject, True),  # requires args
     "/project": (cmd_project, True),  # requires args
 }
@@ -351,21 +775,38 @@ async def handle_command(chat_id: int, user: User, text: str) -> bool:
     return False
 
 
-@app.post("/webhook")
-async def telegram_webhook(request: Request):
-    """Handle incoming Telegram webhook updates."""
-    try:
-        data = await request.json()
+def update_lane_key(data: dict):
+    """Dispatcher lane for an update: its chat, so each chat is processed in order."""
+    chat_id = update_chat_id(data)
+    if chat_id is not None:
+        return chat_id
+    return ("update", data.get("update_id"))
+
 
-        # Extract message info
-        if "message" not in data:
-            return {"status": "ok"}
+async def process_update(data: dict):
+    """Process a single Telegram update. Raises on failure so the job is retried."""
+    chat_id = update_lane_key(data)
+    with UPDATES_IN_FLIGHT.track_inprogress(), UPDATE_LATENCY.time():
+        with start_trace("update", update_id=data.get("update_id"), chat_id=chat_id):
+            await handle_update(data)
 
-        message = data["message"]
-        chat_id = message["chat"]["id"]
-        from_user = message.get("from", {})
 
-        # Get or create user
+async def handle_update(data: dict):
+    """Route one update to a command handler or the user's OpenCode session."""
+    if "callback_query" in data:
+        await handle_callback_query(data["callback_query"])
+        return
+
+    # Extract message info
+    if "message" not in data:
+        return
+
+    message = data["message"]
+    chat_id = message["chat"]["id"]
+    from_user = message.get("from", {})
+
+    # Get or create user
+    with span("user_resolution"):
         user = await get_or_create_user(
             telegram_id=from_user.get("id", chat_id),
             username=from_user.get("username"),
@@ -373,62 +814,252 @@ async def telegram_webhook(request: Request):
             last_name=from_user.get("last_name")
         )
 
-        # Check if user is allowed
-        if not is_user_allowed(user):
-            await send_telegram_message(
-                chat_id,
-                "Sorry, you're not authorized to use this bot. Contact the administrator."
-            )
-            return {"status": "ok"}
+    # Check if user is allowed
+    if not is_user_allowed(user):
+        await send_telegram_message(
+            chat_id,
+            "Sorry, you're not authorized to use this bot. Contact the administrator."
+        )
+        return
 
-        # Handle text messages only
-        if "text" not in message:
-            await send_telegram_message(chat_id, "Please send a text message.")
-            return {"status": "ok"}
+    # Handle text messages only
+    if "text" not in message:
+        await send_telegram_message(chat_id, "Please send a text message.")
+        return
 
-        user_message = message["text"]
-        print(f"[Telegram] Received from {user.username or user.telegram_id}: {user_message[:100]}")
+    user_message = message["text"]
+    print(f"[Telegram] Received from {user.username or user.telegram_id}: {user_message[:100]}")
 
-        # Handle commands
-        if user_message.startswith("/"):
+    # Handle commands
+    if user_message.startswith("/"):
+        with span("command", command=user_message.split()[0].split("@")[0]):
             handled = await handle_command(chat_id, user, user_message)
-            if handled:
-                return {"status": "ok"}
-            # Unknown command
-            await send_telegram_message(chat_id, "Unknown command. Use /help to see available commands.")
-            return {"status": "ok"}
+        if handled:
+            return
+        # Unknown command
+        await send_telegram_message(chat_id, "Unknown command. Use /help to see available commands.")
+        return
 
-        # Send typing indicator
-        await send_typing_action(chat_id)
+    # Show "typing..." until the reply is ready, refreshed while the agent works
+    with chat_actions.keep(chat_id):
+        response, streamer = await answer_message(chat_id, user, user_message)
+    if response is None:
+        return
+    print(f"[OpenCode] Response for {user.telegram_id}: {response[:100]}...")
 
-        # Get or create session
-        try:
+    # Send response back to user
+    if streamer is not None:
+        await streamer.finish(response)
+    else:
+        await send_telegram_message(chat_id, response)
+
+
+async def answer_message(
+    chat_id: int,
+    user: User,
+    user_message: str
+) -> Tuple[Optional[str], Optional[TelegramMessageStreamer]]:
+    """Get the agent's reply to a chat message.
+
+    Returns the reply and, with STREAM_RESPONSES, the streamer whose
+    placeholder it replaces. The reply is None if the user was already
+    told why there is none.
+    """
+    # Fail fast while OpenCode is known to be down
+    if opencode_breaker.is_open():
+        await send_telegram_message(chat_id, busy_reply(CircuitOpenError("OpenCode is unavailable")), markdown=False)
+        return None, None
+
+    # Get or create session
+    try:
+        with span("session_lookup"):
             session_id, db_session = await get_or_create_opencode_session(user)
-        except Exception as e:
-            await send_telegram_message(chat_id, f"Failed to initialize session: {str(e)}")
-            return {"status": "error", "message": str(e)}
+    except (QueueFull, CircuitOpenError) as e:
+        await send_telegram_message(chat_id, busy_reply(e), markdown=False)
+        return None, None
+    except Exception as e:
+        await send_telegram_message(chat_id, f"Failed to initialize session: {str(e)}")
+        return None, None
 
-        # Update session activity
-        await update_session_activity(db_session.id)
+    # One prompt at a time per session: a long run keeps the session busy
+    if config.OPENCODE_ASYNC_RUNS and await get_running_agent_run(session_id) is not None:
+        await send_telegram_message(
+            chat_id,
+            "The agent is still working on your previous request. I'll send the result "
+            "here when it's done. Use /newsession to start something else meanwhile."
+        )
+        return None, None
+
+    # Update session activity
+    await update_session_activity(db_session.id)
+
+    if config.STREAM_RESPONSES:
+        # Show a placeholder right away and edit it as the agent's output streams in
+        streamer = TelegramMessageStreamer(chat_id, config.STREAM_EDIT_INTERVAL)
+        await streamer.start(config.STREAM_PLACEHOLDER)
+        with span("opencode"):
+            response = await ask_opencode(
+                db_session, chat_id, user_message,
+                on_text=streamer.update,
+                on_queued=lambda position: streamer.update(queue_notice(position))
+            )
+        return response, streamer
 
-        # Send message to OpenCode server
-        response = await send_message_to_opencode(session_id, user_message)
-        print(f"[OpenCode] Response for {user.telegram_id}: {response[:100]}...")
+    def on_queued(position: int):
+        # Called from inside the wait for a slot, so the notice is sent alongside it
+        spawn(send_queue_notice(chat_id, position))
 
-        # Send response back to user
-        await send_telegram_message(chat_id, response)
+    # Send message to OpenCode server
+    with span("opencode"):
+        return await ask_opencode(db_session, chat_id, user_message, on_queued=on_queued), None
+
+
+def queue_notice(position: int) -> str:
+    return f"The agent is busy. Your message is number {position} in the queue."
+
+
+async def send_queue_notice(chat_id: int, position: int):
+    try:
+        await send_telegram_message(chat_id, queue_notice(position), markdown=False)
+    except Exception as e:
+        print(f"[Admission] Failed to send queue notice to chat {chat_id}: {e}")
+
+
+@app.post("/webhook")
+async def telegram_webhook(request: Request):
+    """Persist the incoming update and acknowledge it immediately.
 
-        return {"status": "ok"}
+    Redeliveries of an already accepted update_id are dropped here, before
+    any work is enqueued.
+    """
+    with WEBHOOK_IN_FLIGHT.track_inprogress(), WEBHOOK_LATENCY.time():
+        return await accept_update(request)
 
+
+async def accept_update(request: Request):
+    """Store one webhook update and wake the replica that owns its chat."""
+    rejected = []
+    try:
+        data = await request.json()
+        job_id = await enqueue_update(data, rejected)
     except Exception as e:
-        print(f"Error processing webhook: {e}")
-        return {"status": "error", "message": str(e)}
+        print(f"Error enqueueing webhook update: {e}")
+        # Non-2xx makes Telegram redeliver the update later
+        raise HTTPException(status_code=500, detail="Failed to enqueue update")
+
+    if rejected:
+        spawn(reject_update(data))
+        return {"status": "ok", "rejected": True}
+    if job_id is None:
+        print(f"[Telegram] Dropped duplicate update {data.get('update_id')}")
+        return {"status": "ok", "duplicate": True}
+
+    mark_received(data.get("update_id"))
+    key = chat_key(data)
+    if cluster.is_local(key):
+        notify_job_workers()
+    else:
+        cluster.wake(cluster.owner_of(key))
+    return {"status": "ok"}
+
+
+@app.post("/internal/wake")
+async def internal_wake(request: Request):
+    """Another replica stored an update for a chat this replica owns."""
+    if config.CLUSTER_TOKEN and not cluster.check_token(request.headers.get("x-cluster-token", "")):
+        raise HTTPException(status_code=403, detail="Forbidden")
+    notify_job_workers()
+    return {"status": "ok"}
 
 
 @app.get("/health")
 async def health_check():
-    """Health check endpoint."""
-    return {"status": "healthy"}
+    """Liveness, with the OpenCode circuit breaker and admission queue state.
+
+    Always 200: restarting this pod doesn't help an unhealthy upstream.
+    """
+    opencode = dispatcher.stats()["opencode"]
+    return {
+        "status": "healthy" if opencode_breaker.state == CLOSED else "degraded",
+        "opencode_breaker": opencode_breaker.stats(),
+        "opencode_queue": {"waiting": opencode["waiting"], "max_queued": opencode["max_queued"]},
+    }
+
+
+@app.get("/ready")
+async def readiness_check():
+    """Readiness: 503 unless the database answers.
+
+    Only local health counts. While OpenCode is down or saturated the pod
+    still has to receive updates, to answer commands and turn messages
+    away with a "busy" reply.
+    """
+    try:
+        await asyncio.wait_for(ping_db(), config.READY_DB_TIMEOUT)
+    except Exception as e:
+        print(f"[Health] Database check failed: {e!r}")
+        raise HTTPException(status_code=503, detail="Database unavailable")
+    return {"status": "ready"}
+
+
+@app.get("/stats")
+async def stats():
+    """Job queue and dispatcher statistics."""
+    return {
+        "pending_jobs": await count_pending_jobs(),
+        "dispatcher": dispatcher.stats(),
+        "telegram_outbound": outbound.stats(),
+        "session_pool": session_pool.stats(),
+        "ingress": {
+            "mode": config.INGRESS_MODE,
+            **(app.state.poller.stats() if config.INGRESS_MODE == "polling" else {}),
+        },
+        "agent_runs": agent_runs.stats(),
+        "background_tasks": background_stats(),
+        "opencode_events": event_bus.stats(),
+        "decisions": decisions.stats(),
+        "opencode_breaker": opencode_breaker.stats(),
+        "chat_actions": chat_actions.stats(),
+        "markdown": markdown_renderer.stats(),
+        "tracing": trace_exporter.stats(),
+        "cluster": cluster.stats(),
+        "updates": {
+            **dedup_stats,
+            "duplicate_rate": round(dedup_stats["duplicates"] / dedup_stats["received"], 4)
+            if dedup_stats["received"] else 0.0,
+        },
+    }
+
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus metrics."""
+    dispatcher_stats = dispatcher.stats()
+    QUEUE_DEPTH.labels("pending_jobs").set(await count_pending_jobs())
+    QUEUE_DEPTH.labels("dispatcher_lanes").set(dispatcher_stats["queued"])
+    QUEUE_DEPTH.labels("opencode_waiting").set(dispatcher_stats["opencode"]["waiting"])
+    QUEUE_DEPTH.labels("telegram_outbound").set(outbound.stats()["waiting"])
+    QUEUE_DEPTH.labels("agent_runs").set(await count_running_agent_runs())
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+
+@app.get("/debug/profile", response_class=PlainTextResponse)
+async def profile_event_loop(request: Request, seconds: float = 10.0):
+    """Sample the event loop for `seconds` and return collapsed stacks.
+
+    Requires the X-Admin-Token header to match ADMIN_TOKEN; disabled when
+    ADMIN_TOKEN is unset.
+    """
+    if not config.ADMIN_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    token = request.headers.get("x-admin-token", "")
+    if not hmac.compare_digest(token.encode(), config.ADMIN_TOKEN.encode()):
+        raise HTTPException(status_code=403, detail="Forbidden")
+    if profiler.busy:
+        raise HTTPException(status_code=409, detail="A profile is already being captured")
+    seconds = max(0.1, min(seconds, config.PROFILE_MAX_SECONDS))
+    print(f"[Debug] Capturing {seconds:.1f}s event loop profile")
+    return await profiler.capture(seconds)
 
 
 if __name__ == "__main__":
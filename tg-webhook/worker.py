@@ -0,0 +1,196 @@
+import asyncio
+import time
+from typing import Awaitable, Callable, Hashable, Optional, Set
+
+from config import config
+from dispatcher import ChatDispatcher, dispatcher
+from metrics import JOB_OUTCOMES
+from sharding import cluster
+from db import (
+    Job,
+    claim_next_job,
+    complete_job,
+    retry_job,
+    fail_job,
+    touch_jobs,
+    requeue_running_jobs,
+)
+
+
+JobHandler = Callable[[dict], Awaitable[None]]
+LaneKey = Callable[[dict], Hashable]
+
+
+class JobWorkerPool:
+    """Drains the SQLite-backed job table into per-chat dispatcher lanes.
+
+    A single claimer takes jobs in enqueue order and hands each one to the
+    lane returned by `lane_key`, so updates from one chat run in order while
+    different chats run in parallel. A chat's next job is only claimable
+    once its previous one is done, so the claimer is woken whenever a job
+    ends. At most `max_in_flight` claimed jobs are held in memory at once.
+    A chat's backlog is capped when updates are enqueued (CHAT_MAX_QUEUED).
+    On a shared database, the jobs being run are touched every third of
+    JOB_STALE_AFTER, so other replicas don't take them for abandoned.
+    """
+
+    def __init__(
+        self,
+        handler: JobHandler,
+        lane_key: LaneKey,
+        dispatcher: ChatDispatcher,
+        max_in_flight: int,
+        max_attempts: int,
+        poll_interval: float,
+    ):
+        self.handler = handler
+        self.lane_key = lane_key
+        self.dispatcher = dispatcher
+        self.max_attempts = max_attempts
+        self.poll_interval = poll_interval
+        self._slots = asyncio.Semaphore(max_in_flight)
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._heartbeat: Optional[asyncio.Task] = None
+        self._running: Set[int] = set()
+        # On a shared database other replicas' running jobs are not ours to
+        # requeue; only jobs abandoned for JOB_STALE_AFTER seconds are
+        self.stale_after = config.JOB_STALE_AFTER if config.DB_BACKEND == "postgres" else None
+        self._last_recovery = time.monotonic()
+
+    async def start(self):
+        """Requeue jobs interrupted by a restart and start claiming."""
+        recovered = await requeue_running_jobs(self.stale_after)
+        if recovered:
+            print(f"[Jobs] Requeued {recovered} unfinished job(s) from previous run")
+        self._task = asyncio.create_task(self._run(), name="job-claimer")
+        if self.stale_after is not None:
+            self._heartbeat = asyncio.create_task(self._touch_running(), name="job-heartbeat")
+        print("[Jobs] Worker pool started")
+
+    async def stop(self):
+        """Stop claiming and cancel running jobs. They are requeued on next start."""
+        for task in (self._task, self._heartbeat):
+            if task is not None:
+                task.cancel()
+                await asyncio.gather(task, return_exceptions=True)
+        self._task = self._heartbeat = None
+        await self.dispatcher.stop()
+
+    def notify(self):
+        """Wake the claimer after a new job has been enqueued."""
+        self._wakeup.set()
+
+    async def _run(self):
+        while True:
+            await self._slots.acquire()
+            try:
+                job = await claim_next_job(cluster.owned_slots(), cluster.self_url)
+            except Exception as e:
+                print(f"[Jobs] Failed to claim job: {e}")
+                job = None
+
+            if job is None:
+                self._slots.release()
+                await self._recover_stale_jobs()
+                await self._wait_for_work()
+                continue
+
+            try:
+                key = self.lane_key(job.payload)
+            except Exception:
+                key = ("job", job.id)
+            self._running.add(job.id)
+            future = self.dispatcher.submit(key, lambda job=job: self._execute(job))
+            future.add_done_callback(lambda _, job_id=job.id: self._job_done(job_id))
+
+    def _job_done(self, job_id: int):
+        self._running.discard(job_id)
+        self._slots.release()
+        self.notify()
+
+    async def _touch_running(self):
+        """Keep the running jobs' updated_at fresh while they run, however long that is."""
+        while True:
+            await asyncio.sleep(self.stale_after / 3)
+            try:
+                await touch_jobs(list(self._running))
+            except Exception as e:
+                print(f"[Jobs] Failed to touch running jobs: {e}")
+
+    async def _recover_stale_jobs(self):
+        """Periodically requeue jobs abandoned by a replica that died mid-job."""
+        if self.stale_after is None or time.monotonic() - self._last_recovery < self.stale_after / 2:
+            return
+        self._last_recovery = time.monotonic()
+        try:
+            recovered = await requeue_running_jobs(self.stale_after)
+        except Exception as e:
+            print(f"[Jobs] Failed to requeue stale jobs: {e}")
+            return
+        if recovered:
+            print(f"[Jobs] Requeued {recovered} stale job(s)")
+
+    async def _wait_for_work(self):
+        self._wakeup.clear()
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+        except asyncio.TimeoutError:
+            pass
+
+    async def _execute(self, job: Job):
+        try:
+            await self.handler(job.payload)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+            if job.attempts >= self.max_attempts:
+                print(f"[Jobs] Job {job.id} failed permanently after {job.attempts} attempt(s): {error}")
+                await fail_job(job.id, error)
+                JOB_OUTCOMES.labels("failed").inc()
+            else:
+                delay = backoff_delay(job.attempts)
+                print(f"[Jobs] Job {job.id} failed (attempt {job.attempts}), retrying in {delay:.0f}s: {error}")
+                await retry_job(job.id, error, delay)
+                JOB_OUTCOMES.labels("retried").inc()
+            return
+        await complete_job(job.id)
+        JOB_OUTCOMES.labels("completed").inc()
+
+
+def backoff_delay(attempt: int) -> float:
+    """Exponential backoff capped at JOB_MAX_BACKOFF seconds."""
+    return min(config.JOB_BASE_BACKOFF * (2 ** (attempt - 1)), config.JOB_MAX_BACKOFF)
+
+
+_pool: Optional[JobWorkerPool] = None
+
+
+async def start_job_workers(handler: JobHandler, lane_key: LaneKey) -> JobWorkerPool:
+    """Create and start the process-wide worker pool."""
+    global _pool
+    _pool = JobWorkerPool(
+        handler,
+        lane_key,
+        dispatcher,
+        max_in_flight=config.JOB_MAX_IN_FLIGHT,
+        max_attempts=config.JOB_MAX_ATTEMPTS,
+        poll_interval=config.JOB_POLL_INTERVAL,
+    )
+    await _pool.start()
+    return _pool
+
+
+async def stop_job_workers():
+    """Stop the process-wide worker pool."""
+    global _pool
+    if _pool is not None:
+        await _pool.stop()
+        _pool = None
+
+
+def notify_job_workers():
+    """Wake the worker pool after enqueueing a job."""
+    if _pool is not None:
+        _pool.notify()